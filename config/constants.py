@@ -1,5 +1,3 @@
-import streamlit as st
-
 DEBUG_PRINT = True
 
 ISO_TIME_MINS = [5,10,15,20,25,30]
@@ -20,10 +18,30 @@ POP_UP_MAX_WIDTH_PX = 300
 DISPLAY_TAB_NAMES = ['Competition', 'Savills SS Score', 'Demographics', 'Data Summary']
 
 DEFAULT_STORE_NAME = 'Store Location'
-#### ORS => Needs to go to secrets
-ORS_API_KEY = st.secrets["ORS_API_KEY"]
+#### ORS => the key is in st.secrets under this name - read when the ORS client is first used
+ORS_API_KEY_SECRET = 'ORS_API_KEY'
 DISTANCE_NEAREST_ISO_M = 250
 
+# 'concurrent' splits the demographic overlays into chunks of iso bands run in a process pool -
+# 'sequential' runs them one after another in the script thread
+DEMO_PROCESSING_MODE = 'concurrent'
+DEMO_PROCESS_POOL_WORKERS = 4
+# Chunks smaller than this are not worth sending to a worker
+DEMO_MIN_BANDS_PER_CHUNK = 2
+
+# Demographic choropleths - prepared once per (metric, store, band)
+CHOROPLETH_N_CLASSES = 5
+CHOROPLETH_CMAP = 'viridis'
+# Display geometry is simplified at each of these tolerances (degrees - 0.0001 is ~10m)
+CHOROPLETH_LOD_TOLERANCES_DEG = [0.0001, 0.0005, 0.002]
+# The coarsest tolerance not larger than (map extent / this many px) is shown
+CHOROPLETH_LOD_TARGET_PX = 1000
+CHOROPLETH_COORD_PRECISION_DEG = 0.00001
+
+# Opt-in TopoJSON encoding of demographic and isochrone map layers (shared arcs, quantized coords)
+USE_TOPOJSON_LAYERS_DEFAULT = False
+TOPOJSON_QUANTIZATION = 100000
+
 
 # Popup settings for competition maps
 HTML_BODY_FONT_SIZE = 12
@@ -34,6 +52,12 @@ HTML_LINE_HEIGHT = 1.0 # This controls vertical space between lines smaller = ti
 
 ISO_TIME_MINS_COL = 'iso_time_mins'
 
+# Area (sqkm) of each whole zone of a base layer - added when the planar layers are built
+ZONE_AREA_COL = 'area_sqkm_orig'
+
+# Stable id of each SSDB store - SSDB updates (added / changed / removed stores) are keyed on it
+SSDB_ID_COL = 'store_id'
+
 
 class CRS:
     WGS84 = "EPSG:4326"
@@ -3,13 +3,13 @@ import streamlit as st
 
 from config.constants import (DEBUG_PRINT, 
                               DISPLAY_TAB_NAMES)
-from ui.display_ui import DisplayUI
-from ui.search_ui import SearchUI
 from ui.ssdb_uploader_ui import SSDBUploaderUI
 
 """This module is the main controller handling initial loading of data 
 and setting up of session states
 it also handles the instantiation and rendering of the uis for data display
+The search and display uis (and the map libraries they use) are only imported when first rendered
+so the SSDB uploader is shown without waiting for them
 """
 
 
@@ -56,6 +56,7 @@ class StorageAppController():
 
 
     def _render_outputs_view(self):
+        from ui.display_ui import DisplayUI
 
         self.display_ui = DisplayUI()
 
@@ -77,6 +78,7 @@ class StorageAppController():
 
 
     def _render_search_view(self):
+        from ui.search_ui import SearchUI
 
         self.search_ui = SearchUI()
 
@@ -4,8 +4,9 @@ import time
 
 from utils.session_state_utils import initialize_session_state
 from controllers.app_controller import StorageAppController
-from utils.load_save_data_files_utils import (load_data_files, 
-                                              get_savills_score_weightings)
+from utils.load_save_data_files_utils import (get_session_data_files, 
+                                              load_savills_score_weightings)
+from utils.asset_pipeline_utils import get_asset_version
 
 from config.constants import DEBUG_PRINT
 
@@ -41,10 +42,18 @@ def main():
     if "data" not in st.session_state:
         
         # This is loading the main spatial files - but not the ssdb
-        st.session_state.data = load_data_files()
-
-        # This loads the Savills self storage weights 
-        st.session_state.savills_score_weightings, st.session_state.weightings_dict = get_savills_score_weightings()
+        # The base layers are loaded once per server - the session only holds references
+        st.session_state.data = get_session_data_files()
+
+        # This loads the Savills self storage weights - compiled once and shared by every session
+        (st.session_state.savills_score_weightings,
+         st.session_state.weightings_dict,
+         st.session_state.compiled_weightings) = load_savills_score_weightings()
+
+        # The version of the built assets - None if they have not been built with utils.asset_pipeline_utils
+        st.session_state.asset_version = get_asset_version()
+        if DEBUG_PRINT:
+            print(f'****INFO asset version {st.session_state.asset_version}')
         # Show temporary success message
         msg = st.empty()
         msg.success("Data loaded successfully")
@@ -2,7 +2,7 @@ import streamlit as st
 import pandas as pd
 import geopandas as gpd
 
-from config.constants import DEBUG_PRINT, ISO_TIME_MINS
+from config.constants import DEBUG_PRINT, ISO_TIME_MINS, USE_TOPOJSON_LAYERS_DEFAULT
 from utils.search_map_utils import initialize_search_map_session_state
 
 class AppState:
@@ -39,6 +39,7 @@ class SessionStateManager:
         'gdf_demo': {},
         'output_competition': None,
         'df_demo_summ': None,
+        'use_topojson_layers': USE_TOPOJSON_LAYERS_DEFAULT,
     }
     
     @classmethod
@@ -194,7 +195,7 @@ def get_validated_gdf_from_app_data(gdf_name):
     if gdf_name == "gdf_competition":
         return SessionStateManager.get_gdf_competition()
     elif gdf_name in SessionStateManager.get_gdf_demo():
-        return SessionStateManager.get_gdf_demo()[gdf_name]
+        return SessionStateManager.get_gdf_demo()[gdf_name].view(gdf_name)
     else:
         return None
 
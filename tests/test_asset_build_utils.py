@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pytest
+from shapely.geometry import box
+
+import utils.asset_build_utils as asset_build_utils
+from utils.asset_build_utils import (project_values_with_crosswalk,
+                                     build_area_crosswalk,
+                                     save_asset_df,
+                                     read_asset_fingerprint,
+                                     get_msoa_crosswalk,
+                                     MSOA_11_ID_COL,
+                                     MSOA_21_ID_COL)
+from config.constants import CRS
+
+X0, Y0 = 4_000_000, 3_000_000
+
+
+def get_df_crosswalk():
+    """T1 is a quarter S1 and three quarters S2 - T2 is all S2"""
+    return pd.DataFrame({'target': ['T1', 'T1', 'T2'],
+                         'source': ['S1', 'S2', 'S2'],
+                         'weight': [0.25, 0.75, 1.0]})
+
+
+def get_projected(df_source, value_cols=('value',)):
+    df_projected = project_values_with_crosswalk(get_df_crosswalk(), df_source, 'source', 'target', list(value_cols))
+    return df_projected.set_index('target')
+
+
+def test_values_are_the_crosswalk_weighted_mean():
+    df_projected = get_projected(pd.DataFrame({'source': ['S1', 'S2'], 'value': [100.0, 200.0]}))
+    assert df_projected['value'].to_dict() == {'T1': 175.0, 'T2': 200.0}
+
+
+def test_sources_without_a_value_are_left_out_of_the_weighting():
+    df_projected = get_projected(pd.DataFrame({'source': ['S1', 'S2'], 'value': [100.0, np.nan]}))
+    assert df_projected.loc['T1', 'value'] == 100.0
+    # A target with no source value has no value
+    assert np.isnan(df_projected.loc['T2', 'value'])
+
+
+def test_sources_missing_from_the_source_layer_are_left_out():
+    df_projected = get_projected(pd.DataFrame({'source': ['S1'], 'value': [100.0]}))
+    assert df_projected.loc['T1', 'value'] == 100.0
+    assert np.isnan(df_projected.loc['T2', 'value'])
+
+
+def test_each_value_col_is_weighted_on_its_own_values():
+    df_source = pd.DataFrame({'source': ['S1', 'S2'], 'a': [100.0, np.nan], 'b': [10.0, 20.0]})
+    df_projected = get_projected(df_source, value_cols=('a', 'b'))
+    assert list(df_projected.columns) == ['a', 'b']
+    assert df_projected.loc['T1'].tolist() == [100.0, 17.5]
+
+
+def get_zones(id_col, boxes):
+    return gpd.GeoDataFrame({id_col: [f'Z{i}' for i in range(len(boxes))]},
+                            geometry=[box(*b) for b in boxes], crs=CRS.EUROPEAN_PLANAR)
+
+
+def test_area_crosswalk_weights_are_the_shares_of_each_target():
+    gdf_source = get_zones(MSOA_11_ID_COL, [(X0, Y0, X0 + 1_000, Y0 + 1_000),
+                                            (X0 + 1_000, Y0, X0 + 2_000, Y0 + 1_000)])
+    gdf_target = get_zones(MSOA_21_ID_COL, [(X0 + 500, Y0, X0 + 2_000, Y0 + 1_000)])
+    df_crosswalk = build_area_crosswalk(gdf_source, MSOA_11_ID_COL, gdf_target, MSOA_21_ID_COL)
+
+    weights = df_crosswalk.set_index(MSOA_11_ID_COL)['weight']
+    assert weights.sum() == pytest.approx(1)
+    assert weights['Z0'] == pytest.approx(1 / 3)
+    assert weights['Z1'] == pytest.approx(2 / 3)
+
+
+def test_saved_asset_keeps_its_source_fingerprint(tmp_path):
+    fpath = str(tmp_path / 'asset.parquet')
+    df = pd.DataFrame({'a': [1, 2]})
+    save_asset_df(df, fpath, 'abc')
+    assert read_asset_fingerprint(fpath) == 'abc'
+    pd.testing.assert_frame_equal(pd.read_parquet(fpath), df)
+    assert list(tmp_path.iterdir()) == [tmp_path / 'asset.parquet']
+
+
+def test_crosswalk_is_rebuilt_when_its_sources_change(tmp_path, monkeypatch):
+    monkeypatch.setattr(asset_build_utils, 'get_asset_path', lambda fname: str(tmp_path / fname))
+    gdf_msoa_20 = get_zones(MSOA_11_ID_COL, [(X0, Y0, X0 + 1_000, Y0 + 1_000)]).to_crs(CRS.WGS84)
+    gdf_msoa_22 = get_zones(MSOA_21_ID_COL, [(X0, Y0, X0 + 1_000, Y0 + 1_000)]).to_crs(CRS.WGS84)
+
+    builds = []
+    build_msoa_crosswalk = asset_build_utils.build_msoa_crosswalk
+    monkeypatch.setattr(asset_build_utils, 'build_msoa_crosswalk',
+                        lambda *args, **kwargs: builds.append(args) or build_msoa_crosswalk(*args, **kwargs))
+
+    get_msoa_crosswalk(gdf_msoa_20, gdf_msoa_22, 'v1')
+    get_msoa_crosswalk(gdf_msoa_20, gdf_msoa_22, 'v1')
+    assert len(builds) == 1
+    df_crosswalk = get_msoa_crosswalk(gdf_msoa_20, gdf_msoa_22, 'v2')
+    assert len(builds) == 2
+    assert read_asset_fingerprint(str(tmp_path / asset_build_utils.FNAME_MSOA_CROSSWALK)) == 'v2'
+    assert df_crosswalk['weight'].tolist() == pytest.approx([1.0])
@@ -0,0 +1,132 @@
+import os
+import pytest
+
+import utils.asset_pipeline_utils as asset_pipeline_utils
+from utils.asset_pipeline_utils import AssetArtifact, build_assets, get_asset_version
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Runs the pipeline in tmp_path - the manifest is written to the relative ASSET_MANIFEST_PATH"""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.dirname(asset_pipeline_utils.ASSET_MANIFEST_PATH))
+    for name in ('a', 'b'):
+        (tmp_path / f'in_{name}.txt').write_text(name)
+    return tmp_path
+
+
+@pytest.fixture
+def builds(workdir, monkeypatch):
+    """Three fake artifacts - a and b from their own input and a2 from the output of a
+    Returns the names of the artifacts built (in order)"""
+    builds = []
+
+    def get_artifact(name, fname_in, fname_out):
+        fpath_in, fpath_out = str(workdir / fname_in), str(workdir / fname_out)
+
+        def build():
+            builds.append(name)
+            with open(fpath_in) as f_in, open(fpath_out, 'w') as f_out:
+                f_out.write(f_in.read().upper() + name)
+
+        return AssetArtifact(name, 1, lambda: [fpath_in], lambda: [fpath_out], build)
+
+    artifacts = [get_artifact('a', 'in_a.txt', 'out_a.txt'),
+                 get_artifact('b', 'in_b.txt', 'out_b.txt'),
+                 get_artifact('a2', 'out_a.txt', 'out_a2.txt')]
+    monkeypatch.setattr(asset_pipeline_utils, 'ASSET_ARTIFACTS', artifacts)
+    monkeypatch.setattr(asset_pipeline_utils, 'ASSET_ARTIFACT_NAMES', [artifact.name for artifact in artifacts])
+    return builds
+
+
+def get_versions(manifest):
+    return {name: entry['version'] for name, entry in manifest['artifacts'].items()}
+
+
+def edit_file(fpath, text):
+    """Appends to a file - its size changes so its cached hash is not reused"""
+    with open(fpath, 'a') as f:
+        f.write(text)
+
+
+def test_first_build_builds_every_artifact_in_order(builds, workdir):
+    manifest = build_assets()
+    assert builds == ['a', 'b', 'a2']
+    # a2 is built from the output of a
+    assert (workdir / 'out_a2.txt').read_text() == 'AAa2'
+    assert sorted(manifest['artifacts']) == ['a', 'a2', 'b']
+    assert os.path.exists(asset_pipeline_utils.ASSET_MANIFEST_PATH)
+
+
+def test_rebuild_with_unchanged_inputs_is_a_no_op(builds, workdir):
+    manifest = build_assets()
+    mtimes = {fname: os.stat(workdir / fname).st_mtime_ns for fname in ('out_a.txt', 'out_b.txt', 'out_a2.txt')}
+    builds.clear()
+
+    manifest_rebuilt = build_assets()
+    assert builds == []
+    assert get_versions(manifest_rebuilt) == get_versions(manifest)
+    assert manifest_rebuilt['version'] == manifest['version']
+    assert {fname: os.stat(workdir / fname).st_mtime_ns for fname in mtimes} == mtimes
+
+
+def test_changed_input_rebuilds_only_its_dependents(builds, workdir):
+    versions = get_versions(build_assets())
+    builds.clear()
+
+    edit_file(workdir / 'in_b.txt', 'b')
+    versions_b = get_versions(build_assets())
+    assert builds == ['b']
+    assert {name for name in versions if versions_b[name] != versions[name]} == {'b'}
+
+    # a2 is built from the output of a - so it is rebuilt with it
+    builds.clear()
+    edit_file(workdir / 'in_a.txt', 'a')
+    versions_a = get_versions(build_assets())
+    assert builds == ['a', 'a2']
+    assert {name for name in versions if versions_a[name] != versions_b[name]} == {'a', 'a2'}
+
+
+def test_changed_output_is_rebuilt(builds, workdir):
+    build_assets()
+    builds.clear()
+    edit_file(workdir / 'out_b.txt', 'edited')
+    build_assets()
+    assert builds == ['b']
+
+
+def test_force_rebuilds_every_artifact(builds):
+    build_assets()
+    builds.clear()
+    build_assets(['b'], force=True)
+    assert builds == ['b']
+    build_assets(force=True)
+    assert builds == ['b', 'a', 'b', 'a2']
+
+
+def test_failed_build_is_left_out_of_the_manifest(builds, workdir):
+    build_assets()
+    builds.clear()
+    os.remove(workdir / 'in_b.txt')
+
+    manifest = build_assets()
+    assert sorted(manifest['artifacts']) == ['a', 'a2']
+    assert get_asset_version('b') is None
+    assert get_asset_version() is None
+
+
+def test_asset_version_follows_the_files_on_disk(builds, workdir):
+    assert get_asset_version('a') is None
+
+    versions = get_versions(build_assets())
+    assert get_asset_version('a') == versions['a']
+    assert get_asset_version() is not None
+
+    # A file replaced without running the build - the runtime falls back to hashing the files
+    edit_file(workdir / 'in_a.txt', 'a')
+    assert get_asset_version('a') is None
+    assert get_asset_version('b') == versions['b']
+    assert get_asset_version() is None
+
+    build_assets()
+    assert get_asset_version('a') not in (None, versions['a'])
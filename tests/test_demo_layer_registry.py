@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pytest
+from shapely.geometry import box
+
+from utils.demo_layer_registry import (DemoLayerSpec,
+                                       DemoColumn,
+                                       compute_demo_layer,
+                                       EXTENSIVE,
+                                       INTENSIVE,
+                                       DERIVED,
+                                       AREA_COL,
+                                       ZONE_ID_COL)
+from config.constants import CRS, ZONE_AREA_COL
+
+# Two 1 km square zones side by side in planar crs
+X0, Y0 = 4_000_000, 3_000_000
+
+SPEC = DemoLayerSpec('zones', 'gdf_zones', 'zones', [
+    DemoColumn('popn', EXTENSIVE, display_name='popn'),
+    DemoColumn('households', EXTENSIVE, in_summary=False),
+    DemoColumn('price', INTENSIVE, divisor=1_000, display_name='price'),
+    DemoColumn('hh_size', DERIVED, numerator='popn', denominator='households', decimals=2,
+               display_name='hh_size'),
+    DemoColumn('density', DERIVED, numerator='popn', denominator=AREA_COL, display_name='density'),
+], zone_id_col='zone_code')
+
+
+def get_gdf_base():
+    return gpd.GeoDataFrame({'zone_code': ['A', 'B'],
+                             'popn': [1_000, 2_000],
+                             'households': [400, 1_000],
+                             'price': [200_000, np.nan],
+                             ZONE_AREA_COL: [1.0, 1.0]},
+                            geometry=[box(X0, Y0, X0 + 1_000, Y0 + 1_000),
+                                      box(X0 + 1_000, Y0, X0 + 2_000, Y0 + 1_000)],
+                            crs=CRS.EUROPEAN_PLANAR)
+
+
+def get_gdf_isos(max_x_m):
+    """One iso covering zone A whole and zone B up to max_x_m"""
+    return gpd.GeoDataFrame({'storename': ['S'], 'iso_time_mins': [10]},
+                            geometry=[box(X0, Y0, X0 + max_x_m, Y0 + 1_000)],
+                            crs=CRS.EUROPEAN_PLANAR)
+
+
+def test_columns_aggregate_by_kind():
+    df_summary, _ = compute_demo_layer(SPEC, get_gdf_isos(1_500), get_gdf_base())
+    row = df_summary.iloc[0]
+
+    # Extensive counts are apportioned by the share of each zone captured - half of zone B
+    assert row['popn'] == 1_000 + 1_000
+    # Intensive values are the area weighted mean of the pieces with a value - zone B has none
+    assert row['price'] == 200
+    # Derived columns are ratios of the summed counts / area
+    assert row['hh_size'] == round(2_000 / (400 + 500), 2)
+    assert row['density'] == round(2_000 / 1.5)
+    # Columns not in the summary are left out
+    assert 'households' not in df_summary.columns
+    assert list(df_summary.columns[:2]) == ['storename', 'iso_time_mins']
+
+
+def test_pieces_carry_display_columns_and_whole_zone_ids():
+    _, gdf_display = compute_demo_layer(SPEC, get_gdf_isos(1_500), get_gdf_base())
+    gdf_display = gdf_display.sort_values('density').reset_index(drop=True)
+
+    assert gdf_display.crs.to_epsg() == 4326
+    # Display columns in spec order
+    assert list(gdf_display.columns) == ['storename', 'iso_time_mins', 'popn', 'price', 'hh_size', 'density',
+                                         ZONE_ID_COL, 'geometry']
+    # Counts shown on a piece are its apportioned share - derived values are those of the whole zone
+    assert gdf_display['popn'].tolist() == [1_000, 1_000]
+    assert gdf_display['hh_size'].tolist() == [2.5, 2.0]
+    assert gdf_display['density'].tolist() == [1_000, 2_000]
+    # Only the piece covering its whole zone keeps the zone id
+    assert gdf_display.loc[0, ZONE_ID_COL] == 'A'
+    assert pd.isna(gdf_display.loc[1, ZONE_ID_COL])
+
+
+def test_whole_coverage_matches_zone_totals():
+    df_summary, gdf_display = compute_demo_layer(SPEC, get_gdf_isos(2_000), get_gdf_base())
+    assert df_summary.iloc[0]['popn'] == 3_000
+    assert sorted(gdf_display[ZONE_ID_COL].tolist()) == ['A', 'B']
+
+
+def test_bands_are_summarised_separately():
+    gdf_isos = pd.concat([get_gdf_isos(1_000), get_gdf_isos(2_000).assign(iso_time_mins=20)], ignore_index=True)
+    df_summary, _ = compute_demo_layer(SPEC, gdf_isos, get_gdf_base())
+    assert df_summary.set_index('iso_time_mins')['popn'].to_dict() == {10: 1_000, 20: 3_000}
+
+
+def test_missing_base_columns_raise():
+    with pytest.raises(KeyError):
+        compute_demo_layer(SPEC, get_gdf_isos(1_500), get_gdf_base().drop(columns=['households']))
+
+
+def test_crs_mismatch_raises():
+    with pytest.raises(ValueError):
+        compute_demo_layer(SPEC, get_gdf_isos(1_500).to_crs(CRS.WGS84), get_gdf_base())
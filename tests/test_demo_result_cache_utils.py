@@ -0,0 +1,170 @@
+import os
+import time
+import pandas as pd
+import geopandas as gpd
+import pytest
+from shapely.geometry import box
+
+import utils.demo_result_cache_utils as demo_result_cache_utils
+import utils.load_save_data_files_utils as load_save_data_files_utils
+from utils.demo_result_cache_utils import (get_demo_cache_keys,
+                                           split_isos_by_cache,
+                                           merge_cached_and_computed,
+                                           save_demo_result_to_cache,
+                                           load_cached_demo_result,
+                                           prune_demo_cache,
+                                           DEMO_CACHE_TMP_MAX_AGE_S)
+from config.constants import CRS
+
+LAYER_KEY = 'msoa_22'
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """The cache in tmp_path with the planar layers at manifest version 'a'"""
+    cache_dir = tmp_path / 'demo_results'
+    monkeypatch.setattr(demo_result_cache_utils, 'DEMO_CACHE_DIR', str(cache_dir))
+    set_asset_version(monkeypatch, 'a' * 64)
+    return cache_dir
+
+
+def set_asset_version(monkeypatch, version):
+    monkeypatch.setattr(demo_result_cache_utils, 'get_asset_version', lambda artifact_name=None: version)
+
+
+def get_gdf_isos(storename='A', n_bands=2):
+    return gpd.GeoDataFrame({'storename': [storename] * n_bands,
+                             'iso_time_mins': [10 * (i + 1) for i in range(n_bands)]},
+                            geometry=[box(0, 0, i + 1, i + 1) for i in range(n_bands)],
+                            crs=CRS.EUROPEAN_PLANAR)
+
+
+def get_computed_outputs(gdf_isos):
+    """Stands in for compute_demo_layer - one summary row and one piece per band"""
+    df_computed = pd.DataFrame({'storename': gdf_isos['storename'].values,
+                                'iso_time_mins': gdf_isos['iso_time_mins'].values,
+                                'popn': gdf_isos.geometry.area.values})
+    gdf_computed = gpd.GeoDataFrame(df_computed.copy(), geometry=gdf_isos.geometry.to_crs(CRS.WGS84).values,
+                                    crs=CRS.WGS84)
+    return df_computed, gdf_computed
+
+
+def run_with_cache(gdf_isos):
+    """Looks up the bands, computes the misses and merges - returns (outputs, number of bands computed)"""
+    cache_keys, cached_results, gdf_isos_missed = split_isos_by_cache(LAYER_KEY, gdf_isos)
+    computed_outputs = get_computed_outputs(gdf_isos_missed) if not gdf_isos_missed.empty else None
+    return merge_cached_and_computed(cache_keys, cached_results, gdf_isos, computed_outputs), len(gdf_isos_missed)
+
+
+def test_cache_key_is_layer_version_geometry_and_fingerprint(cache_dir):
+    cache_key = get_demo_cache_keys(LAYER_KEY, get_gdf_isos(n_bands=1))[0]
+    layer_key, version, geometry_hash, fingerprint = cache_key.rsplit('_', 3)
+    assert layer_key == LAYER_KEY
+    assert version == f'v{demo_result_cache_utils.DEMO_CACHE_VERSION}'
+    assert len(geometry_hash) == 32
+    assert fingerprint == 'a' * 16
+
+
+def test_same_geometry_hits_the_cache(cache_dir):
+    (df_first, gdf_first), n_computed = run_with_cache(get_gdf_isos('A'))
+    assert n_computed == 2
+
+    # The same sites analysed under another store name are read from the cache
+    (df_second, gdf_second), n_computed = run_with_cache(get_gdf_isos('B'))
+    assert n_computed == 0
+    assert df_second['storename'].tolist() == ['B', 'B']
+    pd.testing.assert_frame_equal(df_second.drop(columns='storename'), df_first.drop(columns='storename'))
+    assert gdf_second.geometry.equals(gdf_first.geometry)
+
+
+def test_only_new_bands_are_computed(cache_dir):
+    run_with_cache(get_gdf_isos(n_bands=1))
+    (df_output, _), n_computed = run_with_cache(get_gdf_isos(n_bands=3))
+    assert n_computed == 2
+    # Cached and computed bands are merged in the row order of the isos
+    assert df_output['iso_time_mins'].tolist() == [10, 20, 30]
+
+
+def test_changed_base_fingerprint_misses_the_cache(cache_dir, monkeypatch):
+    run_with_cache(get_gdf_isos())
+    set_asset_version(monkeypatch, 'b' * 64)
+    assert run_with_cache(get_gdf_isos())[1] == 2
+
+
+def test_fingerprint_falls_back_to_the_source_files(cache_dir, tmp_path, monkeypatch):
+    # No manifest version (eg a data file replaced without running the build) - the source files are hashed
+    set_asset_version(monkeypatch, None)
+    for key in load_save_data_files_utils.PLANAR_LAYER_SOURCES[LAYER_KEY]:
+        (tmp_path / f'{key}.parquet').write_bytes(key.encode())
+    monkeypatch.setattr(load_save_data_files_utils, 'get_data_file_path', lambda key: str(tmp_path / f'{key}.parquet'))
+
+    gdf_isos = get_gdf_isos()
+    cache_keys = get_demo_cache_keys(LAYER_KEY, gdf_isos)
+    assert get_demo_cache_keys(LAYER_KEY, gdf_isos) == cache_keys
+    run_with_cache(gdf_isos)
+    assert run_with_cache(gdf_isos)[1] == 0
+
+    (tmp_path / 'la_rents.parquet').write_bytes(b'la_rents replaced')
+    assert get_demo_cache_keys(LAYER_KEY, gdf_isos) != cache_keys
+    assert run_with_cache(gdf_isos)[1] == 2
+
+
+def test_entries_are_written_atomically(cache_dir):
+    df_band, gdf_band = get_computed_outputs(get_gdf_isos(n_bands=1))
+    save_demo_result_to_cache('key', df_band, gdf_band)
+    assert sorted(os.listdir(cache_dir)) == ['key_gdf.parquet', 'key_summ.parquet']
+
+    # An entry without its summary (a write interrupted before the summary was renamed) is not read
+    os.remove(cache_dir / 'key_summ.parquet')
+    assert load_cached_demo_result('key', 'A', 10) is None
+
+
+def save_entries(cache_keys):
+    """Saves an entry for each key - the first is the least recently used"""
+    df_band, gdf_band = get_computed_outputs(get_gdf_isos(n_bands=1))
+    now = time.time()
+    for i, cache_key in enumerate(cache_keys):
+        save_demo_result_to_cache(cache_key, df_band, gdf_band)
+        last_used = now - 1_000 + i * 100
+        os.utime(os.path.join(demo_result_cache_utils.DEMO_CACHE_DIR, f'{cache_key}_summ.parquet'),
+                 (last_used, last_used))
+
+
+def get_cached_keys(cache_dir):
+    return sorted({fname.rsplit('_', 1)[0] for fname in os.listdir(cache_dir)})
+
+
+def get_cache_bytes(cache_dir):
+    return sum(fpath.stat().st_size for fpath in cache_dir.iterdir())
+
+
+def test_prune_evicts_the_oldest_entries_first(cache_dir):
+    save_entries(['k0', 'k1', 'k2', 'k3'])
+    entry_bytes = get_cache_bytes(cache_dir) // 4
+
+    assert prune_demo_cache(max_bytes=get_cache_bytes(cache_dir) - 1) == 1
+    assert get_cached_keys(cache_dir) == ['k1', 'k2', 'k3']
+    assert prune_demo_cache(max_bytes=entry_bytes + 1) == 2
+    assert get_cached_keys(cache_dir) == ['k3']
+
+
+def test_a_cache_hit_is_the_last_to_be_pruned(cache_dir):
+    save_entries(['k0', 'k1', 'k2'])
+    assert load_cached_demo_result('k0', 'A', 10) is not None
+
+    prune_demo_cache(max_bytes=get_cache_bytes(cache_dir) - 1)
+    assert get_cached_keys(cache_dir) == ['k0', 'k2']
+
+
+def test_prune_removes_stale_tmp_files(cache_dir):
+    save_entries(['k0'])
+    stale_tmp, fresh_tmp = cache_dir / 'k1_summ.parquet.stale.tmp', cache_dir / 'k1_summ.parquet.fresh.tmp'
+    for fpath in (stale_tmp, fresh_tmp):
+        fpath.write_bytes(b'partial')
+    stale = time.time() - DEMO_CACHE_TMP_MAX_AGE_S - 1
+    os.utime(stale_tmp, (stale, stale))
+
+    assert prune_demo_cache() == 0
+    # A fresh tmp file may be a write in progress in another session
+    assert not stale_tmp.exists() and fresh_tmp.exists()
+    assert (cache_dir / 'k0_summ.parquet').exists()
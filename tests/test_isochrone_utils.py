@@ -0,0 +1,43 @@
+from openrouteservice.exceptions import ApiError
+
+import utils.isochrone_utils as isochrone_utils
+
+RESPONSE = {'type': 'FeatureCollection', 'features': [{'type': 'Feature'}]}
+
+
+class StubClient:
+    """Stands in for an ors.Client - request returns response or raises it if it is an exception"""
+
+    def __init__(self, response):
+        self.response = response
+        self.requests = []
+
+    def request(self, url, params, **kwargs):
+        self.requests.append(url)
+        if isinstance(self.response, Exception):
+            raise self.response
+        return self.response
+
+
+class StubManager:
+    def __init__(self, client):
+        self.client = client
+        self.is_available = True
+
+
+def use_stub_client(monkeypatch, response):
+    stub_client = StubClient(response)
+    monkeypatch.setattr(isochrone_utils, 'get_ors_manager', lambda: StubManager(stub_client))
+    return stub_client
+
+
+def test_api_error_is_logged_and_returns_none(monkeypatch, capsys):
+    stub_client = use_stub_client(monkeypatch, ApiError(403, {'error': 'Quota exceeded'}))
+    assert isochrone_utils._get_isochrone_from_ors(51.5, -0.15) is None
+    assert stub_client.requests == ['/v2/isochrones/driving-car/geojson']
+    assert 'ORS API Error' in capsys.readouterr().out
+
+
+def test_valid_response_is_returned(monkeypatch):
+    use_stub_client(monkeypatch, RESPONSE)
+    assert isochrone_utils._get_isochrone_from_ors(51.5, -0.15) == RESPONSE
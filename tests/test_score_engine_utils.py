@@ -0,0 +1,158 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.load_save_data_files_utils import get_savills_score_weightings, FNAME_WEIGHTINGS
+from utils.score_engine_utils import (FactorScale,
+                                      compile_weightings,
+                                      get_weighted_scores,
+                                      get_overall_scores,
+                                      get_supply_factor_values,
+                                      SCORE_ROUNDING_MULTIPLE)
+
+"""Parity of the compiled scoring engine with the per-value algorithm it replaced
+(get_score_from_value and the weighting loop of render_score_table)"""
+
+WEIGHTINGS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                               'assets', 'data', FNAME_WEIGHTINGS)
+
+
+def baseline_score(df, value):
+    """get_score_from_value as it was - returns None where render_score_table left the factor out
+    (a value in a gap or NaN raised on the empty mask and the factor was skipped)"""
+    if value < df['Lower Bound'].min():
+        return df['Score'].iloc[0]
+    elif value > df['Upper Bound'].max():
+        return df['Score'].iloc[-1]
+    mask = (df['Lower Bound'] <= value) & (df['Upper Bound'] >= value)
+    try:
+        return df[mask]['Score'].iloc[0]
+    except IndexError:
+        return None
+
+
+def baseline_weighted_score(weight, unweighted_score):
+    return round((weight * unweighted_score) / SCORE_ROUNDING_MULTIPLE, 0) * SCORE_ROUNDING_MULTIPLE
+
+
+def assert_scores_match_baseline(df_scoring, values):
+    scores = FactorScale(df_scoring).score(values)
+    for value, score in zip(values, scores):
+        expected = baseline_score(df_scoring, value)
+        if expected is None:
+            assert np.isnan(score), f'{value} scored {score} - baseline left it out'
+        else:
+            assert score == expected, f'{value} scored {score} - baseline {expected}'
+
+
+def get_scoring_df(bounds, scores):
+    return pd.DataFrame({'Lower Bound': [lower for lower, _ in bounds],
+                         'Upper Bound': [upper for _, upper in bounds],
+                         'Score': scores})
+
+
+def get_probe_values(df_scoring):
+    """Every bound, the midpoints, values just either side of each bound and beyond both ends"""
+    bounds = np.unique(np.concatenate([df_scoring['Lower Bound'], df_scoring['Upper Bound']]).astype('float64'))
+    span = bounds[-1] - bounds[0]
+    eps = span * 1e-9
+    return np.concatenate([bounds, bounds - eps, bounds + eps, (bounds[:-1] + bounds[1:]) / 2,
+                           [bounds[0] - span, bounds[-1] + span]])
+
+
+@pytest.fixture(scope='module')
+def weightings():
+    df_weightings, weightings_dict = get_savills_score_weightings(WEIGHTINGS_PATH)
+    assert df_weightings is not None and weightings_dict
+    return df_weightings, weightings_dict
+
+
+def test_factor_scales_match_baseline_on_workbook(weightings):
+    _, weightings_dict = weightings
+    for df_scoring in weightings_dict.values():
+        assert_scores_match_baseline(df_scoring, get_probe_values(df_scoring))
+
+
+def test_shared_bound_takes_lower_band():
+    df_scoring = get_scoring_df([(0, 10), (10, 20), (20, 30)], [1, 2, 3])
+    assert FactorScale(df_scoring).score([10, 20]).tolist() == [1, 2]
+    assert_scores_match_baseline(df_scoring, [0, 10, 20, 30])
+
+
+def test_gap_between_bands_has_no_score():
+    df_scoring = get_scoring_df([(0, 10), (20, 30)], [1, 3])
+    scores = FactorScale(df_scoring).score([5, 15, 20, 10.000001, 19.999999])
+    assert scores[0] == 1 and scores[2] == 3
+    assert np.isnan(scores[[1, 3, 4]]).all()
+    assert_scores_match_baseline(df_scoring, [5, 15, 20, 10.000001, 19.999999])
+
+
+def test_values_beyond_the_bounds_are_clamped():
+    df_scoring = get_scoring_df([(5, 10), (10, 20)], [4, 9])
+    assert FactorScale(df_scoring).score([-1e9, 4.999, 20.001, 1e9]).tolist() == [4, 4, 9, 9]
+    assert_scores_match_baseline(df_scoring, [-1e9, 4.999, 20.001, 1e9])
+
+
+def test_nan_value_has_no_score():
+    df_scoring = get_scoring_df([(0, 10), (10, 20)], [1, 2])
+    assert np.isnan(FactorScale(df_scoring).score([np.nan])).all()
+    assert_scores_match_baseline(df_scoring, [np.nan])
+
+
+def test_compiled_weightings_match_baseline_score_table(weightings):
+    """The scored factors and weighted scores of a store / drive time as render_score_table built them"""
+    df_weightings, weightings_dict = weightings
+    compiled = compile_weightings(df_weightings, weightings_dict)
+    rng = np.random.default_rng(38)
+
+    factor_values = np.empty((50, len(compiled.factor_names)))
+    for i, name in enumerate(compiled.factor_names):
+        df_scoring = weightings_dict[name]
+        lower, upper = df_scoring['Lower Bound'].min(), df_scoring['Upper Bound'].max()
+        span = upper - lower
+        factor_values[:, i] = rng.uniform(lower - span * 0.1, upper + span * 0.1, len(factor_values))
+    factor_values[::7, 0] = np.nan
+
+    weighted_scores = get_weighted_scores(compiled.score(factor_values), compiled.weights)
+    overall_scores = get_overall_scores(weighted_scores)
+
+    for values, row_weighted_scores, overall_score in zip(factor_values, weighted_scores, overall_scores):
+        expected = []
+        for name, weight, value in zip(compiled.factor_names, compiled.weights, values):
+            score = baseline_score(weightings_dict[name], value)
+            expected.append(np.nan if score is None else baseline_weighted_score(weight, score))
+        np.testing.assert_array_equal(row_weighted_scores, expected)
+        assert overall_score == baseline_weighted_score(1, np.nansum(expected))
+
+
+def test_demand_factors_follow_weighting_sheet_order(weightings):
+    df_weightings, weightings_dict = weightings
+    compiled = compile_weightings(df_weightings, weightings_dict)
+    expected = [name for name, supply_demand in zip(df_weightings['Internal_Name'], df_weightings['Supply_Demand'])
+                if supply_demand != 'Supply' and name in weightings_dict]
+    assert compiled.demand_factor_names == expected
+    assert compiled.factor_names[len(expected):] == ['People_per_store', 'CLA_per_person']
+
+
+def test_supply_factor_values_match_baseline():
+    total_popn = np.array([120_000, 120_000, 0, np.nan, 50_000])
+    competition_cla = np.array([60_000, np.nan, 1_000, 1_000, 0])
+    competition_count = np.array([7, np.nan, 2, 2, 1])
+    values = get_supply_factor_values(total_popn, competition_cla, competition_count)
+
+    # People per store and CLA per person as render_score_table calculated them
+    assert values['People_per_store'][0] == round(120_000 / 7, 0)
+    assert values['CLA_per_person'][0] == round(60_000 / 120_000, 2)
+    assert values['People_per_store'][4] == 50_000 and values['CLA_per_person'][4] == 0
+
+
+def test_supply_factors_left_out_without_competition_or_population():
+    total_popn = np.array([120_000, 0, np.nan])
+    competition_cla = np.array([np.nan, 1_000, 1_000])
+    competition_count = np.array([np.nan, 2, 2])
+    values = get_supply_factor_values(total_popn, competition_cla, competition_count)
+
+    # A band with no competition has no competition summary - neither supply factor was scored
+    assert np.isnan(values['People_per_store']).all()
+    assert np.isnan(values['CLA_per_person']).all()
@@ -0,0 +1,63 @@
+import numpy as np
+import geopandas as gpd
+import shapely
+import pytest
+from shapely.geometry import box
+
+import utils.spatial_prefilter_utils as spatial_prefilter_utils
+from utils.spatial_prefilter_utils import get_prefilter_indices
+from utils.arrow_layer_utils import ArrowBaseLayer, write_arrow_layer
+from utils.load_save_data_files_utils import ZONE_BBOX_COLS
+from config.constants import CRS
+
+X0, Y0 = 4_000_000, 3_000_000
+
+
+@pytest.fixture
+def layer(tmp_path, monkeypatch):
+    """A 30 x 30 grid of 1 km zones - every other zone a triangle so its bounding box is not the zone"""
+    geoms = []
+    for i in range(30):
+        for j in range(30):
+            x, y = X0 + i * 1_000, Y0 + j * 1_000
+            geoms.append(box(x, y, x + 1_000, y + 1_000) if (i + j) % 2
+                         else shapely.Polygon([(x, y), (x + 1_000, y), (x, y + 1_000)]))
+    gdf_zones = gpd.GeoDataFrame({'zone_id': np.arange(len(geoms))}, geometry=geoms, crs=CRS.EUROPEAN_PLANAR)
+    gdf_zones[ZONE_BBOX_COLS] = gdf_zones.geometry.bounds.values
+    fpath = str(tmp_path / 'planar_zones.arrow')
+    write_arrow_layer(gdf_zones, fpath)
+    layer = ArrowBaseLayer(fpath)
+    monkeypatch.setattr(spatial_prefilter_utils, 'get_planar_arrow_layer', lambda key: layer)
+    return layer
+
+
+def get_gdf_isos(n_isos, seed=45):
+    rng = np.random.default_rng(seed)
+    centres = rng.uniform([X0 - 2_000, Y0 - 2_000], [X0 + 32_000, Y0 + 32_000], (n_isos, 2))
+    radii = rng.uniform(100, 3_000, n_isos)
+    return gpd.GeoDataFrame(geometry=shapely.buffer(shapely.points(centres), radii), crs=CRS.EUROPEAN_PLANAR)
+
+
+def get_expected_indices(layer, gdf_isos):
+    """Zones that intersect any iso bounding box - tested one zone at a time"""
+    iso_boxes = shapely.union_all(shapely.box(*gdf_isos.geometry.bounds.values.T))
+    zones = layer.take(np.arange(len(layer))).geometry.values
+    return np.flatnonzero(shapely.intersects(zones, iso_boxes))
+
+
+@pytest.mark.parametrize('n_isos', [1, 7, 150])
+def test_prefilter_matches_the_zones_intersecting_the_iso_boxes(layer, monkeypatch, n_isos):
+    # Small blocks so the isos are compared over several broadcasts
+    monkeypatch.setattr(spatial_prefilter_utils, 'PREFILTER_ISO_BLOCK', 16)
+    gdf_isos = get_gdf_isos(n_isos)
+    idx, gdf_subset = get_prefilter_indices('zones', gdf_isos)
+
+    np.testing.assert_array_equal(idx, get_expected_indices(layer, gdf_isos))
+    assert gdf_subset.index.tolist() == idx.tolist()
+    assert gdf_subset['zone_id'].tolist() == idx.tolist()
+
+
+def test_iso_outside_the_layer_keeps_no_zones(layer):
+    gdf_isos = gpd.GeoDataFrame(geometry=[box(X0 - 5_000, Y0 - 5_000, X0 - 4_000, Y0 - 4_000)], crs=CRS.EUROPEAN_PLANAR)
+    idx, gdf_subset = get_prefilter_indices('zones', gdf_isos)
+    assert len(idx) == 0 and gdf_subset.empty
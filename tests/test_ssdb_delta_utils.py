@@ -0,0 +1,144 @@
+import pandas as pd
+import geopandas as gpd
+import pytest
+from shapely.geometry import box
+
+import utils.competition_utils as competition_utils
+from utils.competition_utils import get_competition_ssdb_cols, get_competition_in_isochrones, get_competition_isos_from_ss
+from utils.ssdb_ingest_utils import add_store_ids, normalize_ssdb_chunk
+from utils.ssdb_delta_utils import (get_ssdb_delta,
+                                    apply_delta_to_ssdb,
+                                    apply_delta_to_competition,
+                                    DELTA_ACTION_COL,
+                                    DELTA_ADD,
+                                    DELTA_CHANGE,
+                                    DELTA_REMOVE)
+from utils.load_save_data_files_utils import get_gdf_ssdb_from_df
+from config.constants import SSDB_ID_COL, CRS
+
+LAT0, LON0 = 51.5, -0.15
+
+
+def get_store_rows(indices, lon_offset=0.0):
+    """Stores spaced 0.01 deg east of LON0 - the isos below hold the first 3 (10 mins) and first 6 (20 mins)"""
+    return pd.DataFrame({'storename': [f'Store {i}' for i in indices],
+                         'address': [f'{i} High Street' for i in indices],
+                         'city': ['London'] * len(indices),
+                         'latitude': [LAT0] * len(indices),
+                         'longitude': [LON0 + 0.005 + i / 100 + lon_offset for i in indices],
+                         'ss_type': ['Self Storage'] * len(indices),
+                         'area_unit': ['sqft'] * len(indices),
+                         'store_cla': [40_000.0 + i for i in indices],
+                         'store_mla': [50_000.0 + i for i in indices]})
+
+
+def get_gdf_ssdb(df_ssdb):
+    """The SSDB as the ingest saves it"""
+    return get_gdf_ssdb_from_df(add_store_ids(normalize_ssdb_chunk(df_ssdb)).reset_index(drop=True))
+
+
+def get_gdf_isos():
+    return gpd.GeoDataFrame({'storename': ['Subject', 'Subject'],
+                             'iso_time_mins': [10, 20],
+                             'latitude': [LAT0, LAT0],
+                             'longitude': [LON0, LON0]},
+                            geometry=[box(LON0, LAT0 - 0.01, LON0 + 0.03, LAT0 + 0.01),
+                                      box(LON0, LAT0 - 0.01, LON0 + 0.06, LAT0 + 0.01)],
+                            crs=CRS.WGS84)
+
+
+def build_competition(gdf_ssdb):
+    """The competition built from scratch as process_competition_with_isochrones does"""
+    return get_competition_in_isochrones(get_competition_ssdb_cols(gdf_ssdb), get_competition_isos_from_ss())
+
+
+def get_comparable(gdf, sort_cols=(SSDB_ID_COL, 'iso_time_mins')):
+    """Returns df of gdf with the geometry as wkt in a fixed row order"""
+    df = pd.DataFrame(gdf.drop(columns='geometry'))
+    df['wkt'] = gdf.geometry.to_wkt()
+    return df.sort_values(list(sort_cols)).reset_index(drop=True)
+
+
+@pytest.fixture(autouse=True)
+def store_isos(monkeypatch):
+    # The isos of the processed locations - read from session_state in the app
+    monkeypatch.setattr(competition_utils, 'get_store_isos_from_ss', get_gdf_isos)
+
+
+def get_delta_rows(df_rows, action):
+    return df_rows.assign(**{DELTA_ACTION_COL: action})
+
+
+def test_delta_matches_a_full_rebuild():
+    gdf_ssdb = get_gdf_ssdb(get_store_rows(range(8)))
+    gdf_competition = build_competition(gdf_ssdb)
+    store_ids = gdf_ssdb.set_index('storename')[SSDB_ID_COL]
+
+    # Store 1 moves out of the 10 min iso (same address), store 4 is removed and store 20 is added inside both isos
+    df_changed = get_store_rows([1], lon_offset=0.03).assign(**{SSDB_ID_COL: store_ids['Store 1']})
+    df_removed = pd.DataFrame({SSDB_ID_COL: [store_ids['Store 4']]})
+    df_added = get_store_rows([20], lon_offset=-0.19)
+    df_added[SSDB_ID_COL] = add_store_ids(df_added.copy())[SSDB_ID_COL]
+    df_delta = pd.concat([get_delta_rows(df_changed, DELTA_CHANGE),
+                          get_delta_rows(df_removed, DELTA_REMOVE),
+                          get_delta_rows(df_added, f' {DELTA_ADD.upper()} ')], ignore_index=True)
+    ssdb_delta = get_ssdb_delta(df_delta)
+    assert len(ssdb_delta) == 3
+
+    gdf_ssdb_updated, gdf_old = apply_delta_to_ssdb(gdf_ssdb, ssdb_delta)
+    gdf_competition_updated = apply_delta_to_competition(gdf_competition, ssdb_delta)
+
+    # The same as uploading the updated SSDB and processing it again
+    df_ssdb_rebuilt = pd.concat([get_store_rows([0, 2, 3, 5, 6, 7]),
+                                 get_store_rows([1], lon_offset=0.03),
+                                 get_store_rows([20], lon_offset=-0.19)], ignore_index=True)
+    gdf_ssdb_rebuilt = get_gdf_ssdb(df_ssdb_rebuilt)
+    pd.testing.assert_frame_equal(get_comparable(gdf_ssdb_updated, [SSDB_ID_COL]),
+                                  get_comparable(gdf_ssdb_rebuilt, [SSDB_ID_COL]))
+    pd.testing.assert_frame_equal(get_comparable(gdf_competition_updated),
+                                  get_comparable(build_competition(gdf_ssdb_rebuilt)))
+    assert sorted(gdf_old['storename']) == ['Store 1', 'Store 4']
+
+
+def test_store_id_is_kept_when_the_store_is_renamed():
+    df_ssdb = get_store_rows(range(3))
+    store_ids = get_gdf_ssdb(df_ssdb)[SSDB_ID_COL].tolist()
+
+    df_ssdb.loc[1, 'storename'] = 'Store 1 - Rebranded'
+    df_ssdb.loc[1, 'latitude'] = LAT0 + 0.001
+    assert get_gdf_ssdb(df_ssdb)[SSDB_ID_COL].tolist() == store_ids
+
+
+def test_stores_at_the_same_address_have_distinct_ids():
+    df_ssdb = get_store_rows([0, 0])
+    df_ssdb['storename'] = ['B Storage', 'A Storage']
+    gdf_ssdb = get_gdf_ssdb(df_ssdb)
+    store_ids = gdf_ssdb.set_index('storename')[SSDB_ID_COL]
+    assert store_ids['B Storage'] == store_ids['A Storage'] + '-2'
+    # The ids do not depend on the row order
+    store_ids_reversed = get_gdf_ssdb(df_ssdb.iloc[::-1]).set_index('storename')[SSDB_ID_COL]
+    assert store_ids_reversed.sort_index().equals(store_ids.sort_index())
+
+
+def test_unknown_delta_action_is_rejected():
+    gdf_ssdb = get_gdf_ssdb(get_store_rows(range(3)))
+    df_delta = pd.DataFrame({SSDB_ID_COL: gdf_ssdb[SSDB_ID_COL].iloc[:2],
+                             DELTA_ACTION_COL: [DELTA_REMOVE, 'delete']})
+    with pytest.raises(ValueError, match='delete'):
+        get_ssdb_delta(df_delta)
+
+
+def test_delta_without_an_action_col_is_rejected():
+    with pytest.raises(KeyError):
+        get_ssdb_delta(pd.DataFrame({SSDB_ID_COL: ['a']}))
+
+
+def test_remove_only_delta_drops_the_competition_rows():
+    gdf_ssdb = get_gdf_ssdb(get_store_rows(range(4)))
+    gdf_competition = build_competition(gdf_ssdb)
+    removed_id = gdf_ssdb.loc[0, SSDB_ID_COL]
+    ssdb_delta = get_ssdb_delta(pd.DataFrame({SSDB_ID_COL: [removed_id], DELTA_ACTION_COL: [DELTA_REMOVE]}))
+
+    gdf_competition_updated = apply_delta_to_competition(gdf_competition, ssdb_delta)
+    assert removed_id not in gdf_competition_updated[SSDB_ID_COL].values
+    assert len(gdf_competition_updated) == len(gdf_competition) - 2
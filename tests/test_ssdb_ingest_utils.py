@@ -0,0 +1,112 @@
+import io
+import pandas as pd
+import pytest
+
+import utils.ssdb_ingest_utils as ssdb_ingest_utils
+from utils.ssdb_ingest_utils import ingest_ssdb
+from config.constants import SSDB_ID_COL
+
+
+def get_df_ssdb(n_rows=4):
+    return pd.DataFrame({'storename': [f' Store {i} ' for i in range(n_rows)],
+                         'address': [f'{i} High Street' for i in range(n_rows)],
+                         'city': ['London'] * n_rows,
+                         'latitude': [51.5 + i / 100 for i in range(n_rows)],
+                         'longitude': [-0.15 + i / 100 for i in range(n_rows)],
+                         'ss_type': ['Self Storage'] * n_rows,
+                         'area_unit': ['sqft'] * n_rows,
+                         'store_cla': [40_000.0 + i for i in range(n_rows)],
+                         'store_mla': [50_000.0 + i for i in range(n_rows)]})
+
+
+def to_csv_bytes(df):
+    return df.to_csv(index=False).encode()
+
+
+def to_parquet_bytes(df):
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def reads(tmp_path, monkeypatch):
+    """Artifacts are saved to tmp_path - returns the fnames passed to read_ssdb_file (an artifact miss)"""
+    monkeypatch.setattr(ssdb_ingest_utils, 'SSDB_CACHE_DIR', str(tmp_path))
+    fnames = []
+    read_ssdb_file = ssdb_ingest_utils.read_ssdb_file
+    monkeypatch.setattr(ssdb_ingest_utils, 'read_ssdb_file',
+                        lambda file_bytes, fname: fnames.append(fname) or read_ssdb_file(file_bytes, fname))
+    return fnames
+
+
+def test_csv_and_parquet_uploads_ingest_the_same(reads):
+    df_ssdb = get_df_ssdb()
+    gdf_csv, _ = ingest_ssdb(to_csv_bytes(df_ssdb), 'ssdb.csv')
+    gdf_parquet, _ = ingest_ssdb(to_parquet_bytes(df_ssdb), 'SSDB.PARQUET')
+
+    assert reads == ['ssdb.csv', 'SSDB.PARQUET']
+    pd.testing.assert_frame_equal(gdf_csv.drop(columns='geometry'), gdf_parquet.drop(columns='geometry'))
+    assert gdf_csv.crs.to_epsg() == 4326
+    # Text is stripped and every store has an id
+    assert gdf_csv['storename'].tolist() == [f'Store {i}' for i in range(4)]
+    assert gdf_csv[SSDB_ID_COL].is_unique
+
+
+def test_unsupported_file_type_raises(reads):
+    with pytest.raises(ValueError):
+        ingest_ssdb(b'storename', 'ssdb.txt')
+
+
+def test_same_bytes_are_read_from_the_artifact(reads, tmp_path):
+    file_bytes = to_csv_bytes(get_df_ssdb())
+    gdf_first, content_sha = ingest_ssdb(file_bytes, 'ssdb.csv')
+
+    progress = []
+    gdf_second, content_sha_second = ingest_ssdb(file_bytes, 'renamed.csv',
+                                                 progress_callback=lambda fraction, text: progress.append(text))
+
+    # The upload is only parsed and validated once
+    assert reads == ['ssdb.csv']
+    assert content_sha_second == content_sha
+    assert progress == ['SSDB already ingested']
+    assert len(list(tmp_path.iterdir())) == 1
+    pd.testing.assert_frame_equal(gdf_second.drop(columns='geometry'), gdf_first.drop(columns='geometry'))
+
+
+def test_changed_bytes_miss_the_artifact(reads, tmp_path):
+    df_ssdb = get_df_ssdb()
+    _, content_sha = ingest_ssdb(to_csv_bytes(df_ssdb), 'ssdb.csv')
+    df_ssdb.loc[0, 'store_cla'] = 1.0
+    gdf_changed, content_sha_changed = ingest_ssdb(to_csv_bytes(df_ssdb), 'ssdb.csv')
+
+    assert reads == ['ssdb.csv', 'ssdb.csv']
+    assert content_sha_changed != content_sha
+    assert len(list(tmp_path.iterdir())) == 2
+    assert gdf_changed.loc[0, 'store_cla'] == 1.0
+
+
+def test_rows_failing_validation_are_rejected(reads, monkeypatch):
+    # Small chunks so the invalid rows are spread over several chunks - one of them with no valid rows
+    monkeypatch.setattr(ssdb_ingest_utils, 'SSDB_INGEST_CHUNK_ROWS', 2)
+    df_ssdb = get_df_ssdb(6).astype({'latitude': object})
+    df_ssdb.loc[1, 'latitude'] = 95
+    df_ssdb.loc[2, 'latitude'] = 'not a number'
+    df_ssdb.loc[3, 'longitude'] = None
+
+    progress = []
+    gdf_ssdb, _ = ingest_ssdb(to_csv_bytes(df_ssdb), 'ssdb.csv',
+                              progress_callback=lambda fraction, text: progress.append(fraction))
+
+    assert gdf_ssdb['storename'].tolist() == ['Store 0', 'Store 4', 'Store 5']
+    assert gdf_ssdb[SSDB_ID_COL].is_unique
+    assert progress == pytest.approx([1 / 3, 2 / 3, 1])
+
+
+def test_ssdb_without_valid_rows_is_not_saved(reads, tmp_path):
+    df_ssdb = get_df_ssdb(2)
+    df_ssdb['latitude'] = 100
+    assert ingest_ssdb(to_csv_bytes(df_ssdb), 'ssdb.csv')[0] is None
+    # Missing a required column
+    assert ingest_ssdb(to_csv_bytes(get_df_ssdb().drop(columns='store_cla')), 'ssdb.csv')[0] is None
+    assert list(tmp_path.iterdir()) == []
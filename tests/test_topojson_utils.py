@@ -0,0 +1,112 @@
+import numpy as np
+import shapely
+from shapely.geometry import box, mapping, Polygon, MultiPolygon, GeometryCollection, LineString
+
+from utils.topojson_utils import encode_topojson, get_payload_bytes
+
+OBJECT_NAME = 'demo'
+
+
+def decode_arcs(topology):
+    """Returns each arc as absolute quantized points"""
+    return [np.cumsum(np.array(arc), axis=0).tolist() for arc in topology['arcs']]
+
+
+def decode_ring(arc_refs, arcs):
+    points = []
+    for ref in arc_refs:
+        arc = arcs[ref] if ref >= 0 else arcs[~ref][::-1]
+        points += arc if not points else arc[1:]
+    return points
+
+
+def decode_geometry(geometry, topology):
+    """Returns the shapely geometry of a TopoJSON geometry in the input coordinates"""
+    if geometry['type'] is None:
+        return None
+    arcs = decode_arcs(topology)
+    (kx, ky), (tx, ty) = topology['transform']['scale'], topology['transform']['translate']
+
+    def to_polygon(rings):
+        coords = [[(x * kx + tx, y * ky + ty) for x, y in decode_ring(ring, arcs)] for ring in rings]
+        return Polygon(coords[0], coords[1:])
+
+    if geometry['type'] == 'Polygon':
+        return to_polygon(geometry['arcs'])
+    return MultiPolygon([to_polygon(rings) for rings in geometry['arcs']])
+
+
+def get_geometries(topology):
+    return topology['objects'][OBJECT_NAME]['geometries']
+
+
+def test_geometries_round_trip_within_the_quantization():
+    geoms = [box(0, 0, 1, 1),
+             Polygon([(1, 0), (2, 0), (2, 1), (1, 1)], [[(1.25, 0.25), (1.75, 0.25), (1.75, 0.75), (1.25, 0.75)]]),
+             MultiPolygon([box(3, 0, 3.5, 0.5), box(3.6, 0, 4, 0.5)])]
+    topology = encode_topojson(geoms, [{'i': i} for i in range(len(geoms))], OBJECT_NAME, quantization=10_001)
+    cell = max(topology['transform']['scale'])
+
+    geometries = get_geometries(topology)
+    assert [geometry['type'] for geometry in geometries] == ['Polygon', 'Polygon', 'MultiPolygon']
+    for geom, geometry in zip(geoms, geometries):
+        decoded = decode_geometry(geometry, topology)
+        assert decoded.is_valid
+        assert shapely.hausdorff_distance(decoded, geom) <= cell
+        assert abs(decoded.area - geom.area) < cell
+
+
+def test_shared_border_is_one_arc_referenced_by_both():
+    geoms = [box(0, 0, 1, 1), box(1, 0, 2, 1)]
+    topology = encode_topojson(geoms, [{}, {}], OBJECT_NAME)
+    left_refs, right_refs = [set(geometry['arcs'][0]) for geometry in get_geometries(topology)]
+
+    # The shared edge is held once - one ring references it forwards and the other in reverse (~index)
+    shared = [ref for ref in left_refs if ~ref in right_refs]
+    assert len(shared) == 1
+    # 3 arcs - the shared edge and the rest of each ring
+    assert len(topology['arcs']) == 3
+
+
+def test_arcs_are_delta_encoded():
+    topology = encode_topojson([box(0, 0, 1, 1)], [{}], OBJECT_NAME, quantization=11)
+    arc = topology['arcs'][0]
+    points = np.cumsum(np.array(arc), axis=0)
+    # The first point is absolute and the ring closes on it
+    assert points[0].tolist() == points[-1].tolist()
+    assert points.min() == 0 and points.max() == 10
+
+
+def test_properties_and_ids_follow_the_geoms():
+    properties = [{'value': 1, 'style': {'fillColor': '#000000'}}, {'value': 2}]
+    topology = encode_topojson([box(0, 0, 1, 1), box(5, 5, 6, 6)], properties, OBJECT_NAME)
+    geometries = get_geometries(topology)
+    assert [geometry['properties'] for geometry in geometries] == properties
+    assert [geometry['id'] for geometry in geometries] == ['0', '1']
+    assert topology['type'] == 'Topology'
+    assert topology['objects'][OBJECT_NAME]['type'] == 'GeometryCollection'
+
+
+def test_empty_and_non_polygon_geoms_have_no_geometry():
+    geoms = [None, Polygon(), GeometryCollection([LineString([(0, 0), (1, 1)])]),
+             GeometryCollection([box(0, 0, 1, 1), LineString([(0, 0), (1, 1)])])]
+    geometries = get_geometries(encode_topojson(geoms, [{}] * len(geoms), OBJECT_NAME))
+    # Line and point slivers of an overlay piece are dropped - the polygon part is kept
+    assert [geometry['type'] for geometry in geometries] == [None, None, None, 'Polygon']
+
+
+def test_collapsed_polygons_are_dropped():
+    # Smaller than one quantization cell of the layer extent
+    geoms = [box(0, 0, 100, 100), box(50, 50, 50.0001, 50.0001)]
+    geometries = get_geometries(encode_topojson(geoms, [{}, {}], OBJECT_NAME, quantization=1_001))
+    assert [geometry['type'] for geometry in geometries] == ['Polygon', None]
+
+
+def test_topojson_payload_is_smaller_for_adjacent_pieces():
+    geoms = [box(x, y, x + 1, y + 1) for x in range(10) for y in range(10)]
+    geoms = shapely.segmentize(np.array(geoms), 0.05)
+    topology = encode_topojson(geoms, [{}] * len(geoms), OBJECT_NAME)
+    geojson = {'type': 'FeatureCollection',
+               'features': [{'type': 'Feature', 'properties': {}, 'geometry': mapping(geom)}
+                            for geom in geoms]}
+    assert get_payload_bytes(topology) < get_payload_bytes(geojson) / 2
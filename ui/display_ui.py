@@ -16,6 +16,8 @@ from utils.demo_data_summary_management_utils import (get_filtered_df_demo_summ,
                                                       get_data_value_from_df_demo_summ)
 from utils.other_utils import add_savills_logo
 from utils.asset_score_utils import render_score_table
+from utils.raster_demo_utils import compare_fast_to_exact
+from utils.ssdb_delta_utils import render_ssdb_delta_uploader
 
 
 """Module renders output when the SSDB has been loaded and store(s) have been selected and """
@@ -112,6 +114,16 @@ class DisplayUI:
     
             st.markdown("<hr style='margin:4px 0;'>", unsafe_allow_html=True)
 
+            ###############################################################
+            ################### MAP LAYER OPTIONS #########################
+            ###############################################################
+
+            st.checkbox('Compact map layers (TopoJSON)',
+                        key='use_topojson_layers',
+                        help='Sends demographic and isochrone layers as TopoJSON - smaller to transfer on slow connections')
+
+            st.markdown("<hr style='margin:4px 0;'>", unsafe_allow_html=True)
+
             ###############################################################
             ##################### DELETE / RESET  #########################
             ###############################################################
@@ -260,6 +272,7 @@ class DisplayUI:
         # Competition summary
         render_competition_data_header()
         render_competition_data_summary_with_editor()
+        render_ssdb_delta_uploader()
 
         # Demographic summary
         self._render_demographic_summary()
@@ -300,4 +313,25 @@ class DisplayUI:
                 print(f'!!!!WARNING could not get a filtered df_summ for store and isotime: {e}')
             st.error("Error loading demographic summary data")
 
+        self._render_indicative_demographics(storename, drive_time)
+
+    def _render_indicative_demographics(self, storename, drive_time):
+        """Render the raster fast-path values with their error against the exact overlay values"""
+        df_demo_fast = st.session_state.get('df_demo_fast')
+        _exact_cols = get_column_names_from_df_demo_summ()
+
+        def _get_exact_value(storename, iso_time_mins, metric):
+            if metric not in _exact_cols:
+                return None
+            return get_data_value_from_df_demo_summ(storename=storename,
+                                                    iso_time_mins=iso_time_mins,
+                                                    data_col_name=metric)
+
+        df_comparison = compare_fast_to_exact(df_demo_fast, storename, drive_time, _get_exact_value)
+        if df_comparison is None:
+            return
+
+        with st.expander('Indicative demographics (raster fast-path)'):
+            st.dataframe(df_comparison, hide_index=True)
+
 
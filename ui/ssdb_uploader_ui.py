@@ -1,13 +1,12 @@
 import streamlit as st
-import pandas as pd
 
-from utils.load_save_data_files_utils import get_gdf_ssdb_from_df
+from utils.ssdb_ingest_utils import ingest_ssdb, SSDB_FILE_TYPES
 from config.constants import DEBUG_PRINT
 
 class SSDBUploaderUI:
     def __init__(self):
         self.title = "Please add the SSDB"
-        self.allowed_types = ["xlsx", "xls"]
+        self.allowed_types = SSDB_FILE_TYPES
 
         #####################################
         # force sidebar to be hidden on init 
@@ -33,7 +32,7 @@ class SSDBUploaderUI:
         st.title(self.title)
         
         uploaded_file = st.file_uploader(
-            "Choose an Excel file", 
+            "Choose an Excel, CSV or parquet file", 
             type=self.allowed_types
         )
         
@@ -41,15 +40,15 @@ class SSDBUploaderUI:
             self._process_uploaded_file(uploaded_file)
     
     def _process_uploaded_file(self, uploaded_file):
-        """Process the uploaded Excel file"""
+        """Ingest the uploaded file - an SSDB already ingested is loaded from its artifact"""
         try:
-            # Read the Excel file into a DataFrame
-            df_ssdb = pd.read_excel(uploaded_file)
-            
-            # Process the DataFrame using your existing function
-            gdf_ssdb = get_gdf_ssdb_from_df(df_ssdb)
+            progress_bar = st.progress(0.0, text='Reading SSDB')
+            gdf_ssdb, content_sha = ingest_ssdb(uploaded_file.getvalue(),
+                                                uploaded_file.name,
+                                                progress_callback=lambda fraction, text: progress_bar.progress(fraction, text=text))
             if gdf_ssdb is not None:
                 st.session_state.data['ssdb'] = gdf_ssdb
+                st.session_state.ssdb_content_sha = content_sha
                 st.session_state.ssdb_uploaded = True
             
                 st.success("SSDB file successfully loaded!")
@@ -0,0 +1,84 @@
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import pyarrow as pa
+
+"""This module holds base layers as Arrow IPC files that are memory-mapped when read
+The file is uncompressed so reading it maps the columns rather than copying them - every server
+process reading the same file shares one physical copy through the OS page cache
+Geometry is held as WKB and only decoded to shapely for the rows taken from the layer
+"""
+
+ARROW_GEOMETRY_COL = 'geometry_wkb'
+
+# Schema metadata keys
+_META_CRS = b'crs'
+_META_GEOMETRY_NAME = b'geometry_name'
+_META_FINGERPRINT = b'fingerprint'
+
+
+def write_arrow_layer(gdf, fpath, fingerprint=''):
+    """Writes gdf to an uncompressed Arrow IPC file with the geometry as WKB
+    fingerprint is saved in the schema metadata so a stale file can be detected"""
+    df = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.append_column(ARROW_GEOMETRY_COL, pa.array(shapely.to_wkb(gdf.geometry.values), type=pa.binary()))
+    table = table.replace_schema_metadata({
+        _META_CRS: gdf.crs.to_json() if gdf.crs is not None else '',
+        _META_GEOMETRY_NAME: gdf.geometry.name,
+        _META_FINGERPRINT: fingerprint,
+    })
+
+    # Written to a temporary file first so a process mapping the old file never sees a partial write
+    fpath_tmp = f'{fpath}.tmp'
+    with pa.OSFile(fpath_tmp, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(fpath_tmp, fpath)
+
+
+def read_arrow_layer_fingerprint(fpath):
+    """Returns the fingerprint saved with an Arrow layer - only the schema is read"""
+    with pa.memory_map(fpath, 'r') as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    return metadata.get(_META_FINGERPRINT, b'').decode()
+
+
+class ArrowBaseLayer:
+    """A base layer memory-mapped from an Arrow IPC file
+    Attribute columns are converted to pandas and geometry decoded only for the rows taken
+    Treat as read only - it is shared by every session"""
+
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self.table = pa.ipc.open_file(pa.memory_map(fpath, 'r')).read_all()
+        metadata = self.table.schema.metadata or {}
+        crs = metadata.get(_META_CRS, b'').decode()
+        self.crs = crs or None
+        self.geometry_name = metadata.get(_META_GEOMETRY_NAME, b'geometry').decode()
+        self.fingerprint = metadata.get(_META_FINGERPRINT, b'').decode()
+        self.columns = [col for col in self.table.column_names if col != ARROW_GEOMETRY_COL]
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def get_column_values(self, col):
+        """Returns a column as a numpy array - zero copy for numeric columns without nulls"""
+        return self.table.column(col).to_numpy()
+
+    def take(self, idx, columns=None):
+        """Returns a GeoDataFrame of the rows at positions idx (index is the positions)
+        columns limits the attribute columns converted - None converts them all"""
+        idx = np.asarray(idx, dtype='int64')
+        columns = self.columns if columns is None else columns
+        table = self.table.select(columns + [ARROW_GEOMETRY_COL]).take(pa.array(idx))
+        df = table.drop_columns([ARROW_GEOMETRY_COL]).to_pandas()
+        df.index = pd.Index(idx)
+        df[self.geometry_name] = shapely.from_wkb(table.column(ARROW_GEOMETRY_COL).to_numpy(zero_copy_only=False))
+        return gpd.GeoDataFrame(df, geometry=self.geometry_name, crs=self.crs)
+
+    def to_gdf(self, columns=None):
+        """Returns every row as a GeoDataFrame - decodes all of the geometry"""
+        return self.take(np.arange(len(self)), columns)
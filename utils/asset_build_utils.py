@@ -0,0 +1,203 @@
+import os
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config.constants import DEBUG_PRINT, CRS
+
+"""This module holds the one-off build steps for assets derived from the base data files
+The outputs are saved to assets/data so the app only reads them
+Each output is saved with the fingerprint of the data files it was built from - where an output is
+missing or was built from other versions of the data files the app builds it on first use and tries to save it
+"""
+
+FNAME_MSOA_CROSSWALK = "msoa_11_21_crosswalk.parquet"
+FNAME_MSOA_LA_LOOKUP = "msoa_21_la_lookup.parquet"
+
+# Parquet schema metadata key of the source fingerprint
+_META_SOURCE_FINGERPRINT = b'source_fingerprint'
+
+MSOA_11_ID_COL = 'MSOA11NM'
+MSOA_21_ID_COL = 'MSOA21NM'
+
+# Income is held on 2011 msoas - it is projected onto the 2021 msoas with the crosswalk
+MSOA_11_VALUE_COLS = ['HouseholdIncMar2020']
+
+# msoas nest within local authorities - each 2021 msoa takes the values of its LA
+LA_ID_COL = 'Area name'
+LA_VALUE_COLS = ['Rents_Oct_2024']
+
+
+def get_asset_path(fname):
+    return os.path.join('assets', 'data', fname)
+
+
+def save_asset_df(df, fpath, fingerprint=''):
+    """Saves df to parquet with the source fingerprint in the schema metadata
+    Written to a temporary file first so a partial file is never read"""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), _META_SOURCE_FINGERPRINT: fingerprint})
+    fpath_tmp = f'{fpath}.tmp'
+    pq.write_table(table, fpath_tmp)
+    os.replace(fpath_tmp, fpath)
+
+
+def read_asset_fingerprint(fpath):
+    """Returns the source fingerprint saved with an asset - only the schema is read"""
+    metadata = pq.read_schema(fpath).metadata or {}
+    return metadata.get(_META_SOURCE_FINGERPRINT, b'').decode()
+
+
+def build_area_crosswalk(gdf_source, source_id_col, gdf_target, target_id_col):
+    """Returns df [target_id_col, source_id_col, weight]
+    weight is the share of the target zone area covered by the source zone
+    Both gdfs are intersected in planar crs"""
+    gdf_overlaid = gpd.overlay(gdf_target[[target_id_col, 'geometry']].to_crs(CRS.EUROPEAN_PLANAR),
+                               gdf_source[[source_id_col, 'geometry']].to_crs(CRS.EUROPEAN_PLANAR),
+                               how='intersection',
+                               keep_geom_type=True,
+                               make_valid=True)
+    df_crosswalk = pd.DataFrame({target_id_col: gdf_overlaid[target_id_col],
+                                 source_id_col: gdf_overlaid[source_id_col],
+                                 'area': gdf_overlaid.geometry.area})
+    df_crosswalk = df_crosswalk[df_crosswalk['area'] > 0]
+    df_crosswalk['weight'] = df_crosswalk['area'].div(df_crosswalk.groupby(target_id_col)['area'].transform('sum'))
+
+    return df_crosswalk[[target_id_col, source_id_col, 'weight']].reset_index(drop=True)
+
+
+def project_values_with_crosswalk(df_crosswalk, df_source, source_id_col, target_id_col, value_cols):
+    """Returns df [target_id_col, value_cols] - the crosswalk weighted mean of the source values
+    for each target zone. Source zones without a value are left out of the weighting"""
+    df = df_crosswalk.merge(df_source[[source_id_col] + value_cols], on=source_id_col, how='left')
+
+    df_projected = pd.DataFrame({target_id_col: df[target_id_col].unique()}).set_index(target_id_col)
+    for col in value_cols:
+        has_value = df[col].notna()
+        weighted = df[col].mul(df['weight']).where(has_value, 0)
+        weights = df['weight'].where(has_value, 0)
+        sums = pd.DataFrame({'weighted': weighted, 'weights': weights, target_id_col: df[target_id_col]}).groupby(target_id_col).sum()
+        df_projected[col] = sums['weighted'].div(sums['weights'])
+
+    return df_projected.reset_index()
+
+
+def build_msoa_crosswalk(gdf_msoa_20, gdf_msoa_22, fpath=None, fingerprint=''):
+    """Builds the 2011 -> 2021 msoa area crosswalk and saves it to fpath with the fingerprint of its sources
+    Returns the crosswalk df"""
+    fpath = fpath or get_asset_path(FNAME_MSOA_CROSSWALK)
+    df_crosswalk = build_area_crosswalk(gdf_msoa_20, MSOA_11_ID_COL, gdf_msoa_22, MSOA_21_ID_COL)
+
+    try:
+        save_asset_df(df_crosswalk, fpath, fingerprint)
+        print(f'****INFO build_msoa_crosswalk saved {len(df_crosswalk)} rows to {fpath}')
+    except Exception as e:
+        print(f'!!!!WARNING build_msoa_crosswalk could not save to {fpath}: {e}')
+
+    return df_crosswalk
+
+
+def _load_or_build_asset(fname, build_fn, fingerprint):
+    """Returns the saved asset df - calls build_fn(fpath) to build and save it if it has not been built yet
+    or was saved with a different source fingerprint"""
+    fpath = get_asset_path(fname)
+    if os.path.exists(fpath):
+        try:
+            if read_asset_fingerprint(fpath) == fingerprint:
+                return pd.read_parquet(fpath)
+            if DEBUG_PRINT:
+                print(f'****INFO _load_or_build_asset {fpath} was built from other data files - rebuilding')
+            return build_fn(fpath)
+        except Exception as e:
+            print(f'!!!!WARNING _load_or_build_asset could not read {fpath} - rebuilding: {e}')
+            return build_fn(fpath)
+
+    if DEBUG_PRINT:
+        print(f'****INFO _load_or_build_asset {fpath} not found - building')
+    return build_fn(fpath)
+
+
+def get_msoa_crosswalk(gdf_msoa_20, gdf_msoa_22, fingerprint):
+    """Returns the saved msoa crosswalk - builds it if it has not been built yet or its sources have changed
+    fingerprint is the fingerprint of the msoa_20 and msoa_22 data files"""
+    return _load_or_build_asset(FNAME_MSOA_CROSSWALK,
+                                lambda fpath: build_msoa_crosswalk(gdf_msoa_20, gdf_msoa_22, fpath, fingerprint),
+                                fingerprint)
+
+
+def add_msoa_11_values_to_msoa_22(gdf_msoa_22, gdf_msoa_20, df_crosswalk):
+    """Adds MSOA_11_VALUE_COLS to gdf_msoa_22 (in place) projected through the crosswalk"""
+    df_projected = project_values_with_crosswalk(df_crosswalk, gdf_msoa_20, MSOA_11_ID_COL,
+                                                 MSOA_21_ID_COL, MSOA_11_VALUE_COLS)
+    df_projected = df_projected.set_index(MSOA_21_ID_COL)
+    for col in MSOA_11_VALUE_COLS:
+        gdf_msoa_22[col] = gdf_msoa_22[MSOA_21_ID_COL].map(df_projected[col])
+
+    if DEBUG_PRINT:
+        missing = gdf_msoa_22[MSOA_11_VALUE_COLS].isna().any(axis=1).sum()
+        print(f'****INFO add_msoa_11_values_to_msoa_22 added {MSOA_11_VALUE_COLS} - {missing} zones without a value')
+
+    return gdf_msoa_22
+
+
+def build_parent_zone_lookup(gdf_zones, zone_id_col, gdf_parents, parent_id_col):
+    """Returns df [zone_id_col, parent_id_col] assigning each zone to the parent zone containing
+    its representative point - zones whose point falls outside every parent (eg coastline
+    differences) take the nearest parent. Both gdfs are joined in planar crs"""
+    gdf_points = gdf_zones[[zone_id_col, 'geometry']].to_crs(CRS.EUROPEAN_PLANAR)
+    gdf_points['geometry'] = gdf_points.geometry.representative_point()
+    gdf_parents = gdf_parents[[parent_id_col, 'geometry']].to_crs(CRS.EUROPEAN_PLANAR)
+
+    gdf_within = gpd.sjoin(gdf_points, gdf_parents, how='left', predicate='within')
+    # A point on a shared boundary can match two parents - keep the first
+    gdf_within = gdf_within[~gdf_within.index.duplicated(keep='first')]
+
+    unmatched = gdf_within[parent_id_col].isna()
+    if unmatched.any():
+        gdf_nearest = gpd.sjoin_nearest(gdf_points[unmatched], gdf_parents, how='left')
+        gdf_nearest = gdf_nearest[~gdf_nearest.index.duplicated(keep='first')]
+        gdf_within.loc[unmatched, parent_id_col] = gdf_nearest[parent_id_col]
+        if DEBUG_PRINT:
+            print(f'****INFO build_parent_zone_lookup {unmatched.sum()} zones assigned to the nearest {parent_id_col}')
+
+    return pd.DataFrame({zone_id_col: gdf_within[zone_id_col],
+                         parent_id_col: gdf_within[parent_id_col]}).reset_index(drop=True)
+
+
+def build_msoa_la_lookup(gdf_la_rents, gdf_msoa_22, fpath=None, fingerprint=''):
+    """Builds the 2021 msoa -> LA lookup and saves it to fpath with the fingerprint of its sources
+    Returns the lookup df"""
+    fpath = fpath or get_asset_path(FNAME_MSOA_LA_LOOKUP)
+    df_lookup = build_parent_zone_lookup(gdf_msoa_22, MSOA_21_ID_COL, gdf_la_rents, LA_ID_COL)
+
+    try:
+        save_asset_df(df_lookup, fpath, fingerprint)
+        print(f'****INFO build_msoa_la_lookup saved {len(df_lookup)} rows to {fpath}')
+    except Exception as e:
+        print(f'!!!!WARNING build_msoa_la_lookup could not save to {fpath}: {e}')
+
+    return df_lookup
+
+
+def get_msoa_la_lookup(gdf_la_rents, gdf_msoa_22, fingerprint):
+    """Returns the saved msoa -> LA lookup - builds it if it has not been built yet or its sources have changed
+    fingerprint is the fingerprint of the la_rents and msoa_22 data files"""
+    return _load_or_build_asset(FNAME_MSOA_LA_LOOKUP,
+                                lambda fpath: build_msoa_la_lookup(gdf_la_rents, gdf_msoa_22, fpath, fingerprint),
+                                fingerprint)
+
+
+def add_la_values_to_msoa_22(gdf_msoa_22, gdf_la_rents, df_lookup):
+    """Adds LA_VALUE_COLS to gdf_msoa_22 (in place) from the LA each msoa is assigned to"""
+    msoa_to_la = df_lookup.set_index(MSOA_21_ID_COL)[LA_ID_COL]
+    df_la_values = gdf_la_rents[[LA_ID_COL] + LA_VALUE_COLS].drop_duplicates(LA_ID_COL).set_index(LA_ID_COL)
+    la_names = gdf_msoa_22[MSOA_21_ID_COL].map(msoa_to_la)
+    for col in LA_VALUE_COLS:
+        gdf_msoa_22[col] = la_names.map(df_la_values[col])
+
+    if DEBUG_PRINT:
+        missing = gdf_msoa_22[LA_VALUE_COLS].isna().any(axis=1).sum()
+        print(f'****INFO add_la_values_to_msoa_22 added {LA_VALUE_COLS} - {missing} zones without a value')
+
+    return gdf_msoa_22
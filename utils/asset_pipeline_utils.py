@@ -0,0 +1,284 @@
+import streamlit as st
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from datetime import datetime, timezone
+
+from utils.load_save_data_files_utils import (convert_data_files_to_spatial_parquet,
+                                              build_planar_arrow_layers,
+                                              build_compiled_weightings_file,
+                                              load_planar_data_files,
+                                              get_data_file,
+                                              get_data_file_path,
+                                              get_data_files_fingerprint,
+                                              get_spatial_data_file_path,
+                                              get_planar_arrow_path,
+                                              get_path_sha256,
+                                              get_weightings_path,
+                                              get_weightings_cache_path,
+                                              PLANAR_LAYER_KEYS,
+                                              PLANAR_LAYER_SOURCES,
+                                              SPATIAL_DATA_KEYS,
+                                              SPATIAL_DATA_VERSION,
+                                              PLANAR_ARROW_VERSION,
+                                              WEIGHTINGS_CACHE_VERSION)
+from utils.asset_build_utils import (build_msoa_crosswalk,
+                                     build_msoa_la_lookup,
+                                     get_asset_path,
+                                     FNAME_MSOA_CROSSWALK,
+                                     FNAME_MSOA_LA_LOOKUP)
+from utils.raster_demo_utils import (build_demo_raster_surface_file,
+                                     get_raster_surface_path,
+                                     RASTER_SURFACE_VERSION)
+from utils.display_geometry_utils import (build_display_geometry_files,
+                                          load_zone_display_geometry,
+                                          get_display_geometry_path,
+                                          DISPLAY_GEOMETRY_LAYER_KEYS,
+                                          DISPLAY_GEOMETRY_VERSION)
+from config.constants import DEBUG_PRINT
+
+"""This module is the headless build of every runtime artifact derived from the raw data files
+Each artifact lists its input and output files - the build records the sha256 of both and its
+schema version in ASSET_MANIFEST_PATH and only rebuilds an artifact whose inputs, outputs or schema
+version no longer match the manifest. Artifacts are built in order so a rebuilt output changes the
+inputs of the artifacts built from it
+The runtime reads the manifest version of an artifact (get_asset_version) to key its caches on the build
+Run from the repo root:
+    python -m utils.asset_pipeline_utils [--force] [artifact names - default all]
+"""
+
+ASSET_MANIFEST_PATH = os.path.join('assets', 'asset_manifest.json')
+# Bump when the layout of the manifest changes
+ASSET_MANIFEST_VERSION = 1
+
+# The crosswalk and lookup are saved as parquet with their source fingerprint - bump when their build changes
+ZONE_LOOKUP_VERSION = 2
+
+
+class AssetArtifact:
+    """A build step of the asset pipeline
+    get_input_paths / get_output_paths return the files it reads and writes - build() writes the outputs"""
+
+    def __init__(self, name, schema_version, get_input_paths, get_output_paths, build):
+        self.name = name
+        self.schema_version = schema_version
+        self.get_input_paths = get_input_paths
+        self.get_output_paths = get_output_paths
+        self.build = build
+
+
+def _build_planar_layers():
+    build_planar_arrow_layers()
+    load_planar_data_files.clear()
+
+
+def _build_display_geometry():
+    build_display_geometry_files()
+    load_zone_display_geometry.clear()
+
+
+def _get_weightings_cache_paths():
+    return [get_weightings_cache_path(get_path_sha256(get_weightings_path()))]
+
+
+def _build_compiled_weightings():
+    build_compiled_weightings_file(get_weightings_path(), _get_weightings_cache_paths()[0])
+
+
+# In build order - an artifact can read the outputs of the artifacts before it
+ASSET_ARTIFACTS = [
+    AssetArtifact('spatial_data_files', SPATIAL_DATA_VERSION,
+                  lambda: [get_data_file_path(key) for key in SPATIAL_DATA_KEYS],
+                  lambda: [get_spatial_data_file_path(key) for key in SPATIAL_DATA_KEYS],
+                  convert_data_files_to_spatial_parquet),
+    AssetArtifact('msoa_crosswalk', ZONE_LOOKUP_VERSION,
+                  lambda: [get_data_file_path('msoa_20'), get_data_file_path('msoa_22')],
+                  lambda: [get_asset_path(FNAME_MSOA_CROSSWALK)],
+                  lambda: build_msoa_crosswalk(get_data_file('msoa_20'), get_data_file('msoa_22'),
+                                               fingerprint=get_data_files_fingerprint(['msoa_20', 'msoa_22']))),
+    AssetArtifact('msoa_la_lookup', ZONE_LOOKUP_VERSION,
+                  lambda: [get_data_file_path('la_rents'), get_data_file_path('msoa_22')],
+                  lambda: [get_asset_path(FNAME_MSOA_LA_LOOKUP)],
+                  lambda: build_msoa_la_lookup(get_data_file('la_rents'), get_data_file('msoa_22'),
+                                               fingerprint=get_data_files_fingerprint(['la_rents', 'msoa_22']))),
+    AssetArtifact('planar_layers', PLANAR_ARROW_VERSION,
+                  lambda: (list(dict.fromkeys(get_data_file_path(source_key)
+                                              for key in PLANAR_LAYER_KEYS
+                                              for source_key in PLANAR_LAYER_SOURCES[key]))
+                           + [get_asset_path(FNAME_MSOA_CROSSWALK), get_asset_path(FNAME_MSOA_LA_LOOKUP)]),
+                  lambda: [get_planar_arrow_path(key) for key in PLANAR_LAYER_KEYS],
+                  _build_planar_layers),
+    AssetArtifact('raster_surface', RASTER_SURFACE_VERSION,
+                  lambda: [get_planar_arrow_path(key) for key in PLANAR_LAYER_KEYS],
+                  lambda: [get_raster_surface_path()],
+                  build_demo_raster_surface_file),
+    AssetArtifact('display_geometry', DISPLAY_GEOMETRY_VERSION,
+                  lambda: [get_planar_arrow_path(key) for key in DISPLAY_GEOMETRY_LAYER_KEYS],
+                  lambda: [get_display_geometry_path(key) for key in DISPLAY_GEOMETRY_LAYER_KEYS],
+                  _build_display_geometry),
+    AssetArtifact('compiled_weightings', WEIGHTINGS_CACHE_VERSION,
+                  lambda: [get_weightings_path()],
+                  _get_weightings_cache_paths,
+                  _build_compiled_weightings),
+]
+
+ASSET_ARTIFACT_NAMES = [artifact.name for artifact in ASSET_ARTIFACTS]
+
+
+def _to_manifest_path(fpath):
+    """Paths are saved with / so a manifest built on one OS is read on another"""
+    return os.path.normpath(fpath).replace(os.sep, '/')
+
+
+def get_paths_sha256(fpaths):
+    """Returns {manifest path: sha256} of the files"""
+    return {_to_manifest_path(fpath): get_path_sha256(fpath) for fpath in fpaths}
+
+
+def get_entry_version(schema_version, input_shas, output_shas):
+    """Returns the version of an artifact - changes with its schema version or any of its files"""
+    content = json.dumps([schema_version, input_shas, output_shas], sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()[:16]
+
+
+def get_artifact_entry(artifact):
+    """Returns the manifest entry of an artifact from the files on disk"""
+    input_shas = get_paths_sha256(artifact.get_input_paths())
+    output_shas = get_paths_sha256(artifact.get_output_paths())
+    return {'schema_version': artifact.schema_version,
+            'inputs': input_shas,
+            'outputs': output_shas,
+            'version': get_entry_version(artifact.schema_version, input_shas, output_shas)}
+
+
+def is_entry_current(entry, schema_version=None):
+    """True if every input and output of a manifest entry still has its recorded sha256
+    (and the schema version matches if one is given)"""
+    if not entry or (schema_version is not None and entry.get('schema_version') != schema_version):
+        return False
+    try:
+        return all(get_path_sha256(fpath) == sha
+                   for fpath, sha in {**entry['inputs'], **entry['outputs']}.items())
+    except (OSError, KeyError):
+        return False
+
+
+def is_artifact_current(artifact, entry):
+    """True if the manifest entry is current and lists the files the artifact reads and writes now"""
+    if not is_entry_current(entry, artifact.schema_version):
+        return False
+    try:
+        return (sorted(entry['inputs']) == sorted(map(_to_manifest_path, artifact.get_input_paths()))
+                and sorted(entry['outputs']) == sorted(map(_to_manifest_path, artifact.get_output_paths())))
+    except OSError:
+        return False
+
+
+def read_asset_manifest(fpath=ASSET_MANIFEST_PATH):
+    """Returns the manifest dict - or None if there is none or it is from another manifest version"""
+    if not os.path.exists(fpath):
+        return None
+    try:
+        with open(fpath, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f'!!!!WARNING read_asset_manifest could not read {fpath}: {e}')
+        return None
+    if manifest.get('manifest_version') != ASSET_MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def write_asset_manifest(manifest, fpath=ASSET_MANIFEST_PATH):
+    """Writes the manifest - to a temporary file first so a partial manifest is never read"""
+    fpath_tmp = f'{fpath}.tmp'
+    with open(fpath_tmp, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(fpath_tmp, fpath)
+
+
+def build_assets(names=None, force=False):
+    """Builds the artifacts (default all) whose inputs, outputs or schema version changed since the
+    manifest was written - force rebuilds them all. Writes and returns the manifest"""
+    manifest = read_asset_manifest() or {}
+    entries = dict(manifest.get('artifacts', {}))
+
+    for artifact in ASSET_ARTIFACTS:
+        if names and artifact.name not in names:
+            continue
+        if not force and is_artifact_current(artifact, entries.get(artifact.name)):
+            print(f'****INFO build_assets {artifact.name} is current - skipped')
+            continue
+
+        start_time = time.perf_counter()
+        try:
+            artifact.build()
+            entry = get_artifact_entry(artifact)
+        except Exception as e:
+            # Left out of the manifest so the runtime does not use it and the next build tries again
+            print(f'!!!!WARNING build_assets could not build {artifact.name}: {e}')
+            entries.pop(artifact.name, None)
+            continue
+        entry['built_at'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        entries[artifact.name] = entry
+        print(f'****INFO build_assets built {artifact.name} in {time.perf_counter() - start_time:,.1f}s '
+              f'- version {entry["version"]}')
+
+    manifest = {'manifest_version': ASSET_MANIFEST_VERSION,
+                'built_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'version': get_entry_version(ASSET_MANIFEST_VERSION,
+                                             {name: entry['version'] for name, entry in entries.items()}, {}),
+                'artifacts': entries}
+    write_asset_manifest(manifest)
+    print(f'****INFO build_assets wrote {ASSET_MANIFEST_PATH} - version {manifest["version"]}')
+    return manifest
+
+
+@st.cache_data(show_spinner=False)
+def _load_asset_manifest(fpath, mtime_ns):
+    """Returns the manifest - mtime_ns is part of the cache key so a new build is read again"""
+    return read_asset_manifest(fpath)
+
+
+def get_asset_version(artifact_name=None):
+    """Returns the manifest version of an artifact - or of the whole build if artifact_name is None
+    Returns None if there is no manifest or the files on disk no longer match it (eg a data file was
+    replaced without running the build) - callers then fall back to hashing the files themselves"""
+    try:
+        manifest = _load_asset_manifest(ASSET_MANIFEST_PATH, os.stat(ASSET_MANIFEST_PATH).st_mtime_ns)
+    except OSError:
+        return None
+    if manifest is None:
+        return None
+
+    entries = manifest['artifacts']
+    if artifact_name is None:
+        is_current = (sorted(entries) == sorted(ASSET_ARTIFACT_NAMES)
+                      and all(is_entry_current(entry) for entry in entries.values()))
+        version = manifest['version']
+    else:
+        is_current = is_entry_current(entries.get(artifact_name))
+        version = entries.get(artifact_name, {}).get('version')
+
+    if not is_current:
+        if DEBUG_PRINT:
+            print(f'****INFO get_asset_version {artifact_name or "build"} does not match {ASSET_MANIFEST_PATH} '
+                  f'- run python -m utils.asset_pipeline_utils')
+        return None
+    return version
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds the runtime artifacts whose inputs changed '
+                                                 f'and writes {ASSET_MANIFEST_PATH}')
+    parser.add_argument('artifacts', nargs='*', help=f'artifacts to build - default all of {ASSET_ARTIFACT_NAMES}')
+    parser.add_argument('--force', action='store_true', help='rebuild even if the artifacts are current')
+    args = parser.parse_args()
+    unknown_names = [name for name in args.artifacts if name not in ASSET_ARTIFACT_NAMES]
+    if unknown_names:
+        parser.error(f'unknown artifacts {unknown_names} - use any of {ASSET_ARTIFACT_NAMES}')
+    manifest = build_assets(args.artifacts, force=args.force)
+    sys.exit(0 if len(manifest['artifacts']) == len(ASSET_ARTIFACT_NAMES) else 1)
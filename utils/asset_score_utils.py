@@ -1,46 +1,128 @@
 import streamlit as st
-
-import pandas as pd
 import numpy as np
 
-from managers.session_state_manager import SessionStateManager
-
-from utils.demo_data_summary_management_utils import get_data_value_from_df_demo_summ
-from utils.competition_utils import summarise_competition, get_output_competition
-from utils.other_utils import validate_storename_and_iso_time_mins_in_df
+from utils.score_engine_utils import (FactorScale,
+                                      ScoreCube,
+                                      compile_weightings,
+                                      get_competition_totals_by_store_band,
+                                      build_factor_values)
+from utils.store_band_views_utils import get_store_band_views
 
-from config.constants import DEBUG_PRINT
+from config.constants import DEBUG_PRINT, ISO_TIME_MINS
 
 
 
 """This module covers the creation of the SSST output table on the ssst tab
 Reads in data summary and applies weights
+Every selected store and drive time is scored in one pass by the score engine (score_engine_utils)
+the table for the selected store / drive time is then a lookup in the score cube
+What-if weights reuse the cached unweighted scores so only the weighted sum is recalculated
 """
 
-SCORE_ROUNDING_MULTIPLE = 0.25
 
 def get_score_from_value(df, value):
-    """This requires that the bounds are in ascending order
+    """Returns the score of a single value from a weightings sheet - NaN if the value falls between bands
+    This requires that the bounds are in ascending order
     This is part of the load process """
 
     _required_cols = ['Lower Bound', 'Upper Bound', 'Score']
-    _missing_cols = []
-    for col in _required_cols:
-        if col not in df.columns:
-            _missing_cols.append(col)
+    _missing_cols = [col for col in _required_cols if col not in df.columns]
     if _missing_cols:
         print(f'!!!!WARNING get_score_from_value df passed with missing cols {_missing_cols}')
         return None
-    if value < df['Lower Bound'].min():
-        print(f"WARNING: Value {value} below minimum bound, using lowest score")
-        return df['Score'].iloc[0]
-    elif value > df['Upper Bound'].max():
-        print(f"WARNING: Value {value} above maximum bound, using highest score")
-        return df['Score'].iloc[-1]
-    
-    mask = (df['Lower Bound'] <= value) & (df['Upper Bound'] >= value)
-    return df[mask]['Score'].iloc[0]
+    return FactorScale(df).score([value])[0]
+
+
+def get_compiled_weightings():
+    """Returns the compiled weightings from session_state - compiles them on first use"""
+    compiled_weightings = st.session_state.get('compiled_weightings')
+    if compiled_weightings is None:
+        compiled_weightings = compile_weightings(st.session_state.get('savills_score_weightings'),
+                                                 st.session_state.get('weightings_dict'))
+        st.session_state.compiled_weightings = compiled_weightings
+    return compiled_weightings
+
+
+def build_score_cube(storenames, selected_storage_types, iso_time_mins_list=ISO_TIME_MINS):
+    """Returns ScoreCube of every store x drive time for the selected storage types - None if the inputs are missing"""
+    compiled_weightings = get_compiled_weightings()
+    df_demo_summ = st.session_state.get('df_demo_summ')
+    gdf_competition = st.session_state.get('gdf_competition')
+    if compiled_weightings is None or df_demo_summ is None or gdf_competition is None:
+        print(f'!!!!WARNING build_score_cube missing weightings, df_demo_summ or gdf_competition')
+        return None
+
+    df_competition_totals = get_competition_totals_by_store_band(gdf_competition, selected_storage_types)
+    factor_values = build_factor_values(compiled_weightings, storenames, iso_time_mins_list,
+                                        df_demo_summ, df_competition_totals)
+    score_cube = ScoreCube(compiled_weightings, storenames, iso_time_mins_list, factor_values)
+
+    if DEBUG_PRINT:
+        print(f'****INFO build_score_cube scored {len(storenames)} stores x {len(iso_time_mins_list)} drive times '
+              f'x {len(compiled_weightings.factor_names)} factors')
+    return score_cube
+
+
+def get_score_cube(storename, selected_storage_types):
+    """Returns the ScoreCube holding storename - from the precomputed views if they are ready
+    otherwise built here and held in session_state until its inputs change. None if it cannot be built"""
+    store_band_views = get_store_band_views()
+    if store_band_views is not None:
+        score_cube = store_band_views.get_score_cube(selected_storage_types)
+        if score_cube is not None and storename in score_cube.storenames:
+            return score_cube
+
+    storenames = list(st.session_state.get('selected_storenames') or [])
+    if storename not in storenames:
+        storenames.append(storename)
+    # The cube is only valid for the objects it was built from
+    cube_inputs = (st.session_state.get('gdf_competition'),
+                   st.session_state.get('df_demo_summ'),
+                   get_compiled_weightings())
+    cube_key = (tuple(sorted(selected_storage_types)), tuple(storenames))
+
+    cached = st.session_state.get('score_cube_cache')
+    if (cached is not None and cached[0] == cube_key
+            and all(cached_input is cube_input for cached_input, cube_input in zip(cached[1], cube_inputs))):
+        return cached[2]
+
+    score_cube = build_score_cube(storenames, selected_storage_types)
+    st.session_state.score_cube_cache = (cube_key, cube_inputs, score_cube)
+    return score_cube
+
+
+def render_weight_overrides(compiled_weightings):
+    """Renders the what-if weight inputs - returns the override weights (one per factor) or None if not in use
+    The inputs are percentages and start from the workbook weights"""
+    use_overrides = st.toggle('What-if weights',
+                              key='use_weight_overrides',
+                              help='Try other factor weights - the scores of every selected store update without recalculating the data')
+    if not use_overrides:
+        return None
+
+    if st.button('Reset to workbook weights'):
+        for name in compiled_weightings.factor_names:
+            st.session_state.pop(f'weight_override_{name}', None)
+
+    weights = []
+    columns = st.columns(3)
+    for i, (name, display_name, weight) in enumerate(zip(compiled_weightings.factor_names,
+                                                         compiled_weightings.display_names,
+                                                         compiled_weightings.weights)):
+        with columns[i % len(columns)]:
+            weight_perc = st.number_input(f'{display_name} (%)',
+                                          min_value=0.0,
+                                          max_value=100.0,
+                                          value=round(float(weight) * 100, 2),
+                                          step=1.0,
+                                          key=f'weight_override_{name}')
+        weights.append(weight_perc / 100)
 
+    total_weight_perc = sum(weights) * 100
+    if abs(total_weight_perc - 100) > 0.01:
+        st.warning(f'What-if weights total {round(total_weight_perc, 2)}% - the workbook weights total 100%')
+
+    return np.array(weights, dtype='float64')
 
 
 def render_score_table():
@@ -52,184 +134,43 @@ def render_score_table():
     print(f'**Processing Savills Score***')
     print(f'****************************')
 
+    _iso_time_mins = st.session_state.get("selected_drive_time")
+    _storename = st.session_state.get("selected_storename")
+    selected_storage_types = st.session_state.get("selected_storage_types")
+
+    # Validation checks
+    if not _iso_time_mins:
+        return st.error("Please select a drive time")
+    if not _storename:
+        return st.error("Please select a store name")
+    if not selected_storage_types:
+        return st.error("Please select at least one storage type")
 
-    try: 
-       
-        _iso_time_mins = st.session_state.get("selected_drive_time")
-        _storename = st.session_state.get("selected_storename")
-        selected_storage_types = st.session_state.get("selected_storage_types")
+    print(f'storename: {_storename } iso_time_mins: {_iso_time_mins}')
 
-        # Validation checks
-        if not _iso_time_mins:
-            return st.error("Please select a drive time")
-        if not _storename:
-            return st.error("Please select a store name")
-        if not selected_storage_types:
-            return st.error("Please select at least one storage type")
+    _compiled_weightings = get_compiled_weightings()
+    if _compiled_weightings is None:
+        print(f'!!!!WARNING render_score_table could not get the score weightings')
+        return
 
-        print(f'storename: {_storename } iso_time_mins: {_iso_time_mins}')
+    # Only the weighted sum is recalculated for override weights - the unweighted scores are cached in the cube
+    _override_weights = render_weight_overrides(_compiled_weightings)
 
-    except:
-        print(f'!!!!!WARNING render_score_table could not get storename or iso_time ')
+    # Lookup in the precomputed views - scored here if the background precompute has not finished
+    _score_table = None
+    _store_band_views = get_store_band_views()
+    if _override_weights is None and _store_band_views is not None:
+        _score_table = _store_band_views.get_score_table(_storename, _iso_time_mins, selected_storage_types)
 
+    _score_cube = None
+    if _score_table is None:
+        _score_cube = get_score_cube(_storename, selected_storage_types)
+        if _score_cube is None or (_storename, _iso_time_mins) not in _score_cube:
+            print(f'!!!!WARNING render_score_table could not score {_storename} {_iso_time_mins}')
+            return
+        _score_table = _score_cube.get_score_table(_storename, _iso_time_mins, weights=_override_weights)
 
-    _score_weightings = st.session_state.get("savills_score_weightings") 
-    if _score_weightings is None:
-        print(f'!!!!WARNING render_score_table could not get savills_score_weightings from session_state')
-        return
-    
-    output_factor_name = []
-    internal_factor_name = []
-    raw_value = []
-    weight = []
-    score_unweighted = []
-    score_weighted = []
-
-
-    for idx, row in _score_weightings.iterrows():
-       
-        # only process if this is a demand factor - supply handled later
-        if row.Supply_Demand == 'Supply':
-            continue
-
-        print(f'\tProcessing: {row.Display_Name}')
-        print(f'\tInternal name: {row.Internal_Name}')
-        print(f'\tWeight: {row.Weight}')
-
-        
-        _internal_name = row.Internal_Name
-        _weight = row.Weight
-        
-        weightings_dict = st.session_state.get('weightings_dict')
-        if weightings_dict is None:
-            print(f'!!!!WARNING could not get weightings_dict')
-            continue
-        else:
-            # only append values if we have managed to get data in
-            _df_scoring = weightings_dict.get(_internal_name)
-            if _df_scoring is not None:
-                _raw_value = get_data_value_from_df_demo_summ(storename=_storename,
-                                                              iso_time_mins=_iso_time_mins,
-                                                              data_col_name= _internal_name)
-                if _raw_value is None:
-                    print(f'!!!!WARNING render_score_table could not get a value for {_internal_name}')
-                try:
-                    _unweighted_score = get_score_from_value(_df_scoring, _raw_value)
-                    print(f'****INFO _unweighted_score: {_unweighted_score}')
-                except:
-                    print(f'!!!!WARNING could not get _unweighted_score')
-                    continue
-                
-                raw_value.append(_raw_value)
-                score_unweighted.append(_unweighted_score)
-                output_factor_name.append(row.Display_Name)
-                internal_factor_name.append(_internal_name)
-                _display_weight = round(_weight * 100,2)
-                weight.append(f'{_display_weight}%')
-                _weighted_score = round((_weight * _unweighted_score) / SCORE_ROUNDING_MULTIPLE,0) * SCORE_ROUNDING_MULTIPLE
-                score_weighted.append(_weighted_score) 
-
-    # now need to add the two supply side factors
-    _total_popn_in_iso =  get_data_value_from_df_demo_summ(storename=_storename, 
-                                     iso_time_mins=_iso_time_mins, 
-                                     data_col_name='Total_Popn')
-    print(f'****INFO render_score_table total_popn: {_total_popn_in_iso} ')
-    
-    _gdf_competition = get_output_competition(drive_time=_iso_time_mins,
-                                            storename=_storename,
-                                            selected_storage_types=selected_storage_types)
-    if _gdf_competition is not None:
-        print(f'****INFO render_score_table _gdf_competition {_gdf_competition.columns}')
-        _competition_summary = summarise_competition(_gdf_competition)
-
-        print(f"****INFO _competition_summary")
-        print(f"{_competition_summary}")
-        
-        # Check dataframe is not None - as this is the error value from _competiton summary
-        if _competition_summary is None:
-            print("!!!!WARNING No competition data available")
-            total_cla = 0
-            total_stores = 0
-            stores_per_person = None
-            cla_per_person = None
-        else:
-            # Use .iloc[0] for first row regardless of index
-            total_cla = _competition_summary.iloc[0]['store_cla']
-            total_stores = _competition_summary.iloc[0]['competition_count']
-            
-            ##############################
-            ## STORES PER PERSON
-            ##############################
-            # Check for division by zero - stores per person
-            if total_stores > 0 and _total_popn_in_iso > 0:
-                
-                stores_per_person = round(_total_popn_in_iso / total_stores,0)
-
-                weight_values = _score_weightings.loc[_score_weightings['Internal_Name'] == 'People_per_store', 'Weight'].values
-                if len(weight_values) > 0:
-                    _weight = weight_values[0]
-                    raw_value.append(stores_per_person)
-                    output_factor_name.append('People per store')
-                    internal_factor_name.append('People_per_store')
-                    _df_scoring = weightings_dict.get('People_per_store')
-                    _unweighted_score = get_score_from_value(_df_scoring, stores_per_person)
-                    score_unweighted.append(_unweighted_score)
-                    print(f'****INFO _unweighted_score: {_unweighted_score}')
-                    _display_weight = round(_weight * 100,2)
-                    weight.append(f'{_display_weight}%')
-                    _weighted_score = round((_weight * _unweighted_score) / SCORE_ROUNDING_MULTIPLE,0) * SCORE_ROUNDING_MULTIPLE
-                    score_weighted.append(_weighted_score) 
-                else:
-                    print(f"!!!!WARNING: No weight found for People_per_store")
-
-            else:
-                stores_per_person = None
-                print("!!!!Warning: No stores to calculate stores per person ratio")
-            
-            ##############################
-            #### CLA Per person
-            #############################
-
-            # Check for division by zero - CLA per person
-            if pd.notna(_total_popn_in_iso) and _total_popn_in_iso > 0:
-
-                cla_per_person = round(total_cla / _total_popn_in_iso,2)
-
-                weight_values = _score_weightings.loc[_score_weightings['Internal_Name'] == 'CLA_per_person', 'Weight'].values
-                if len(weight_values) > 0:
-                    _weight = weight_values[0]
-                    raw_value.append(cla_per_person)
-                    output_factor_name.append('CLA per person')
-                    internal_factor_name.append('CLA_per_person')
-                    _df_scoring = weightings_dict.get('CLA_per_person')
-                    _unweighted_score = get_score_from_value(_df_scoring, cla_per_person)
-                    score_unweighted.append(_unweighted_score)
-                    print(f'****INFO _unweighted_score: {_unweighted_score}')
-                    _display_weight = round(_weight * 100,2)
-                    weight.append(f'{_display_weight}%')
-                    _weighted_score = round((_weight * _unweighted_score) / SCORE_ROUNDING_MULTIPLE,0) * SCORE_ROUNDING_MULTIPLE
-                    score_weighted.append(_weighted_score) 
-                else:
-                    print(f"!!!!WARNING: No weight found for CLA_per_person")
-            else:
-                cla_per_person = None
-                print("!!!!Warning: Invalid population to calculate CLA per person")
-
-    print(f'*****INFO checking length of outputs lists for _output_df')
-    _output_lists = [output_factor_name, raw_value, score_unweighted, weight, score_weighted]
-    for _output_list in _output_lists:
-        print(f'\t{len(_output_list)}')
-
-    _output_df = pd.DataFrame({
-        'Factor':output_factor_name,
-        'Factor Value': raw_value,
-        'Score (unweighted)': score_unweighted,
-        'Weight': weight,
-        'Weighted Score': score_weighted,
-    })
-
-    _overall_score = _output_df['Weighted Score'].sum()
-    _overall_score_rounded = round(_overall_score / SCORE_ROUNDING_MULTIPLE,0) * SCORE_ROUNDING_MULTIPLE
+    _output_df, _overall_score_rounded = _score_table
 
     # Streamlit will render these at this point
     _rendered_df = st.dataframe(_output_df, 
@@ -239,6 +180,10 @@ def render_score_table():
 
     _output_text = st.write(f'Savills Self Storage Score: {_overall_score_rounded} / 10')
 
-
-
-
+    if _override_weights is not None:
+        # Every selected store is rescored with the override weights on the same rerun
+        _df_overall_scores = _score_cube.get_overall_scores_df(weights=_override_weights)
+        _df_base_scores = _score_cube.get_overall_scores_df()
+        st.write(f'What-if scores for every selected store - workbook weights score for {_storename}: '
+                 f'{_df_base_scores.at[_storename, _iso_time_mins]} / 10')
+        st.dataframe(_df_overall_scores.rename(columns=lambda iso_time_mins: f'{iso_time_mins} mins'))
@@ -0,0 +1,190 @@
+import json
+import numpy as np
+import shapely
+import folium
+import branca.colormap as cm
+
+from utils.topojson_utils import encode_topojson, get_payload_bytes
+
+from config.constants import (DEBUG_PRINT,
+                              CHOROPLETH_N_CLASSES,
+                              CHOROPLETH_CMAP,
+                              CHOROPLETH_LOD_TOLERANCES_DEG,
+                              CHOROPLETH_LOD_TARGET_PX,
+                              CHOROPLETH_COORD_PRECISION_DEG)
+
+"""This module prepares the demographic choropleth layers
+The display geometry of a band is simplified and serialized once per level of detail (LOD) tolerance
+as a DisplayGeometry shared by every metric of the band
+A ChoroplethLayer is built once per (metric, store, band) - it only holds the class breaks and the
+properties of each feature with its fill style, so rendering a cached layer only pairs its properties
+with the shared geometry. The style is read from the feature properties in the browser - no Python
+style callback runs on a rerun
+The TopoJSON encoding of a LOD is opt-in and built on first use
+"""
+
+MISSING_VALUE_COLOR = '#cccccc'
+TOPOJSON_OBJECT_NAME = 'demo'
+
+
+def simplify_display_geometry(geoms, tolerance):
+    """Returns the 4326 geoms simplified at tolerance and snapped to the display precision"""
+    simplified = shapely.simplify(geoms, tolerance, preserve_topology=True)
+    return shapely.set_precision(simplified, CHOROPLETH_COORD_PRECISION_DEG)
+
+
+def get_class_breaks(values, n_classes=CHOROPLETH_N_CLASSES):
+    """Returns the quantile class breaks (n_classes + 1 edges at most) of the non null values"""
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return np.array([])
+    return np.unique(np.quantile(values, np.linspace(0, 1, n_classes + 1)))
+
+
+def get_class_colors(n_classes):
+    """Returns one hex colour per class from CHOROPLETH_CMAP"""
+    colormap = getattr(cm.linear, CHOROPLETH_CMAP).scale(0, max(n_classes - 1, 1))
+    return [colormap.rgb_hex_str(i) for i in range(n_classes)]
+
+
+def select_lod_tolerance(bounds):
+    """Returns the coarsest LOD tolerance that is still below one display pixel for bounds [[s, w], [n, e]]"""
+    if bounds is None:
+        return max(CHOROPLETH_LOD_TOLERANCES_DEG)
+    (south, west), (north, east) = bounds
+    pixel_size_deg = max(north - south, east - west) / CHOROPLETH_LOD_TARGET_PX
+    tolerances = sorted(CHOROPLETH_LOD_TOLERANCES_DEG)
+    fitting = [tolerance for tolerance in tolerances if tolerance <= pixel_size_deg]
+    return fitting[-1] if fitting else tolerances[0]
+
+
+class DisplayGeometry:
+    """One LOD of the display geometry of a band - shared by every metric of the band
+    The GeoJSON geometry is serialized once - features only add the properties of a metric
+    prebuilt_geoms (optional) is aligned with geoms - the prebuilt display geometry of a piece (already simplified
+    at tolerance) or None where the piece is simplified here"""
+
+    def __init__(self, geoms, tolerance, prebuilt_geoms=None):
+        if prebuilt_geoms is None:
+            self.geoms = simplify_display_geometry(geoms, tolerance)
+        else:
+            self.geoms = np.asarray(prebuilt_geoms, dtype=object).copy()
+            is_missing = shapely.is_missing(self.geoms)
+            if is_missing.any():
+                self.geoms[is_missing] = simplify_display_geometry(np.asarray(geoms)[is_missing], tolerance)
+        geojson_geoms = shapely.to_geojson(self.geoms)
+        self.geojson_bytes = sum(len(geojson_geom) for geojson_geom in geojson_geoms)
+        self.geojson_geoms = [json.loads(geojson_geom) for geojson_geom in geojson_geoms]
+        self._topojson = None
+
+    def get_geojson(self, properties):
+        """Returns a GeoJSON FeatureCollection dict of the shared geometry with one properties dict per geom"""
+        return {'type': 'FeatureCollection',
+                'features': [{'type': 'Feature', 'id': str(i), 'properties': feature_properties, 'geometry': geometry}
+                             for i, (feature_properties, geometry) in enumerate(zip(properties, self.geojson_geoms))]}
+
+    def get_topojson(self, properties):
+        """Returns a TopoJSON topology dict of the shared arcs with one properties dict per geom"""
+        if self._topojson is None:
+            self._topojson = encode_topojson(self.geoms, [{}] * len(self.geoms), TOPOJSON_OBJECT_NAME)
+        geometries = self._topojson['objects'][TOPOJSON_OBJECT_NAME]['geometries']
+        return {**self._topojson,
+                'objects': {TOPOJSON_OBJECT_NAME: {'type': 'GeometryCollection',
+                                                   'geometries': [{**geometry, 'properties': feature_properties}
+                                                                  for geometry, feature_properties
+                                                                  in zip(geometries, properties)]}}}
+
+    def topojson_bytes(self):
+        """Returns the size of the arcs and transform - the geometries only hold arc references"""
+        self.get_topojson([])
+        return get_payload_bytes({key: value for key, value in self._topojson.items() if key != 'objects'})
+
+    def memory_usage_bytes(self):
+        """Returns the approximate size held - the serialized size of the geometry and of any TopoJSON"""
+        return self.geojson_bytes + (self.topojson_bytes() if self._topojson is not None else 0)
+
+
+class ChoroplethLayer:
+    """Choropleth of one metric of one store / drive time - the class breaks and the properties
+    (value and fill style) of each feature. get_display_geometry(tolerance) returns the shared DisplayGeometry"""
+
+    def __init__(self, metric, values, get_display_geometry):
+        self.metric = metric
+        self.values = values
+        self.breaks = get_class_breaks(values)
+        self.colors = get_class_colors(max(len(self.breaks) - 1, 1))
+        self.fill_colors = get_feature_colors(values, self.breaks, self.colors)
+        # One style dict per colour - shared by the features of that class
+        styles = {fill_color: _get_fill_style(fill_color) for fill_color in set(self.fill_colors)}
+        self.properties = [{metric: None if np.isnan(value) else float(value), 'style': styles[fill_color]}
+                           for value, fill_color in zip(values, self.fill_colors)]
+        self.properties_bytes = get_payload_bytes(self.properties)
+        self._get_display_geometry = get_display_geometry
+
+    def get_legend(self):
+        """Returns the step colormap legend for the class breaks - or None if there are no values"""
+        if len(self.breaks) < 2:
+            return None
+        return cm.StepColormap(self.colors, index=list(self.breaks),
+                               vmin=self.breaks[0], vmax=self.breaks[-1], caption=self.metric)
+
+    def get_geojson(self, tolerance):
+        return self._get_display_geometry(tolerance).get_geojson(self.properties)
+
+    def get_topojson(self, tolerance):
+        """Returns the TopoJSON topology of a LOD - the style is held in each geometry's properties"""
+        return self._get_display_geometry(tolerance).get_topojson(self.properties)
+
+    def payload_bytes(self, tolerance):
+        return self._get_display_geometry(tolerance).geojson_bytes + self.properties_bytes
+
+    def topojson_payload_bytes(self, tolerance):
+        return self._get_display_geometry(tolerance).topojson_bytes() + self.properties_bytes
+
+
+def get_feature_colors(values, breaks, colors):
+    """Returns the fill colour of each value from the class breaks"""
+    if len(breaks) == 0:
+        return [MISSING_VALUE_COLOR] * len(values)
+    class_idx = np.searchsorted(breaks[1:-1], values, side='right')
+    return [MISSING_VALUE_COLOR if np.isnan(value) else colors[idx]
+            for value, idx in zip(values, class_idx)]
+
+
+def build_choropleth_layer(metric, values, get_display_geometry):
+    """Returns a ChoroplethLayer for the values of one band
+    get_display_geometry(tolerance) returns the shared DisplayGeometry of the band in values order"""
+    values = np.asarray(values, dtype='float64')
+    layer = ChoroplethLayer(metric, values, get_display_geometry)
+
+    if DEBUG_PRINT:
+        print(f'****INFO build_choropleth_layer {metric} {len(values)} pieces - '
+              f'properties {layer.properties_bytes / 1e3:.0f} kB')
+
+    return layer
+
+
+def _get_fill_style(fill_color):
+    return {'fillColor': fill_color,
+            'color': fill_color,
+            'weight': 0.5,
+            'fillOpacity': 0.6}
+
+
+def add_choropleth_layer_to_map(m, layer, tolerance, use_topojson=False):
+    """Adds the cached LOD of the layer and its legend to folium map m
+    The data is passed as a dict (nothing to parse) and styled from each feature's properties
+    use_topojson sends the TopoJSON encoding of the LOD instead of GeoJSON"""
+    if use_topojson:
+        folium.TopoJson(layer.get_topojson(tolerance),
+                        f'objects.{TOPOJSON_OBJECT_NAME}',
+                        name=layer.metric,
+                        tooltip=folium.GeoJsonTooltip(fields=[layer.metric])).add_to(m)
+    else:
+        # Without a style_function folium styles each feature from feature.properties.style
+        folium.GeoJson(layer.get_geojson(tolerance),
+                       name=layer.metric,
+                       tooltip=folium.GeoJsonTooltip(fields=[layer.metric])).add_to(m)
+    legend = layer.get_legend()
+    if legend is not None:
+        legend.add_to(m)
@@ -6,11 +6,13 @@ from html import escape
 import folium
 from streamlit_folium import st_folium
 
-from utils.load_save_data_files_utils import get_ssdb_from_ss, get_store_isos_from_ss
+from utils.load_save_data_files_utils import get_ssdb_from_ss, get_store_isos_from_ss, get_debug_output_path
 
 from utils.spatial_processing_utils import check_crs_match, get_bounds_from_gdf
 from utils.dataframe_handling_utils import all_required_cols_in_df
 from utils.spatial_calculations_utils import haversine_distance_km
+from utils.topojson_utils import encode_topojson, get_payload_bytes, format_payload_comparison
+from utils.store_band_views_utils import get_store_band_views
 
 from config.constants import (DEBUG_PRINT, 
                               DEFAULT_TILE_LAYER, 
@@ -18,6 +20,8 @@ from config.constants import (DEBUG_PRINT,
                               POP_UP_MAX_WIDTH_PX,
                               HTML_BODY_FONT_SIZE,
                               HTML_H4_FONT_SIZE,
+                              USE_TOPOJSON_LAYERS_DEFAULT,
+                              SSDB_ID_COL,
                                 HTML_LINE_HEIGHT )
 
 def process_competition_with_isochrones():
@@ -36,20 +40,55 @@ def process_competition_with_isochrones():
             print(f'!!!!WARNING process_competition_with_isochrones found missing cols from gdf_ssdb_4326')
         return None
     # Filter and rename 
-    gdf_ssdb_4326 = gdf_ssdb_4326[required_ssdb_cols]
-    gdf_ssdb_4326.rename(columns={'storename':'Competitor'}, inplace=True) # OTherwise this will match storename from isos
+    gdf_ssdb_4326 = get_competition_ssdb_cols(gdf_ssdb_4326)
 
     # get the isochrones from session_state
+    gdf_store_isos_4236 = get_competition_isos_from_ss()
+    if gdf_store_isos_4236 is None:
+        return None
+
+    gdf_comp_in_iso_4326 = get_competition_in_isochrones(gdf_ssdb_4326, gdf_store_isos_4236)
+    
+    if DEBUG_PRINT:
+        print(f'****INFO process_competition_with_isochrones joined gdf_store_isos_4236, gdf_ssdb_4326')
+        print(f'****INFO process_competition_with_isochrones {gdf_comp_in_iso_4326.columns}')
+
+        try:
+            fpath_test = get_debug_output_path('test_competition.gpkg')
+            gdf_comp_in_iso_4326.to_file(fpath_test, 
+                                 driver='GPKG')
+            print(f'****INFO Successfully save gdf_comp_in_iso_4326 to {fpath_test}')
+        except:
+            print(f'!!!!WARNING failed to save test version of gdf_comp_in_iso_4326')
+
+    return gdf_comp_in_iso_4326
+
+
+def get_competition_ssdb_cols(gdf_ssdb_4326):
+    """Returns the ssdb columns used for the competition with storename renamed Competitor
+    SSDB_ID_COL is kept if the ssdb has it so the competition can be updated store by store"""
+    _ssdb_cols = ['storename', 'address', 'city', 'area_unit', 'store_mla', 'store_cla' ,'ss_type',  'geometry']
+    if SSDB_ID_COL in gdf_ssdb_4326.columns:
+        _ssdb_cols = [SSDB_ID_COL] + _ssdb_cols
+    # OTherwise this will match storename from isos
+    return gdf_ssdb_4326[_ssdb_cols].rename(columns={'storename':'Competitor'})
+
+
+def get_competition_isos_from_ss():
+    """Returns the isos from session_state with the columns used for the competition - or None"""
     gdf_store_isos_4236 = get_store_isos_from_ss()
     required_iso_cols = ['storename', 'iso_time_mins', 'latitude', 'longitude', 'geometry']
     if not all_required_cols_in_df(gdf_store_isos_4236, required_iso_cols):
         if DEBUG_PRINT:
-            print(f'!!!!WARNING process_competition_with_isochrones found missing cols from gdf_store_isos_4236')
+            print(f'!!!!WARNING get_competition_isos_from_ss found missing cols from gdf_store_isos_4236')
         return None
     # Filter and rename
-    gdf_store_isos_4236 = gdf_store_isos_4236[required_iso_cols]
-    gdf_store_isos_4236.rename(columns={'latitude': 'src_latitude', 'longitude':'src_longitude'}, inplace=True)
+    return gdf_store_isos_4236[required_iso_cols].rename(columns={'latitude': 'src_latitude', 'longitude':'src_longitude'})
+
 
+def get_competition_in_isochrones(gdf_ssdb_4326, gdf_store_isos_4236):
+    """Returns gdf of each ssdb store in each iso (from get_competition_ssdb_cols / get_competition_isos_from_ss)
+    with the distance to the subject store and the popup html - sorted by store, drive time and distance"""
     # Check that the crs match - expected that these will both be 4236
     check_crs_match(gdf_store_isos_4236, gdf_ssdb_4326, raise_error=True)
 
@@ -76,24 +115,17 @@ def process_competition_with_isochrones():
         gdf_comp_in_iso_4326[col] = pd.to_numeric(gdf_comp_in_iso_4326[col], errors='coerce')
 
     # Create html for popup
-    gdf_comp_in_iso_4326['popup_text'] = gdf_comp_in_iso_4326.apply(create_popup_text_html, axis=1)
+    # (apply returns an empty DataFrame when no stores are in the isos)
+    gdf_comp_in_iso_4326['popup_text'] = (gdf_comp_in_iso_4326.apply(create_popup_text_html, axis=1)
+                                           if not gdf_comp_in_iso_4326.empty else '')
 
-    gdf_comp_in_iso_4326 = gdf_comp_in_iso_4326.sort_values(by=['storename', 'iso_time_mins', 'distance_km'], 
-                                                            ascending=[True, True, True])
-    
-    if DEBUG_PRINT:
-        print(f'****INFO process_competition_with_isochrones joined gdf_store_isos_4236, gdf_ssdb_4326')
-        print(f'****INFO process_competition_with_isochrones {gdf_comp_in_iso_4326.columns}')
+    return sort_competition(gdf_comp_in_iso_4326)
 
-        try:
-            fpath_test = r'D:\D_documents\OldCo\Savills\Scripts\SSST_V2\assets\data\test_competition.gpkg'
-            gdf_comp_in_iso_4326.to_file(fpath_test, 
-                                 driver='GPKG')
-            print(f'****INFO Successfully save gdf_comp_in_iso_4326 to {fpath_test}')
-        except:
-            print(f'!!!!WARNING failed to save test version of gdf_comp_in_iso_4326')
 
-    return gdf_comp_in_iso_4326
+def sort_competition(gdf_competition):
+    """Returns the competition sorted by store, drive time and distance"""
+    return gdf_competition.sort_values(by=['storename', 'iso_time_mins', 'distance_km'], 
+                                       ascending=[True, True, True])
 
 def get_output_iso(drive_time, storename):
     """This function gets the iso for the specified drive time 
@@ -102,6 +134,10 @@ def get_output_iso(drive_time, storename):
     if (_gdf_isos is None or drive_time is None or storename is None): 
         print(f'!!!!WARNING get_output_iso could not get gdf_isos from session_state or storename or drivetime was None')
         return None
+    # Lookup in the precomputed views once the background precompute has finished
+    _store_band_views = get_store_band_views()
+    if _store_band_views is not None:
+        return _store_band_views.get_output_iso(storename, drive_time)
     _gdf_isos_filtered = _gdf_isos[(_gdf_isos.iso_time_mins == drive_time) & (_gdf_isos.storename == storename)].copy()
     if _gdf_isos_filtered.empty:
         print(f'!!!!WARNING get_output_iso could not find matches for {storename} {drive_time}')
@@ -120,6 +156,13 @@ def get_output_competition(drive_time, storename, selected_storage_types):
     if (_gdf_comp is None or drive_time is None or storename is None or not selected_storage_types): 
         print(f'!!!!WARNING get_output_competition missing required parameters')
         return None
+
+    _store_band_views = get_store_band_views()
+    if _store_band_views is not None:
+        _gdf_comp_filtered = _store_band_views.get_output_competition(storename, drive_time, selected_storage_types)
+        if _gdf_comp_filtered is None:
+            print(f'!!!!WARNING get_output_competition no matches for {storename} {drive_time} with selected types')
+        return _gdf_comp_filtered
     
     _gdf_comp_filtered = _gdf_comp[
         (_gdf_comp.iso_time_mins == drive_time) & 
@@ -264,10 +307,17 @@ def render_competition_map():
             'opacity': 0.8
         }
         if gdf_output_iso is not None:
-            folium.GeoJson(
-                gdf_output_iso.iloc[0].geometry.__geo_interface__,
-                style_function=lambda x: iso_style
-            ).add_to(m)
+            if st.session_state.get('use_topojson_layers', USE_TOPOJSON_LAYERS_DEFAULT):
+                # Style is held in the properties so no style_function is needed
+                iso_topojson = encode_topojson(gdf_output_iso.geometry.values[:1], [{'style': iso_style}], 'iso')
+                folium.TopoJson(iso_topojson, 'objects.iso').add_to(m)
+                st.caption(format_payload_comparison(get_payload_bytes(gdf_output_iso.iloc[0].geometry.__geo_interface__),
+                                                     get_payload_bytes(iso_topojson)))
+            else:
+                folium.GeoJson(
+                    gdf_output_iso.iloc[0].geometry.__geo_interface__,
+                    style_function=lambda x: iso_style
+                ).add_to(m)
         
         ###################################################################
         # Add competition - competition is any store where distance is greater than 0
@@ -0,0 +1,231 @@
+import geopandas as gpd
+
+from utils.spatial_processing_utils import check_crs_match
+from utils.asset_build_utils import MSOA_21_ID_COL
+from config.constants import CRS, SQM_IN_SQKM, ZONE_AREA_COL
+
+"""This module is the registry of the demographic layers overlaid with the isochrones
+Each base dataset is a DemoLayerSpec that declares its columns as
+    extensive - counts, apportioned to each overlay piece by area fraction and summed
+    intensive - rates / prices, area-weighted mean across the pieces
+    derived   - ratio of two aggregates (eg households / population) calculated after the sum
+compute_demo_layer runs any spec in a single overlay pass - a new dataset only needs a spec
+added to DEMO_LAYER_REGISTRY (or passed to register_demo_layer)
+"""
+
+EXTENSIVE = 'extensive'
+INTENSIVE = 'intensive'
+DERIVED = 'derived'
+
+# Area of each overlay piece - can be used as the denominator of a derived column
+AREA_COL = 'area_sqkm'
+# Display column of the id of the base zone a piece covers whole - None where the piece is clipped
+# by the isochrone. Whole zones are drawn from their prebuilt display geometry (see display_geometry_utils)
+ZONE_ID_COL = 'zone_id'
+# A piece covers its whole zone if its area is within this fraction of the zone area
+WHOLE_ZONE_AREA_TOL = 1e-6
+
+_GROUPBY_COLS = ['storename', 'iso_time_mins']
+
+
+class DemoColumn:
+    """One column of a demographic layer
+    source        - column in the base layer (defaults to name) - not used by derived columns
+    divisor       - intensive values are divided by this first (eg 1_000 to show in ,000s)
+    numerator / denominator - names of extensive columns (or AREA_COL) a derived column is the ratio of
+    multiplier / decimals   - derived and intensive summary values are multiplied then rounded - 0 decimals gives int
+    in_summary    - whether the aggregate is output to df_demo_summ
+    display_name  - name of the column on the overlay pieces for the maps (None is not shown)
+    display_source - for derived columns - base column shown on the pieces. If None the ratio is
+                    calculated from the zone values of the numerator / denominator sources"""
+
+    def __init__(self, name, kind, source=None, divisor=1, numerator=None, denominator=None,
+                 multiplier=1, decimals=0, in_summary=True, display_name=None, display_source=None):
+        if kind not in (EXTENSIVE, INTENSIVE, DERIVED):
+            raise ValueError(f'!!!!WARNING DemoColumn {name} has unknown kind {kind}')
+        if kind == DERIVED and (numerator is None or denominator is None):
+            raise ValueError(f'!!!!WARNING DemoColumn {name} is derived but missing numerator / denominator')
+        self.name = name
+        self.kind = kind
+        self.source = source if source is not None else name
+        self.divisor = divisor
+        self.numerator = numerator
+        self.denominator = denominator
+        self.multiplier = multiplier
+        self.decimals = decimals
+        self.in_summary = in_summary
+        self.display_name = display_name
+        self.display_source = display_source
+
+
+class DemoLayerSpec:
+    """A base dataset and the columns to aggregate from it
+    layer_key matches DATA_FILES / the shared planar base layers
+    zone_id_col - unique zone id column of the base layer - if set the pieces covering a whole zone
+                  carry its id in ZONE_ID_COL (None does not add the column)"""
+
+    def __init__(self, layer_key, app_data_key, test_name, columns, zone_id_col=None):
+        self.layer_key = layer_key
+        self.app_data_key = app_data_key
+        self.test_name = test_name
+        self.columns = columns
+        self.zone_id_col = zone_id_col
+
+    def get_columns(self, kind):
+        return [col for col in self.columns if col.kind == kind]
+
+    def get_column(self, name):
+        for col in self.columns:
+            if col.name == name:
+                return col
+        raise KeyError(f'!!!!WARNING DemoLayerSpec {self.layer_key} has no column {name}')
+
+    def get_base_cols(self):
+        """Returns the base layer columns the spec needs (excluding geometry)"""
+        base_cols = [col.source for col in self.columns if col.kind != DERIVED]
+        base_cols += [col.display_source for col in self.get_columns(DERIVED)
+                      if col.display_name and col.display_source]
+        if self.get_columns(EXTENSIVE) or self.zone_id_col:
+            base_cols.append(ZONE_AREA_COL)
+        if self.zone_id_col:
+            base_cols.append(self.zone_id_col)
+        return list(dict.fromkeys(base_cols))
+
+
+# The order here is the order the outputs are merged into df_demo_summ and gdf_demo
+DEMO_LAYER_REGISTRY = [
+    DemoLayerSpec('msoa_22', 'gdf_popn', 'popn', [
+        # LA rents are attached to each 2021 msoa from the LA it sits in (see asset_build_utils)
+        DemoColumn('Rents_Oct_2024', INTENSIVE, display_name='Rents_Oct_2024'),
+        # Household income is based on 2011 msoa codes - it is projected onto the 2021 zones
+        # through the msoa crosswalk (see asset_build_utils) so it shares the popn intersection
+        DemoColumn('HouseholdIncMar2020', INTENSIVE, display_name='HouseholdIncMar2020'),
+        DemoColumn('Total Households', EXTENSIVE, display_name='Total Households'),
+        DemoColumn('Total_Popn', EXTENSIVE, display_name='Total_Popn'),
+        DemoColumn('total_owners', EXTENSIVE, in_summary=False),
+        DemoColumn('total_renters', EXTENSIVE, in_summary=False),
+        DemoColumn('1 person in household', EXTENSIVE, in_summary=False),
+        DemoColumn('Resi_Sales_YE_Mar2024', EXTENSIVE, in_summary=False),
+        DemoColumn('LTE_3rooms', EXTENSIVE, in_summary=False),
+        DemoColumn('Single_Person_HH_Perc', DERIVED, numerator='1 person in household', denominator='Total Households',
+                   multiplier=100, decimals=2, display_name='Single_Person_HH_Perc', display_source='Single_Person_HH_Perc'),
+        DemoColumn('Popn_Density', DERIVED, numerator='Total_Popn', denominator=AREA_COL,
+                   display_name='Popn_Density', display_source='Popn_Density'),
+        DemoColumn('Owner_Occ_Perc', DERIVED, numerator='total_owners', denominator='Total Households',
+                   multiplier=100, decimals=2, display_name='Owner_Occ_Perc', display_source='Owner_Occ_Perc'),
+        DemoColumn('Avg_HH_Size', DERIVED, numerator='Total_Popn', denominator='Total Households',
+                   decimals=2, display_name='Avg_HH_Size', display_source='Avg_HH_Size'),
+        DemoColumn('trans_per_hh_perc', DERIVED, numerator='Resi_Sales_YE_Mar2024', denominator='Total Households',
+                   multiplier=100, decimals=2, display_name='trans_per_hh_perc'),
+        DemoColumn('LTE3_rooms_perc', DERIVED, numerator='LTE_3rooms', denominator='Total Households',
+                   multiplier=100, decimals=2, display_name='LTE_3Rooms_perc', display_source='LTE_3Rooms_perc'),
+        # Shown in ,000s
+        DemoColumn('Med_House_Price_YE_Mar2024', INTENSIVE, divisor=1_000, display_name='Med_House_Price_YE_Mar2024'),
+    ], zone_id_col=MSOA_21_ID_COL),
+]
+
+
+def register_demo_layer(spec):
+    """Adds a spec to the registry - replaces any spec with the same layer_key"""
+    DEMO_LAYER_REGISTRY[:] = [_spec for _spec in DEMO_LAYER_REGISTRY if _spec.layer_key != spec.layer_key]
+    DEMO_LAYER_REGISTRY.append(spec)
+
+
+def get_demo_layer_spec(layer_key):
+    for spec in DEMO_LAYER_REGISTRY:
+        if spec.layer_key == layer_key:
+            return spec
+    raise KeyError(f'!!!!WARNING get_demo_layer_spec no spec registered for {layer_key}')
+
+
+def _get_ratio(numerator, denominator, col):
+    """Returns numerator / denominator * multiplier rounded to the column decimals"""
+    ratio = numerator.div(denominator).fillna(0)
+    if col.multiplier != 1:
+        ratio = ratio.mul(col.multiplier)
+    if col.decimals == 0:
+        return ratio.round(0).astype(int)
+    return ratio.round(col.decimals)
+
+
+def compute_demo_layer(spec, gdf_isos, gdf_base):
+    """Overlays the isochrones with the base layer of a spec and aggregates every column in one pass
+    Both gdfs must be in planar crs - does not touch session_state so can be run in a worker process
+    Returns df of the summary columns per store / iso_time_mins
+    Plus gdf (4326) of the overlay pieces with the display columns"""
+
+    _base_cols = spec.get_base_cols() + ['geometry']
+    missing_cols = [col for col in _base_cols if col not in gdf_base.columns]
+    if len(missing_cols) > 0:
+        raise KeyError(f'!!!!WARNING missing columns from {spec.layer_key} in compute_demo_layer: {missing_cols}')
+
+    check_crs_match(gdf_isos, gdf_base, raise_error=True)
+
+    # Both are in planar crs so the overlay output can be measured directly
+    gdf_overlaid = gpd.overlay(gdf_isos,
+                               gdf_base[_base_cols],
+                               how='intersection',
+                               keep_geom_type=False,
+                               make_valid=True)
+    gdf_overlaid[AREA_COL] = gdf_overlaid.geometry.area / SQM_IN_SQKM
+
+    extensive_cols = spec.get_columns(EXTENSIVE)
+    intensive_cols = spec.get_columns(INTENSIVE)
+    derived_cols = spec.get_columns(DERIVED)
+    # The zone values of the numerator / denominator of a derived column - a zone value per area is per zone area
+    sources = {col.name: col.source for col in extensive_cols}
+    sources[AREA_COL] = ZONE_AREA_COL
+
+    # Pieces show derived values of the whole zone - calculated before the counts are apportioned
+    df_display = gdf_overlaid[_GROUPBY_COLS].copy()
+    for col in derived_cols:
+        if col.display_name is None:
+            continue
+        if col.display_source:
+            df_display[col.display_name] = gdf_overlaid[col.display_source]
+        else:
+            df_display[col.display_name] = _get_ratio(gdf_overlaid[sources[col.numerator]],
+                                                      gdf_overlaid[sources[col.denominator]], col)
+
+    # Counts are apportioned by the share of the zone captured
+    if extensive_cols:
+        area_perc = gdf_overlaid[AREA_COL].div(gdf_overlaid[ZONE_AREA_COL]).fillna(0)
+    df_pieces = gdf_overlaid[_GROUPBY_COLS + [AREA_COL]].copy()
+    for col in extensive_cols:
+        df_pieces[col.name] = gdf_overlaid[col.source].mul(area_perc).round(0).astype(int)
+    for col in intensive_cols:
+        values = gdf_overlaid[col.source].div(col.divisor) if col.divisor != 1 else gdf_overlaid[col.source]
+        df_pieces[col.name] = values
+        # Pieces without a value are left out of the weighting
+        has_value = values.notna()
+        df_pieces[f'_weighted_{col.name}'] = values.mul(gdf_overlaid[AREA_COL]).where(has_value, 0)
+        df_pieces[f'_area_{col.name}'] = gdf_overlaid[AREA_COL].where(has_value, 0)
+
+    for col in extensive_cols + intensive_cols:
+        if col.display_name is not None:
+            df_display[col.display_name] = df_pieces[col.name]
+
+    _sum_cols = ([col.name for col in extensive_cols]
+                 + [f'_weighted_{col.name}' for col in intensive_cols]
+                 + [f'_area_{col.name}' for col in intensive_cols]
+                 + [AREA_COL])
+    df_groupby = df_pieces.groupby(_GROUPBY_COLS)[_sum_cols].sum().reset_index()
+
+    for col in intensive_cols:
+        df_groupby[col.name] = _get_ratio(df_groupby[f'_weighted_{col.name}'], df_groupby[f'_area_{col.name}'], col)
+    for col in derived_cols:
+        df_groupby[col.name] = _get_ratio(df_groupby[col.numerator], df_groupby[col.denominator], col)
+
+    _summary_cols = [col.name for col in spec.columns if col.in_summary]
+    df_demo_output = df_groupby[_GROUPBY_COLS + _summary_cols]
+
+    _display_cols = [col.display_name for col in spec.columns if col.display_name is not None]
+    if spec.zone_id_col:
+        is_whole_zone = gdf_overlaid[AREA_COL] >= gdf_overlaid[ZONE_AREA_COL] * (1 - WHOLE_ZONE_AREA_TOL)
+        df_display[ZONE_ID_COL] = gdf_overlaid[spec.zone_id_col].where(is_whole_zone, None)
+        _display_cols.append(ZONE_ID_COL)
+    df_display = df_display[_GROUPBY_COLS + _display_cols]
+    # Only the overlay output is reprojected - and only for display
+    gdf_demo_output = gpd.GeoDataFrame(df_display, geometry=gdf_overlaid.geometry, crs=gdf_overlaid.crs).to_crs(CRS.WGS84)
+
+    return df_demo_output, gdf_demo_output
@@ -0,0 +1,95 @@
+"""This module holds the overlay outputs used for the demographic maps
+One DemoLayerStore is kept per overlay - it holds the geometry column once and every
+data column of the overlay is exposed as a lightweight view for a store / drive time
+st.session_state.gdf_demo maps each data column name to the DemoLayerStore holding it
+Choropleth layers are prepared from the store once per (metric, store, band) and cached on it -
+the display geometry of a band is serialized once per LOD and shared by all of its metrics
+Pieces that cover a whole zone (ZONE_ID_COL) take the prebuilt display geometry of the zone
+"""
+
+from utils.choropleth_layer_utils import build_choropleth_layer, DisplayGeometry
+from utils.demo_layer_registry import ZONE_ID_COL
+from utils.display_geometry_utils import get_zone_display_geoms
+
+DEMO_LAYER_ID_COLS = ['storename', 'iso_time_mins']
+
+
+class DemoLayerStore:
+    """Single overlay gdf (4326) shared by all of its metrics
+    layer_key is the base layer of the overlay - used to look up the prebuilt display geometry of whole zones"""
+
+    def __init__(self, gdf, layer_key=None):
+        _required_cols = DEMO_LAYER_ID_COLS + [gdf.geometry.name]
+        missing_cols = [col for col in _required_cols if col not in gdf.columns]
+        if missing_cols:
+            raise KeyError(f'!!!!WARNING DemoLayerStore missing required cols: {missing_cols}')
+
+        self.gdf = gdf
+        self.layer_key = layer_key
+        self.metrics = [col for col in gdf.columns if col not in _required_cols + [ZONE_ID_COL]]
+
+        # Positional row indices for each (storename, iso_time_mins) - so a view only touches its own rows
+        self._band_indices = {band: indices for band, indices
+                              in gdf.groupby(DEMO_LAYER_ID_COLS, sort=False).indices.items()}
+
+        # Display geometry is shared by all metrics - {(band, tolerance): DisplayGeometry}
+        self._display_geometry = {}
+        # {(metric, band): ChoroplethLayer}
+        self._choropleth_layers = {}
+
+    def __contains__(self, metric):
+        return metric in self.metrics
+
+    def view(self, metric, storename=None, iso_time_mins=None):
+        """Returns gdf with columns ['storename', 'iso_time_mins', metric, 'geometry']
+        for one store / drive time - or for all rows if either is None
+        Only the selected rows are materialised"""
+        if metric not in self.metrics:
+            raise KeyError(f'!!!!WARNING DemoLayerStore has no metric {metric}')
+
+        output_cols = DEMO_LAYER_ID_COLS + [metric, self.gdf.geometry.name]
+
+        if storename is None or iso_time_mins is None:
+            return self.gdf[output_cols]
+
+        band_indices = self._band_indices.get((storename, iso_time_mins))
+        if band_indices is None:
+            return self.gdf.iloc[0:0][output_cols]
+
+        return self.gdf.iloc[band_indices][output_cols]
+
+    def _get_display_geometry(self, band, tolerance):
+        key = (band, tolerance)
+        if key not in self._display_geometry:
+            band_indices = self._band_indices[band]
+            geoms = self.gdf.geometry.values[band_indices]
+            prebuilt_geoms = None
+            if ZONE_ID_COL in self.gdf.columns:
+                zone_ids = self.gdf[ZONE_ID_COL].to_numpy()[band_indices]
+                prebuilt_geoms = get_zone_display_geoms(self.layer_key, zone_ids, tolerance)
+            self._display_geometry[key] = DisplayGeometry(geoms, tolerance, prebuilt_geoms)
+        return self._display_geometry[key]
+
+    def get_choropleth_layer(self, metric, storename, iso_time_mins):
+        """Returns the cached ChoroplethLayer for a metric of one store / drive time
+        Builds it on first use - returns None if the band has no rows"""
+        if metric not in self.metrics:
+            raise KeyError(f'!!!!WARNING DemoLayerStore has no metric {metric}')
+
+        band = (storename, iso_time_mins)
+        if band not in self._band_indices:
+            return None
+
+        key = (metric, band)
+        if key not in self._choropleth_layers:
+            values = self.gdf[metric].to_numpy()[self._band_indices[band]]
+            self._choropleth_layers[key] = build_choropleth_layer(
+                metric, values, lambda tolerance: self._get_display_geometry(band, tolerance))
+        return self._choropleth_layers[key]
+
+    def memory_usage_bytes(self):
+        """Returns the approximate memory held - the deep usage of the stored gdf plus the serialized
+        size of the cached display geometry and choropleth properties"""
+        return (int(self.gdf.memory_usage(deep=True).sum())
+                + sum(display_geometry.memory_usage_bytes() for display_geometry in self._display_geometry.values())
+                + sum(layer.properties_bytes for layer in self._choropleth_layers.values()))
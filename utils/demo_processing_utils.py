@@ -1,4 +1,8 @@
 import streamlit as st
+import pickle
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import pandas as pd
 import geopandas as gpd
 import numpy as np
@@ -6,303 +10,184 @@ import folium
 from streamlit_folium import st_folium
 
 
-from utils.spatial_processing_utils import check_crs_match
-from utils.demo_data_summary_management_utils import add_data_to_df_demo_summ
+from utils.demo_data_summary_management_utils import add_data_to_df_demo_summ, save_df_demo_summ_debug_csv
 from utils.spatial_processing_utils import get_bounds_from_gdf
 from utils.competition_utils import get_output_iso
+from utils.load_save_data_files_utils import get_store_isos_planar_from_ss, get_debug_output_path
+from utils.spatial_prefilter_utils import prefilter_base_layer
+from utils.demo_result_cache_utils import split_isos_by_cache, merge_cached_and_computed
+from utils.demo_layer_store import DemoLayerStore
+from utils.demo_layer_registry import DEMO_LAYER_REGISTRY, get_demo_layer_spec, compute_demo_layer
+from utils.choropleth_layer_utils import select_lod_tolerance, add_choropleth_layer_to_map
+from utils.topojson_utils import format_payload_comparison
 
 from config.constants import (DEBUG_PRINT, 
-                              CRS, 
-                              SQM_IN_SQKM,
+                              DEMO_PROCESSING_MODE,
+                              DEMO_PROCESS_POOL_WORKERS,
+                              DEMO_MIN_BANDS_PER_CHUNK,
                               DEFAULT_TILE_LAYER,
                               DEMO_MAP_DISPLAY_HEIGHT_PX,
+                              CHOROPLETH_LOD_TOLERANCES_DEG,
+                              USE_TOPOJSON_LAYERS_DEFAULT,
                               DEFAULT_MAP_CENTER_LATLON, 
                               DEFAULT_MAP_ZOOM_START)
 
-def process_LA_rents():
+def get_demo_processor_inputs(layer_key):
+    """Gets the planar isos from session_state, looks each band up in the demo result cache
+    and prefilters the planar base layer for the bands that are not cached
+    These are read-only inputs to compute_demo_layer
+    Returns gdf_isos, cache_keys, cached_results, gdf_isos_missed, gdf_base (None if all cached)"""
 
-    """Function overlay isoschrones with LA rents
-    Creates gdf of polygons showing average rent per overlaid area
-    PLus df of weighted rent per iso area / per store"""
-
-    gdf_isos = st.session_state.gdf_isos.copy()
+    gdf_isos = get_store_isos_planar_from_ss()
+    if gdf_isos is None:
+        raise ValueError(f'!!!!WARNING get_demo_processor_inputs could not get planar gdf_isos from session_state')
     _iso_cols_to_keep = ['storename','iso_time_mins', 'geometry']
     missing_cols = []
     for col in _iso_cols_to_keep:
         if col not in gdf_isos.columns:
             missing_cols.append(col)
     if len(missing_cols) > 0:
-        raise KeyError(f'!!!!WARNING missing columns from gdf_isos in process_LA_rents: {missing_cols}')
-    
+        raise KeyError(f'!!!!WARNING missing columns from gdf_isos in get_demo_processor_inputs: {missing_cols}')
+    gdf_isos = gdf_isos[_iso_cols_to_keep]
 
-    gdf_la_rents = st.session_state.data['la_rents'].copy()
-    _la_rents_cols_to_keep = ['Area name', 'Rents_Oct_2024', 'geometry']
-    missing_cols = []
-    for col in _la_rents_cols_to_keep:
-        if col not in gdf_la_rents.columns:
-            missing_cols.append(col)
-    if len(missing_cols) > 0:
-        raise KeyError(f'!!!!WARNING missing columns from gdf_la_rents in process_LA_rents: {missing_cols}')
-
-
-    check_crs_match(gdf_isos, gdf_la_rents, raise_error=True)
-
-    gdf_overlaid_rents = gpd.overlay(gdf_isos[_iso_cols_to_keep], 
-                                        gdf_la_rents[_la_rents_cols_to_keep], 
-                                        how='intersection',
-                                        keep_geom_type=False,
-                                        make_valid=True
-                                    )
-    if not gdf_overlaid_rents.empty:
-        st.session_state.app_data['gdf_rents'] = gdf_overlaid_rents
-
-    # Now add areas and weight outputs
-    gdf_overlaid_rents_3035 = gdf_overlaid_rents.to_crs(CRS.EUROPEAN_PLANAR).copy()
-    gdf_overlaid_rents_3035['area_sqkm'] = gdf_overlaid_rents_3035.geometry.area / SQM_IN_SQKM
-    gdf_overlaid_rents_3035['weighted_rent'] = gdf_overlaid_rents_3035['area_sqkm'].mul(gdf_overlaid_rents_3035['Rents_Oct_2024'])
-    _groupby_cols = ['storename', 'iso_time_mins' ]
-    _sum_cols = ['area_sqkm', 'weighted_rent']
-    gdf_overlaid_rents_groupby = gdf_overlaid_rents_3035.groupby(_groupby_cols)[_sum_cols].sum()
-    gdf_overlaid_rents_groupby = gdf_overlaid_rents_groupby.reset_index()
-    gdf_overlaid_rents_groupby['Rents_Oct_2024'] = (gdf_overlaid_rents_groupby['weighted_rent']
-                                                    .div(gdf_overlaid_rents_groupby['area_sqkm'])
-                                                    .fillna(0)
-                                                    .round(0).
-                                                    astype(int))
-    gdf_overlaid_rents_groupby.drop(columns=['weighted_rent', 'area_sqkm'], inplace=True)
-    
-    # The grouped data can now be added to df_demo_summ and save a version to session_state 
-    add_data_to_df_demo_summ(gdf_overlaid_rents_groupby)
-    
-    # if DEBUG_PRINT:
-    #     print(f'gdf_overlaid_rents_3035: {gdf_overlaid_rents_3035.columns}')
+    cache_keys, cached_results, gdf_isos_missed = split_isos_by_cache(layer_key, gdf_isos)
 
-    _gdf_rent_cols = ['storename', 'iso_time_mins',  'Rents_Oct_2024', 'geometry'  ] 
-    add_demo_gdf_to_session_state(gdf_overlaid_rents_3035[_gdf_rent_cols].to_crs(4326)) 
+    # Only the zones of the shared planar layer near the isos still to compute - only read from it
+    gdf_base = None
+    if not gdf_isos_missed.empty:
+        gdf_base = prefilter_base_layer(layer_key, gdf_isos_missed)
 
-    if DEBUG_PRINT:
-        try:    
-            gdf_overlaid_rents_3035[_gdf_rent_cols].to_file(r"D:\D_documents\OldCo\Savills\Scripts\SSST_V2\assets\data\test_la_overlay.gpkg", driver='GPKG')
-            gdf_overlaid_rents_groupby.to_csv(r"D:\D_documents\OldCo\Savills\Scripts\SSST_V2\assets\data\test_df_rent.csv", index=False)
-            print(f'****INFO save test version of gdf_rents and df_rents')
+    return gdf_isos, cache_keys, cached_results, gdf_isos_missed, gdf_base
 
-        except:
-            print(f'!!!!WARNING was not able to save test version of gdf_overlaid_rents')
-    
 
-def process_household_inc():
-    """Function overlay isoschrones with Household income data 
-    this is not part of the other msoa data set as it is based on 2011 msoa codes
-    Creates gdf of polygons showing hh ince per overlaid area
-    PLus df of weighted hh inc per iso area / per store"""
+def save_demo_outputs(df_demo_output, gdf_demo_output, app_data_key, test_name, layer_key=None):
+    """Adds the outputs of compute_demo_layer to df_demo_summ and gdf_demo in session_state
+    Must be run in the main script thread"""
 
-    gdf_isos = st.session_state.gdf_isos.copy()
-    _iso_cols_to_keep = ['storename','iso_time_mins', 'geometry']
-    missing_cols = []
-    for col in _iso_cols_to_keep:
-        if col not in gdf_isos.columns:
-            missing_cols.append(col)
-    if len(missing_cols) > 0:
-        raise KeyError(f'!!!!WARNING missing columns from gdf_isos in process_LA_rents: {missing_cols}')
-    
+    # The grouped data can now be added to df_demo_summ and save a version to session_state 
+    add_data_to_df_demo_summ(df_demo_output)
 
-    gdf_hh_inc = st.session_state.data['msoa_20'].copy()
-    _hh_inc_cols_to_keep = ['MSOA11NM', 'HouseholdIncMar2020', 'geometry']
-    missing_cols = []
-    for col in _hh_inc_cols_to_keep:
-        if col not in gdf_hh_inc.columns:
-            missing_cols.append(col)
-    if len(missing_cols) > 0:
-        raise KeyError(f'!!!!WARNING missing columns from gdf_hh_inc in process_household_inc: {missing_cols}')
-
-
-    check_crs_match(gdf_isos, gdf_hh_inc, raise_error=True)
-
-    gdf_overlaid_inc = gpd.overlay(gdf_isos[_iso_cols_to_keep], 
-                                        gdf_hh_inc[_hh_inc_cols_to_keep], 
-                                        how='intersection',
-                                        keep_geom_type=False,
-                                        make_valid=True
-                                    )
-    if not gdf_overlaid_inc.empty:
-        st.session_state.app_data['gdf_inc'] = gdf_overlaid_inc
-
-    # Now add areas and weight outputs
-    gdf_overlaid_inc_3035 = gdf_overlaid_inc.to_crs(CRS.EUROPEAN_PLANAR).copy()
-    gdf_overlaid_inc_3035['area_sqkm'] = gdf_overlaid_inc_3035.geometry.area / SQM_IN_SQKM
-    gdf_overlaid_inc_3035['weighted_inc'] = gdf_overlaid_inc_3035['area_sqkm'].mul(gdf_overlaid_inc_3035['HouseholdIncMar2020'])
-    _groupby_cols = ['storename', 'iso_time_mins' ]
-    _sum_cols = ['area_sqkm', 'weighted_inc']
-    gdf_overlaid_inc_groupby = gdf_overlaid_inc_3035.groupby(_groupby_cols)[_sum_cols].sum()
-    gdf_overlaid_inc_groupby = gdf_overlaid_inc_groupby.reset_index()
-    gdf_overlaid_inc_groupby['HouseholdIncMar2020'] = (gdf_overlaid_inc_groupby['weighted_inc']
-                                                    .div(gdf_overlaid_inc_groupby['area_sqkm'])
-                                                    .fillna(0)
-                                                    .round(0).
-                                                    astype(int))
-    gdf_overlaid_inc_groupby.drop(columns=['weighted_inc', 'area_sqkm'], inplace=True)
-
-    # Add the grouped data to df_demo_summ
-    add_data_to_df_demo_summ(gdf_overlaid_inc_groupby)
-
-    # if DEBUG_PRINT:
-    #     print(f'****INFO gdf_overlaid_inc_3035 {gdf_overlaid_inc_3035.columns}')
-
-    _gdf_inc_cols = ['storename', 'iso_time_mins', 'HouseholdIncMar2020', 'geometry']
-    add_demo_gdf_to_session_state(gdf_overlaid_inc_3035[_gdf_inc_cols].to_crs(4326))
-    
+    if not gdf_demo_output.empty:
+        st.session_state.app_data[app_data_key] = gdf_demo_output
+    add_demo_gdf_to_session_state(gdf_demo_output, layer_key)
 
     if DEBUG_PRINT:
         try:    
-            gdf_overlaid_inc_3035[_gdf_inc_cols].to_file(r"D:\D_documents\OldCo\Savills\Scripts\SSST_V2\assets\data\test_inc_overlay.gpkg", driver='GPKG')
-            gdf_overlaid_inc_groupby.to_csv(r"D:\D_documents\OldCo\Savills\Scripts\SSST_V2\assets\data\test_df_inc.csv", index=False)
-            # print(f'****INFO save test version of gdf_inc and df_inc')
+            gdf_demo_output.to_file(get_debug_output_path(f'test_{test_name}_overlay.gpkg'), driver='GPKG')
+            df_demo_output.to_csv(get_debug_output_path(f'test_df_{test_name}.csv'), index=False)
+            print(f'****INFO save test version of gdf_{test_name} and df_{test_name}')
 
         except:
-            print(f'!!!!WARNING was not able to save test version of gdf_overlaid_inc')
+            print(f'!!!!WARNING was not able to save test version of gdf_overlaid_{test_name}')
 
 
-def process_popn_data():
-    """Function overlay isoschrones with LA rents
-    Creates gdf of polygons showing average rent per overlaid area
-    PLus df of weighted rent per iso area / per store"""
+def _run_demo_processor(layer_key):
+    """Runs the registered layer for layer_key in the main script thread"""
+    spec = get_demo_layer_spec(layer_key)
+    gdf_isos, cache_keys, cached_results, gdf_isos_missed, gdf_base = get_demo_processor_inputs(layer_key)
+    computed_outputs = None
+    if gdf_base is not None:
+        computed_outputs = compute_demo_layer(spec, gdf_isos_missed, gdf_base)
+    df_demo_output, gdf_demo_output = merge_cached_and_computed(cache_keys, cached_results,
+                                                                gdf_isos, computed_outputs)
+    save_demo_outputs(df_demo_output, gdf_demo_output, spec.app_data_key, spec.test_name, spec.layer_key)
 
-    # Load and process isos from selected stores
-    gdf_isos = st.session_state.gdf_isos
-    _iso_cols_to_keep = ['storename','iso_time_mins', 'geometry']
-    missing_cols = []
-    for col in _iso_cols_to_keep:
-        if col not in gdf_isos.columns:
-            missing_cols.append(col)
-    if len(missing_cols) > 0:
-        raise KeyError(f'!!!!WARNING missing columns from gdf_isos in process_LA_rents: {missing_cols}')
-    
-    # load and process the popn data from msoa_22
-    gdf_popn = st.session_state.data['msoa_22'].copy()
-    _popn_cols_to_keep = ['MSOA21NM', 'total_owners', 'total_renters',  '1 person in household',
-                        'Total Households', 'Total_Popn', 'Med_House_Price_YE_Mar2024',
-                        'Resi_Sales_YE_Mar2024', 'area_sqkm_orig', 'geometry',
-                        'Single_Person_HH_Perc', 'Popn_Density', 'Owner_Occ_Perc',
-                        'Avg_HH_Size','LTE_3rooms',	'LTE_3Rooms_perc']
-    missing_cols = []
-    for col in _popn_cols_to_keep:
-        if col not in gdf_popn.columns:
-            missing_cols.append(col)
-    if len(missing_cols) > 0:
-        raise KeyError(f'!!!!WARNING missing columns from gdf_popn in process_household_inc: {missing_cols}')
-
-    # Just check check that each crs matchs 
-    check_crs_match(gdf_isos, gdf_popn, raise_error=True)
-
-    # add in transactions per household (perc figure) as this is a relative measure so does not need to be weighted for area
-    gdf_popn['trans_per_hh_perc'] = gdf_popn['Resi_Sales_YE_Mar2024'].div(gdf_popn['Total Households']).fillna(0).mul(100).round(2)
-    # Then add this back to the popn list to keep
-    _popn_cols_to_keep.append('trans_per_hh_perc')
-
-    gdf_overlaid_popn = gpd.overlay(gdf_isos[_iso_cols_to_keep], 
-                                        gdf_popn[_popn_cols_to_keep], 
-                                        how='intersection', 
-                                        keep_geom_type=False,
-                                        make_valid=True
-                                    )
-    if not gdf_overlaid_popn.empty:
-        st.session_state.app_data['gdf_inc'] = gdf_overlaid_popn
-
-    # Now add areas and weight outputs and adjustments where not whole area captured
-    gdf_overlaid_popn_3035 = gdf_overlaid_popn.to_crs(CRS.EUROPEAN_PLANAR).copy()
-    gdf_overlaid_popn_3035['area_sqkm'] = gdf_overlaid_popn_3035.geometry.area / SQM_IN_SQKM
-    gdf_overlaid_popn_3035['area_perc'] = gdf_overlaid_popn_3035['area_sqkm'].div(gdf_overlaid_popn_3035['area_sqkm_orig']).fillna(0)  
-
-    _cols_to_adjust = [ 'total_owners', 'total_renters', 
-                        '1 person in household',
-                        'Total Households', 'Total_Popn', 
-                        'Resi_Sales_YE_Mar2024','LTE_3rooms']
-    for col in _cols_to_adjust:
-        gdf_overlaid_popn_3035[col] = gdf_overlaid_popn_3035[col].mul(gdf_overlaid_popn_3035['area_perc']).round(0).astype(int)
-    
-    # House prices need to be weighted by area  - but first divide through by 1_000 to show as ,000s
-    gdf_overlaid_popn_3035['Med_House_Price_YE_Mar2024'] = gdf_overlaid_popn_3035['Med_House_Price_YE_Mar2024'].div(1_000)
-    gdf_overlaid_popn_3035['Weighted_Med_House_Price_YE_Mar2024'] = gdf_overlaid_popn_3035['Med_House_Price_YE_Mar2024'].mul(gdf_overlaid_popn_3035['area_sqkm'])
-
-    _groupby_cols = ['storename', 'iso_time_mins' ]
-    _sum_cols = [ 'total_owners', 'total_renters',  '1 person in household',
-                        'Total Households', 'Total_Popn', 
-                        'Weighted_Med_House_Price_YE_Mar2024',
-                        'Resi_Sales_YE_Mar2024', 'LTE_3rooms', 'area_sqkm']
-    
-    gdf_overlaid_popn_groupby = gdf_overlaid_popn_3035.groupby(_groupby_cols)[_sum_cols].sum(_sum_cols)
-    gdf_overlaid_popn_groupby = gdf_overlaid_popn_groupby.reset_index()
-
-    # Recalculcate some of the columsn
-    gdf_overlaid_popn_groupby['Single_Person_HH_Perc'] = (gdf_overlaid_popn_groupby['1 person in household']
-                                                    .div(gdf_overlaid_popn_groupby['Total Households'])
-                                                    .fillna(0)
-                                                    .mul(100).
-                                                    round(2))
-    gdf_overlaid_popn_groupby['Popn_Density'] = (gdf_overlaid_popn_groupby['Total_Popn']
-                                                    .div(gdf_overlaid_popn_groupby['area_sqkm'])
-                                                    .fillna(0)
-                                                    .round(0).
-                                                    astype(int))
-    gdf_overlaid_popn_groupby['Owner_Occ_Perc'] = (gdf_overlaid_popn_groupby['total_owners']
-                                                    .div(gdf_overlaid_popn_groupby['Total Households'])
-                                                    .fillna(0)
-                                                    .mul(100).
-                                                    round(2))
-    gdf_overlaid_popn_groupby['Avg_HH_Size'] = (gdf_overlaid_popn_groupby['Total_Popn']
-                                                    .div(gdf_overlaid_popn_groupby['Total Households'])
-                                                    .fillna(0)
-                                                    .round(2)
-                                                    )
-    
-    gdf_overlaid_popn_groupby['trans_per_hh_perc'] = (gdf_overlaid_popn_groupby['Resi_Sales_YE_Mar2024']
-                                                    .div(gdf_overlaid_popn_groupby['Total Households'])
-                                                    .fillna(0)
-                                                    .mul(100)
-                                                    .round(2)
-                                                    )
-    gdf_overlaid_popn_groupby['LTE3_rooms_perc'] = (gdf_overlaid_popn_groupby['LTE_3rooms']
-                                                    .div(gdf_overlaid_popn_groupby['Total Households'])
-                                                    .fillna(0)
-                                                    .mul(100)
-                                                    .round(2)
-                                                    )
-
-    # "De-weight" the cols adjusted by area -just house prices in this instance - and drop the weighted column as it has effectively been rename in the groupby
-    gdf_overlaid_popn_groupby['Med_House_Price_YE_Mar2024'] = gdf_overlaid_popn_groupby['Weighted_Med_House_Price_YE_Mar2024'].div(gdf_overlaid_popn_groupby['area_sqkm']).fillna(0).round(0).astype(int)
-    gdf_overlaid_popn_groupby.drop(columns=['Weighted_Med_House_Price_YE_Mar2024'], inplace=True)
-
-    # if DEBUG_PRINT:
-    #     print(f'****INFO gdf_overlaid_popn_groupby {gdf_overlaid_popn_groupby.columns}')
-    
-    _cols_to_drop = ['total_owners', 'total_renters',
-                        '1 person in household','area_sqkm', 
-                        'Resi_Sales_YE_Mar2024','LTE_3rooms'
-                        ]
 
-    gdf_overlaid_popn_groupby.drop(columns=_cols_to_drop, inplace=True)
-    
-    # Add the grouped data to df_demo_summ 
-    add_data_to_df_demo_summ(gdf_overlaid_popn_groupby)
+def process_popn_data():
+    """Function overlay isoschrones with msoa 2021 popn data
+    Creates gdf of polygons showing the popn data per overlaid area
+    PLus df of area adjusted popn data per iso area / per store"""
+
+    _run_demo_processor('msoa_22')
+
+
+@st.cache_resource(show_spinner=False)
+def get_demo_process_pool():
+    """Returns the process pool shared by all sessions for the demographic overlays
+    spawn is used so that workers do not inherit the streamlit server threads"""
+    return ProcessPoolExecutor(max_workers=DEMO_PROCESS_POOL_WORKERS,
+                               mp_context=multiprocessing.get_context('spawn'))
+
+
+def reset_demo_process_pool():
+    """Shuts down the shared pool (its workers exit) so the next get_demo_process_pool starts a new one"""
+    get_demo_process_pool().shutdown(wait=False, cancel_futures=True)
+    get_demo_process_pool.clear()
+
+
+def get_demo_layer_chunks(gdf_isos_missed, gdf_base, n_chunks):
+    """Splits the bands to compute into up to n_chunks of at least DEMO_MIN_BANDS_PER_CHUNK bands
+    Returns a list of (gdf_isos chunk, the zones of gdf_base within the extent of the chunk)
+    Bands of a store are next to each other in gdf_isos so a chunk only carries the zones near its stores"""
+    n_chunks = max(min(n_chunks, len(gdf_isos_missed) // DEMO_MIN_BANDS_PER_CHUNK), 1)
+    chunks = []
+    for idx in np.array_split(np.arange(len(gdf_isos_missed)), n_chunks):
+        gdf_isos_chunk = gdf_isos_missed.iloc[idx]
+        minx, miny, maxx, maxy = gdf_isos_chunk.total_bounds
+        chunks.append((gdf_isos_chunk, gdf_base.cx[minx:maxx, miny:maxy]))
+    return chunks
+
+
+def concat_demo_layer_outputs(chunk_outputs):
+    """Returns the (df, gdf) outputs of compute_demo_layer for the chunks of a layer as one (df, gdf)"""
+    return (pd.concat([df_output for df_output, _ in chunk_outputs], ignore_index=True),
+            pd.concat([gdf_output for _, gdf_output in chunk_outputs], ignore_index=True))
+
+
+def _compute_demo_layers_in_pool(specs, layer_chunks):
+    """Runs every chunk in the shared process pool - returns the (df, gdf) outputs of each layer (None if nothing to compute)
+    The spec itself is sent to the worker so layers registered at runtime work too"""
+    pool = get_demo_process_pool()
+    futures = [[pool.submit(compute_demo_layer, spec, gdf_isos_chunk, gdf_base_chunk)
+                for gdf_isos_chunk, gdf_base_chunk in chunks]
+               for spec, chunks in zip(specs, layer_chunks)]
+    return [concat_demo_layer_outputs([future.result() for future in _futures]) if _futures else None
+            for _futures in futures]
+
+
+def run_demo_processors(mode=DEMO_PROCESSING_MODE):
+    """Runs every layer in DEMO_LAYER_REGISTRY and merges the outputs into session_state
+    mode 'sequential' runs them one after another in the script thread
+    mode 'concurrent' splits the bands to compute into chunks and runs compute_demo_layer (the GEOS heavy part)
+    for each chunk in a process pool - then merges the outputs in registry order once all have finished
+    If there is only one chunk to compute it is run in the script thread - a worker would add pickling for no parallelism"""
+
+    specs = list(DEMO_LAYER_REGISTRY)
+
+    if mode != 'concurrent':
+        for spec in specs:
+            _run_demo_processor(spec.layer_key)
+        save_df_demo_summ_debug_csv()
+        return
 
-    # if DEBUG_PRINT:
-    #     print(f'****INFO gdf_overlaid_popn_3035 cols: {gdf_overlaid_popn_3035.columns}')
+    # Inputs are gathered in the script thread as they need session_state
+    processor_inputs = [get_demo_processor_inputs(spec.layer_key) for spec in specs]
 
-    _gdf_popn_cols = ['storename', 'iso_time_mins','Total Households',
-       'Total_Popn', 'Med_House_Price_YE_Mar2024', 'trans_per_hh_perc',
-       'Single_Person_HH_Perc', 'Popn_Density',
-       'Owner_Occ_Perc', 'Avg_HH_Size', 'LTE_3Rooms_perc' ,'geometry']
-    add_demo_gdf_to_session_state(gdf_overlaid_popn_3035[_gdf_popn_cols].to_crs(4326))
+    # Only layers with bands missing from the cache need to compute
+    layer_chunks = [get_demo_layer_chunks(gdf_isos_missed, gdf_base, DEMO_PROCESS_POOL_WORKERS) if gdf_base is not None else []
+                    for _, _, _, gdf_isos_missed, gdf_base in processor_inputs]
 
-    if DEBUG_PRINT:
-        try:    
-            gdf_overlaid_popn_3035[_gdf_popn_cols].to_file(r"D:\D_documents\OldCo\Savills\Scripts\SSST_V2\assets\data\test_popn_overlay.gpkg", driver='GPKG')
-            gdf_overlaid_popn_groupby.to_csv(r"D:\D_documents\OldCo\Savills\Scripts\SSST_V2\assets\data\test_df_popn.csv", index=False)
-            print(f'****INFO save test version of gdf_popn and df_popn')
+    computed_outputs = None
+    if sum(len(chunks) for chunks in layer_chunks) > 1:
+        try:
+            computed_outputs = _compute_demo_layers_in_pool(specs, layer_chunks)
+        except (BrokenProcessPool, pickle.PicklingError) as e:
+            # A broken pool should not stop processing - fall back to the script thread
+            # Errors raised by compute_demo_layer itself are not caught - they would fail the same way here
+            print(f'!!!!WARNING run_demo_processors process pool failed - running sequentially: {e}')
+            reset_demo_process_pool()
 
-        except:
-            print(f'!!!!WARNING was not able to save test version of gdf_overlaid_popn')
+    if computed_outputs is None:
+        computed_outputs = [compute_demo_layer(spec, gdf_isos_missed, gdf_base) if gdf_base is not None else None
+                            for spec, (_, _, _, gdf_isos_missed, gdf_base) in zip(specs, processor_inputs)]
+
+    # Merge in a fixed order so df_demo_summ columns do not depend on which layer finished first
+    for spec, (gdf_isos, cache_keys, cached_results, _, _), _computed_outputs in zip(specs, processor_inputs, computed_outputs):
+        df_demo_output, gdf_demo_output = merge_cached_and_computed(cache_keys, cached_results,
+                                                                    gdf_isos, _computed_outputs)
+        save_demo_outputs(df_demo_output, gdf_demo_output, spec.app_data_key, spec.test_name, spec.layer_key)
 
+    save_df_demo_summ_debug_csv()
 
 
 def return_demo_chloropleth_map(gdf_name, storename, iso_time_mins):
@@ -310,40 +195,35 @@ def return_demo_chloropleth_map(gdf_name, storename, iso_time_mins):
     """Function returns st_folium map object based on input gdf"""
 
     try:
-        required_cols = ['geometry', 'storename' , 'iso_time_mins' ]
-        gdf_to_map =  st.session_state.gdf_demo.get(gdf_name)
-        if gdf_to_map is None:
+        store = st.session_state.gdf_demo.get(gdf_name)
+        if store is None:
             print(f'!!!WARNING return_demo_chloropleth_map did not get any values from st.session_state gdf_demo {gdf_name}')
             return None
-        gdf_filtered = gdf_to_map[(gdf_to_map.storename==storename) & (gdf_to_map.iso_time_mins==iso_time_mins)]
-        if gdf_filtered.empty:
+        # The layer is classified and serialized once per (metric, store, band) and cached on the store
+        layer = store.get_choropleth_layer(gdf_name, storename, iso_time_mins)
+        if layer is None:
             print(f'!!!!WARNING could not find values in {gdf_name} that matched the storename: {storename} with an iso_time_mins of: {iso_time_mins}')
             return None
-        # Capture the data col - the data column is the only column that is not in the required columns
-        data_col = [col for col in gdf_to_map.columns if col not in required_cols]
-        if len(data_col) > 1:
-            print(f'!!!!WARNING  return_demo_chloropleth_map excess amount of columns for {gdf_name}')
-            return None
-        if len(data_col) == 0:
-            print(f'!!!!WARNING  return_demo_chloropleth_map missing data cols for {gdf_name}')
-            return None
-        values_col  = data_col[0]
-        print(f'****INFO return_demo_chloropleth_map creating chloro map for {values_col}')
+        print(f'****INFO return_demo_chloropleth_map creating chloro map for {gdf_name}')
         m = folium.Map(location=DEFAULT_MAP_CENTER_LATLON,
                        zoom_start=DEFAULT_MAP_ZOOM_START,
                        tiles=DEFAULT_TILE_LAYER, 
                        width="100%")
-        gdf_filtered.explore(m=m,
-                        column=values_col,
-                        tooltip=values_col,
-                        popup=True)
-        # iso not required but use for bounds
+        # iso not required but use for bounds and to pick the level of detail
         _output_iso = get_output_iso(storename=storename , drive_time=iso_time_mins)
         if _output_iso is not None:
             bounds = get_bounds_from_gdf(_output_iso)
             m.fit_bounds(bounds)
+            tolerance = select_lod_tolerance(bounds)
         else:
             print(f'!!!!WARNING return_demo_chloropleth_map was not able to set bounds from _output_iso')
+            tolerance = max(CHOROPLETH_LOD_TOLERANCES_DEG)
+        use_topojson = st.session_state.get('use_topojson_layers', USE_TOPOJSON_LAYERS_DEFAULT)
+        add_choropleth_layer_to_map(m, layer, tolerance, use_topojson=use_topojson)
+        if use_topojson:
+            st.caption(format_payload_comparison(layer.payload_bytes(tolerance), layer.topojson_payload_bytes(tolerance)))
+        if DEBUG_PRINT:
+            print(f'****INFO return_demo_chloropleth_map LOD {tolerance} payload {layer.payload_bytes(tolerance) / 1e3:.0f} kB')
 
         # Render the map
         return st_folium(
@@ -360,11 +240,12 @@ def return_demo_chloropleth_map(gdf_name, storename, iso_time_mins):
       return None
 
 
-def add_demo_gdf_to_session_state(gdf):
+def add_demo_gdf_to_session_state(gdf, layer_key=None):
 
-    """Function adds input gdf to st.session_state.gdf_demo{}
-    The key is the name of the data column header
-    The gdf should ONLY contain ['storename', 'iso_time_mins'] [<<data_cols>>] ['geometry']"""
+    """Function adds input gdf to st.session_state.gdf_demo{} as a single DemoLayerStore
+    The key is the name of the data column header - all keys of the gdf share the store
+    The gdf should ONLY contain ['storename', 'iso_time_mins'] [<<data_cols>>] ['geometry'] (and ZONE_ID_COL
+    if its spec has a zone id) - layer_key is the base layer of the overlay"""
 
     # For streamlit folium to render needs to be in either 3587 of 4326 - here I will enforce 4326
     if gdf.crs != 4326:
@@ -387,11 +268,13 @@ def add_demo_gdf_to_session_state(gdf):
         print(f'!!!!WARNING add_demo_gdf_to_session_state missing some required cols: {missing_cols} not added gdf to sesion_state')
         return
 
-    data_cols = [col for col in gdf.columns if col not in _required_cols]
-    for col in data_cols:
-        output_cols = _required_cols + [col]
-        gdf_to_save = gdf[output_cols].copy()
-        st.session_state.gdf_demo[col] = gdf_to_save
+    # One store per overlay - every data col maps to the same store so the geometry is held once
+    store = DemoLayerStore(gdf, layer_key)
+    for col in store.metrics:
+        st.session_state.gdf_demo[col] = store
+    if DEBUG_PRINT:
+        print(f'****INFO add_demo_gdf_to_session_state stored {len(store.metrics)} metrics '
+              f'in {store.memory_usage_bytes() / 1e6:.1f} MB')
         # if DEBUG_PRINT:
         #     print(f'*****INFO add_demo_gdf_to_session_state saved {col} to gdf_demo session_state dict')
         #     # print out current dictionaries 
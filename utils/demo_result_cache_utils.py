@@ -0,0 +1,210 @@
+import streamlit as st
+import os
+import time
+import uuid
+import hashlib
+import pandas as pd
+import shapely
+
+from utils.parquet_io_utils import load_gdf_from_parquet, save_gdf_to_parquet
+from utils.load_save_data_files_utils import get_base_layer_fingerprint, PLANAR_LAYER_KEYS
+from utils.asset_pipeline_utils import get_asset_version
+from config.constants import DEBUG_PRINT
+
+"""This module is the persistent cache of per-band demographic outputs
+Each iso band is keyed on the WKB content hash of its geometry plus a fingerprint
+of the base layer parquet it was overlaid with - so the same site analysed again
+(in another session or after clearing locations) is a lookup rather than an overlay
+A change to a base parquet file changes its fingerprint which invalidates its entries
+Entries are written to a temporary file then renamed so a reader never sees a partial file - and the
+least recently used entries are removed once the cache is over DEMO_CACHE_MAX_BYTES
+The planar layers take the version of their build in the asset manifest when the files match it -
+otherwise the source files are hashed
+"""
+
+DEMO_CACHE_DIR = os.path.join('assets', 'cache', 'demo_results')
+
+# Bump when compute_demo_layer or the layer registry change what is output
+DEMO_CACHE_VERSION = 4
+
+# The least recently used entries are removed once the cache is larger than this
+DEMO_CACHE_MAX_BYTES = 500 * 1024 ** 2
+# Temporary files left by an interrupted write are removed after this many seconds
+DEMO_CACHE_TMP_MAX_AGE_S = 60 * 60
+
+_SUMM_SUFFIX = '_summ.parquet'
+_GDF_SUFFIX = '_gdf.parquet'
+
+
+def get_iso_geometry_hash(geom):
+    """Returns the content hash of the iso geometry WKB"""
+    return hashlib.sha256(shapely.to_wkb(geom)).hexdigest()
+
+
+def get_demo_cache_keys(layer_key, gdf_isos):
+    """Returns a cache key for each iso (in row order) for the outputs of the layer_key processor"""
+    fingerprint = get_asset_version('planar_layers') if layer_key in PLANAR_LAYER_KEYS else None
+    fingerprint = fingerprint or get_base_layer_fingerprint(layer_key)
+    return [f'{layer_key}_v{DEMO_CACHE_VERSION}_{get_iso_geometry_hash(geom)[:32]}_{fingerprint[:16]}'
+            for geom in gdf_isos.geometry]
+
+
+def _get_cache_fpaths(cache_key):
+    return (os.path.join(DEMO_CACHE_DIR, f'{cache_key}{_SUMM_SUFFIX}'),
+            os.path.join(DEMO_CACHE_DIR, f'{cache_key}{_GDF_SUFFIX}'))
+
+
+def load_cached_demo_result(cache_key, storename, iso_time_mins):
+    """Returns (df_demo_output, gdf_demo_output) for a single iso band relabelled to
+    storename / iso_time_mins - or None if not cached"""
+    fpath_summ, fpath_gdf = _get_cache_fpaths(cache_key)
+    if not (os.path.exists(fpath_summ) and os.path.exists(fpath_gdf)):
+        return None
+
+    try:
+        df_demo_output = pd.read_parquet(fpath_summ)
+        gdf_demo_output = load_gdf_from_parquet(fpath_gdf, epsg=4326)
+    except Exception as e:
+        print(f'!!!!WARNING load_cached_demo_result could not read {cache_key}: {e}')
+        return None
+
+    # Marks the entry as used so it is the last to be pruned
+    try:
+        os.utime(fpath_summ)
+    except OSError:
+        pass
+
+    # The cached band may have been computed for a different store name
+    for df in (df_demo_output, gdf_demo_output):
+        df['storename'] = storename
+        df['iso_time_mins'] = iso_time_mins
+
+    return df_demo_output, gdf_demo_output
+
+
+def _get_tmp_fpath(fpath):
+    """Returns a temporary path unique to this write - two sessions can save the same entry at once"""
+    return f'{fpath}.{uuid.uuid4().hex}.tmp'
+
+
+def save_demo_result_to_cache(cache_key, df_demo_output, gdf_demo_output):
+    """Saves the outputs for a single iso band to the cache - failures only print a warning
+    Each file is written to a temporary file and renamed - the summary last as an entry is only
+    read once its summary exists"""
+    fpath_summ, fpath_gdf = _get_cache_fpaths(cache_key)
+    fpath_summ_tmp, fpath_gdf_tmp = _get_tmp_fpath(fpath_summ), _get_tmp_fpath(fpath_gdf)
+    try:
+        os.makedirs(DEMO_CACHE_DIR, exist_ok=True)
+        save_gdf_to_parquet(gdf_demo_output, fpath_gdf_tmp)
+        os.replace(fpath_gdf_tmp, fpath_gdf)
+        df_demo_output.to_parquet(fpath_summ_tmp, index=False)
+        os.replace(fpath_summ_tmp, fpath_summ)
+    except Exception as e:
+        print(f'!!!!WARNING save_demo_result_to_cache could not save {cache_key}: {e}')
+        for fpath_tmp in (fpath_summ_tmp, fpath_gdf_tmp):
+            if os.path.exists(fpath_tmp):
+                os.remove(fpath_tmp)
+
+
+def prune_demo_cache(max_bytes=DEMO_CACHE_MAX_BYTES):
+    """Removes the least recently used entries (both files) until the cache is at most max_bytes
+    Also removes temporary files older than DEMO_CACHE_TMP_MAX_AGE_S. Returns the number of entries removed"""
+    try:
+        dir_entries = list(os.scandir(DEMO_CACHE_DIR))
+    except OSError:
+        return 0
+
+    # {cache_key: [last used, bytes, fpaths]} - an entry is last used when its summary was read or written
+    cache_entries = {}
+    now = time.time()
+    for dir_entry in dir_entries:
+        try:
+            stat = dir_entry.stat()
+            if dir_entry.name.endswith('.tmp'):
+                if now - stat.st_mtime > DEMO_CACHE_TMP_MAX_AGE_S:
+                    os.remove(dir_entry.path)
+                continue
+            for suffix in (_SUMM_SUFFIX, _GDF_SUFFIX):
+                if dir_entry.name.endswith(suffix):
+                    cache_entry = cache_entries.setdefault(dir_entry.name[:-len(suffix)], [0, 0, []])
+                    if suffix == _SUMM_SUFFIX:
+                        cache_entry[0] = stat.st_mtime
+                    cache_entry[1] += stat.st_size
+                    cache_entry[2].append(dir_entry.path)
+        except OSError:
+            # Removed by another session
+            continue
+
+    total_bytes = sum(cache_entry[1] for cache_entry in cache_entries.values())
+    n_removed = 0
+    for cache_key, (_, n_bytes, fpaths) in sorted(cache_entries.items(), key=lambda item: item[1][0]):
+        if total_bytes <= max_bytes:
+            break
+        for fpath in fpaths:
+            try:
+                os.remove(fpath)
+            except OSError:
+                pass
+        total_bytes -= n_bytes
+        n_removed += 1
+
+    if DEBUG_PRINT and n_removed:
+        print(f'****INFO prune_demo_cache removed {n_removed} entries - {total_bytes / 1e6:,.0f} MB left')
+    return n_removed
+
+
+def split_isos_by_cache(layer_key, gdf_isos):
+    """Looks up each iso band in the cache
+    Returns (cache_keys, cached_results, gdf_isos_missed)
+    cached_results holds (df, gdf) or None for each iso in row order"""
+    try:
+        cache_keys = get_demo_cache_keys(layer_key, gdf_isos)
+    except Exception as e:
+        # Without a fingerprint nothing can be looked up or saved - compute every band
+        print(f'!!!!WARNING split_isos_by_cache could not fingerprint {layer_key}: {e}')
+        cache_keys = [None] * len(gdf_isos)
+
+    cached_results = [load_cached_demo_result(cache_key, storename, iso_time_mins) if cache_key is not None else None
+                      for cache_key, storename, iso_time_mins
+                      in zip(cache_keys, gdf_isos['storename'], gdf_isos['iso_time_mins'])]
+
+    missed_mask = [cached_result is None for cached_result in cached_results]
+    gdf_isos_missed = gdf_isos[missed_mask]
+
+    if DEBUG_PRINT:
+        print(f'****INFO split_isos_by_cache {layer_key} {len(gdf_isos) - len(gdf_isos_missed)} cached '
+              f'{len(gdf_isos_missed)} to compute')
+
+    return cache_keys, cached_results, gdf_isos_missed
+
+
+def merge_cached_and_computed(cache_keys, cached_results, gdf_isos, computed_outputs):
+    """Saves the computed bands to the cache and returns the combined (df, gdf) outputs
+    in the row order of gdf_isos"""
+    dfs = []
+    gdfs = []
+
+    df_computed, gdf_computed = computed_outputs if computed_outputs is not None else (None, None)
+
+    for cache_key, cached_result, storename, iso_time_mins in zip(cache_keys, cached_results,
+                                                                   gdf_isos['storename'],
+                                                                   gdf_isos['iso_time_mins']):
+        if cached_result is None:
+            df_band = df_computed[(df_computed.storename == storename) &
+                                  (df_computed.iso_time_mins == iso_time_mins)]
+            gdf_band = gdf_computed[(gdf_computed.storename == storename) &
+                                    (gdf_computed.iso_time_mins == iso_time_mins)]
+            if cache_key is not None:
+                save_demo_result_to_cache(cache_key, df_band, gdf_band)
+            cached_result = (df_band, gdf_band)
+
+        dfs.append(cached_result[0])
+        gdfs.append(cached_result[1])
+
+    if computed_outputs is not None:
+        prune_demo_cache()
+
+    df_demo_output = pd.concat(dfs, ignore_index=True)
+    gdf_demo_output = pd.concat(gdfs, ignore_index=True)
+
+    return df_demo_output, gdf_demo_output
@@ -0,0 +1,105 @@
+import streamlit as st
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+import shapely
+
+from utils.load_save_data_files_utils import get_planar_base_layer, get_planar_arrow_fingerprint, PLANAR_LAYER_KEYS
+from utils.asset_build_utils import save_asset_df, read_asset_fingerprint
+from utils.demo_layer_registry import DEMO_LAYER_REGISTRY, get_demo_layer_spec
+from utils.choropleth_layer_utils import simplify_display_geometry
+from config.constants import DEBUG_PRINT, CRS, CHOROPLETH_LOD_TOLERANCES_DEG
+
+"""This module is the prebuilt display geometry of the base zones
+Each zone of a planar base layer is simplified in 4326 at every LOD tolerance once per build and saved
+to DISPLAY_GEOMETRY_DIR - overlay pieces that cover a whole zone (ZONE_ID_COL) are drawn from it so
+only the pieces clipped by an isochrone are simplified per session
+"""
+
+DISPLAY_GEOMETRY_DIR = os.path.join('assets', 'cache', 'display_geometry')
+# Bump when the simplification changes what is saved
+DISPLAY_GEOMETRY_VERSION = 1
+
+# Layers whose overlay pieces carry a zone id
+DISPLAY_GEOMETRY_LAYER_KEYS = [spec.layer_key for spec in DEMO_LAYER_REGISTRY
+                               if spec.zone_id_col and spec.layer_key in PLANAR_LAYER_KEYS]
+
+_TOLERANCE_COL = 'tolerance'
+_GEOMETRY_WKB_COL = 'geometry_wkb'
+
+
+def get_display_geometry_path(layer_key):
+    return os.path.join(DISPLAY_GEOMETRY_DIR, f'display_{layer_key}.parquet')
+
+
+def get_display_geometry_fingerprint(layer_key):
+    """Returns the fingerprint of the display geometry - the planar layer it is built from, the tolerances
+    and the build version"""
+    tolerances = ','.join(map(str, sorted(CHOROPLETH_LOD_TOLERANCES_DEG)))
+    return hashlib.sha256(f'{DISPLAY_GEOMETRY_VERSION}_{tolerances}_'
+                          f'{get_planar_arrow_fingerprint(layer_key)}'.encode()).hexdigest()
+
+
+def build_zone_display_geometry(gdf_zones, zone_id_col, tolerances=CHOROPLETH_LOD_TOLERANCES_DEG):
+    """Returns df [zone_id_col, tolerance, geometry_wkb] of every zone simplified at each tolerance
+    gdf_zones is reprojected to 4326 first - the crs the overlay pieces are drawn in"""
+    geoms = gdf_zones.geometry.to_crs(CRS.WGS84).values
+    zone_ids = gdf_zones[zone_id_col].to_numpy()
+    return pd.concat([pd.DataFrame({zone_id_col: zone_ids,
+                                    _TOLERANCE_COL: tolerance,
+                                    _GEOMETRY_WKB_COL: shapely.to_wkb(simplify_display_geometry(geoms, tolerance))})
+                      for tolerance in tolerances], ignore_index=True)
+
+
+def build_display_geometry_file(layer_key):
+    """Build step - simplifies the zones of the shared planar layer and saves them
+    Returns the display geometry df"""
+    zone_id_col = get_demo_layer_spec(layer_key).zone_id_col
+    df_display = build_zone_display_geometry(get_planar_base_layer(layer_key), zone_id_col)
+    fpath = get_display_geometry_path(layer_key)
+    try:
+        os.makedirs(DISPLAY_GEOMETRY_DIR, exist_ok=True)
+        save_asset_df(df_display, fpath, get_display_geometry_fingerprint(layer_key))
+        print(f'****INFO build_display_geometry_file saved {len(df_display)} zone LODs of {layer_key} to {fpath}')
+    except Exception as e:
+        print(f'!!!!WARNING build_display_geometry_file could not save to {fpath}: {e}')
+    return df_display
+
+
+def build_display_geometry_files():
+    """Build step - builds the display geometry of every layer in DISPLAY_GEOMETRY_LAYER_KEYS"""
+    return [build_display_geometry_file(layer_key) for layer_key in DISPLAY_GEOMETRY_LAYER_KEYS]
+
+
+@st.cache_resource(show_spinner=False)
+def load_zone_display_geometry(layer_key):
+    """Returns {tolerance: {zone id: shapely geom}} of a layer - loaded from its saved
+    file if it is current, otherwise built and saved. Held once per server and shared across sessions"""
+    fpath = get_display_geometry_path(layer_key)
+    df_display = None
+    if os.path.exists(fpath):
+        try:
+            if read_asset_fingerprint(fpath) == get_display_geometry_fingerprint(layer_key):
+                df_display = pd.read_parquet(fpath)
+        except Exception as e:
+            print(f'!!!!WARNING load_zone_display_geometry could not read {fpath} - rebuilding: {e}')
+    if df_display is None:
+        if DEBUG_PRINT:
+            print(f'****INFO load_zone_display_geometry {layer_key} display geometry missing or stale - building')
+        df_display = build_display_geometry_file(layer_key)
+
+    zone_id_col = get_demo_layer_spec(layer_key).zone_id_col
+    return {tolerance: dict(zip(df_tolerance[zone_id_col], shapely.from_wkb(df_tolerance[_GEOMETRY_WKB_COL].to_numpy())))
+            for tolerance, df_tolerance in df_display.groupby(_TOLERANCE_COL)}
+
+
+def get_zone_display_geoms(layer_key, zone_ids, tolerance):
+    """Returns an array of the prebuilt display geometry of zone_ids at tolerance - None where a zone id is
+    None or has no prebuilt geometry. Returns None if the layer has no prebuilt display geometry"""
+    if layer_key not in DISPLAY_GEOMETRY_LAYER_KEYS:
+        return None
+    zone_geoms = load_zone_display_geometry(layer_key).get(tolerance)
+    if zone_geoms is None:
+        return None
+    return np.array([zone_geoms.get(zone_id) for zone_id in zone_ids], dtype=object)
@@ -2,9 +2,6 @@ import streamlit as st
 import pandas as pd
 import geopandas as gpd
 from shapely.geometry import Point, shape
-import openrouteservice as ors
-from openrouteservice import client
-
 
 from utils.spatial_calculations_utils import haversine_distance_m
 from utils.load_save_data_files_utils import save_isochrone_gdf_to_file
@@ -13,7 +10,7 @@ from utils.spatial_processing_utils import is_valid_lat_lon
 from config.constants import (
     ISO_TIME_MINS, 
     DEBUG_PRINT,
-    ORS_API_KEY,
+    ORS_API_KEY_SECRET,
     DISTANCE_NEAREST_ISO_M,
     ISO_TIME_MINS_COL
 )
@@ -33,6 +30,8 @@ class ORSClientManager:
             if not self.api_key:
                 raise ValueError("ORS_API_KEY is not configured")
             
+            # openrouteservice is only imported when the first client is created
+            import openrouteservice as ors
             self._client = ors.Client(key=self.api_key)
             print("****INFO ORS client initialized successfully")
             
@@ -51,8 +50,19 @@ class ORSClientManager:
         return self._client is not None
 
 
-# Initialize ORS client manager
-ors_manager = ORSClientManager(ORS_API_KEY)
+def get_ors_api_key():
+    """Returns the ORS key from st.secrets - None if it is not configured"""
+    try:
+        return st.secrets[ORS_API_KEY_SECRET]
+    except Exception as e:
+        print(f"!!!!ERROR Could not read {ORS_API_KEY_SECRET} from secrets: {e}")
+        return None
+
+
+@st.cache_resource(show_spinner=False)
+def get_ors_manager():
+    """Returns the ORS client manager - created on first use and shared by every session"""
+    return ORSClientManager(get_ors_api_key())
 
 
 def get_isos_from_confirmed_locations_df(df):
@@ -181,7 +191,7 @@ def _validate_configuration():
             return False
         
         # Check ORS client
-        if not ors_manager.is_available:
+        if not get_ors_manager().is_available:
             print("!!!!ERROR ORS client is not available")
             return False
             
@@ -352,7 +362,11 @@ def _fetch_new_isochrones(lat, lon):
 
 def _get_isochrone_from_ors(lat, lon):
     """Fetch isochrone data from OpenRouteService API."""
+    # openrouteservice is only imported when a request is made
+    from openrouteservice import client
+    from openrouteservice.exceptions import ApiError
     try:
+        ors_manager = get_ors_manager()
         if not ors_manager.is_available:
             print("!!!!ERROR ORS client is not available")
             return None
@@ -382,7 +396,7 @@ def _get_isochrone_from_ors(lat, lon):
         print("****INFO Successfully received ORS response")
         return ors_response
         
-    except ors.exceptions.ApiError as e:
+    except ApiError as e:
         print(f"!!!!ERROR ORS API Error: {e}")
         return None
     except Exception as e:
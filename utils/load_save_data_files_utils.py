@@ -1,10 +1,29 @@
 import streamlit as st
 import os 
+import hashlib
+import pickle
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import geopandas as gpd
-
-from utils.parquet_io_utils import load_gdf_from_parquet, save_gdf_to_parquet
-from config.constants import DEBUG_PRINT
+from pyproj import Transformer
+
+from utils.parquet_io_utils import (load_gdf_from_parquet,
+                                    save_gdf_to_parquet,
+                                    get_row_groups_in_bbox,
+                                    convert_parquet_to_spatial_parquet)
+from utils.arrow_layer_utils import ArrowBaseLayer, write_arrow_layer, read_arrow_layer_fingerprint
+from utils.asset_build_utils import (get_msoa_crosswalk,
+                                     add_msoa_11_values_to_msoa_22,
+                                     get_msoa_la_lookup,
+                                     add_la_values_to_msoa_22,
+                                     MSOA_11_ID_COL,
+                                     MSOA_11_VALUE_COLS,
+                                     MSOA_21_ID_COL,
+                                     LA_ID_COL,
+                                     LA_VALUE_COLS)
+from utils.score_engine_utils import compile_weightings
+from utils.demo_layer_registry import DEMO_LAYER_REGISTRY
+from config.constants import DEBUG_PRINT, CRS, SQM_IN_SQKM, ZONE_AREA_COL
 
 
 """"This module loads the data files required for the application
@@ -35,6 +54,48 @@ FNAME_COUNTRIES = "gdf_countries_4326.parquet"
 
 FNAME_WEIGHTINGS = "Savills_Score_weightings.xlsx"
 
+# The compiled weightings are saved here keyed on the workbook content hash
+WEIGHTINGS_CACHE_DIR = os.path.join('assets', 'cache', 'weightings')
+# Bump when CompiledWeightings changes what is saved
+WEIGHTINGS_CACHE_VERSION = 1
+
+DATA_FILES = {
+    "msoa_20": FNAME_MSOA_20,
+    "msoa_22": FNAME_MSOA_22,
+    "iso": FNAME_ISO,
+    "la_rents": FNAME_LA_Rents,
+    # "ssdb": FNAME_SSDB,
+    "countries": FNAME_COUNTRIES,
+}
+
+# Layers the search view needs - loaded when a session starts
+# The rest are only needed once processing starts and are loaded on first access
+SEARCH_DATA_KEYS = ['iso', 'countries']
+
+# Base layers that are overlaid with the isochrones - these are also held in planar crs
+# msoa_20 and la_rents are not overlaid - their values are carried on the msoa_22 zones
+# (income through the msoa crosswalk, rents through the msoa -> LA lookup)
+PLANAR_LAYER_KEYS = ['msoa_22']
+# The data files each planar layer is built from - used to version cached results
+PLANAR_LAYER_SOURCES = {
+    'msoa_22': ['msoa_22', 'msoa_20', 'la_rents'],
+}
+ZONE_BBOX_COLS = ['bbox_minx', 'bbox_miny', 'bbox_maxx', 'bbox_maxy']
+# Zone layers with a spatially sorted copy (see parquet_io_utils) so they can be read by extent
+# The copies are derived from the raw data files - which are never rewritten
+SPATIAL_DATA_KEYS = ['msoa_22', 'msoa_20', 'la_rents']
+SPATIAL_DATA_DIR = os.path.join('assets', 'cache', 'spatial_data')
+# Bump when the sort or row groups of parquet_io_utils change
+SPATIAL_DATA_VERSION = 2
+
+# The built planar layers are saved here as Arrow IPC files that each server process memory-maps
+PLANAR_ARROW_DIR = os.path.join('assets', 'cache', 'planar_layers')
+# Bump when the planar build changes what is saved
+PLANAR_ARROW_VERSION = 1
+
+# Test versions of the outputs are written here when DEBUG_PRINT is on - under the gitignored cache dir
+DEBUG_OUTPUT_DIR = os.path.join('assets', 'cache', 'debug')
+
 def validate_gdf(gdf) -> bool:
     """
     Validate that the input is a GeoDataFrame with a valid geometry column.
@@ -53,33 +114,274 @@ def validate_gdf(gdf) -> bool:
 
 
 
-@st.cache_data(show_spinner=True)
-def load_data_files():
+def get_data_file_path(key):
+    """Returns the path of the parquet file for a key in DATA_FILES"""
+    return os.path.join('assets', 'data', DATA_FILES[key])
+
+
+def get_debug_output_path(fname):
+    """Returns the path of a debug output file in DEBUG_OUTPUT_DIR - the dir is created if missing"""
+    os.makedirs(DEBUG_OUTPUT_DIR, exist_ok=True)
+    return os.path.join(DEBUG_OUTPUT_DIR, fname)
+
+
+def get_data_file_columns(key):
+    """Returns the columns read from a data file - None reads every column
+    The planar layers only read the columns of their demo layer specs (plus the zone ids)
+    and the layers carried on msoa_22 only their id and value columns"""
+    if key == 'msoa_22':
+        columns = [MSOA_21_ID_COL]
+        for spec in DEMO_LAYER_REGISTRY:
+            if spec.layer_key == key:
+                columns += spec.get_base_cols()
+        # Income and rents are attached from msoa_20 / la_rents - they are not in the msoa_22 file
+        attached_cols = [ZONE_AREA_COL] + MSOA_11_VALUE_COLS + LA_VALUE_COLS
+        columns = [col for col in columns if col not in attached_cols]
+        return tuple(dict.fromkeys(columns))
+    if key == 'msoa_20':
+        return tuple([MSOA_11_ID_COL] + MSOA_11_VALUE_COLS)
+    if key == 'la_rents':
+        return tuple([LA_ID_COL] + LA_VALUE_COLS)
+    return None
+
+
+@st.cache_resource(show_spinner=False)
+def load_data_file(key, columns=None):
+    """
+    Load one GeoDataFrame from its parquet file with validation - columns (tuple) projects the read.
+    Loaded on first access then shared across sessions - so treat the returned gdf as read only
+    (copy before adding columns).
+    """
+    fpath = get_data_file_path(key)
+    gdf = load_gdf_from_parquet(fpath, epsg=4326, columns=list(columns) if columns else None)
+
+    if not validate_gdf(gdf):
+        raise ValueError(f"!!!!WARNING {DATA_FILES[key]} did not load as a valid GeoDataFrame with a geometry column.")
+
+    if DEBUG_PRINT:
+        print(f'****INFO load_data_file loaded {key} {gdf.shape}')
+
+    return gdf
+
+
+def get_data_file(key):
+    """Returns the shared gdf of a key in DATA_FILES - read with its column projection on first access"""
+    return load_data_file(key, get_data_file_columns(key))
+
+
+def get_spatial_data_file_path(key):
+    """Returns the path of the spatially sorted copy of a data file - versioned by the content of the
+    raw file so a changed file gets a new copy"""
+    fingerprint = hashlib.sha256(f'{SPATIAL_DATA_VERSION}_{get_data_files_fingerprint([key])}'.encode()).hexdigest()
+    return os.path.join(SPATIAL_DATA_DIR, f'{key}_{fingerprint[:16]}.parquet')
+
+
+def get_data_file_extent_path(key):
+    """Returns the file to read a data file by extent from - its spatially sorted copy if it has been built
+    for the current raw file, otherwise the raw file (read whole)"""
+    fpath_spatial = get_spatial_data_file_path(key)
+    return fpath_spatial if os.path.exists(fpath_spatial) else get_data_file_path(key)
+
+
+def load_data_file_in_extent(key, bounds, crs):
+    """Returns the zones of a data file whose bounding box intersects bounds (minx, miny, maxx, maxy in crs)
+    Only the row groups of a spatially sorted file that intersect the extent are read - not cached"""
+    fpath = get_data_file_extent_path(key)
+    bbox = Transformer.from_crs(crs, CRS.WGS84, always_xy=True).transform_bounds(*bounds)
+    columns = get_data_file_columns(key)
+    gdf = load_gdf_from_parquet(fpath, epsg=4326, columns=list(columns) if columns else None, bbox=bbox)
+
+    if DEBUG_PRINT:
+        row_groups = get_row_groups_in_bbox(fpath, bbox)
+        row_groups_msg = 'not spatially sorted' if row_groups is None else f'{len(row_groups)} row groups'
+        print(f'****INFO load_data_file_in_extent {key} read {len(gdf)} zones ({row_groups_msg})')
+
+    return gdf
+
+
+def convert_data_files_to_spatial_parquet(keys=None):
+    """Build step - writes a spatially sorted GeoParquet copy of the zone layers (default SPATIAL_DATA_KEYS)
+    to SPATIAL_DATA_DIR. Copies already built for the current raw files are left as they are
+    Returns the keys converted"""
+    keys = SPATIAL_DATA_KEYS if keys is None else keys
+    os.makedirs(SPATIAL_DATA_DIR, exist_ok=True)
+    converted_keys = []
+    for key in keys:
+        fpath_spatial = get_spatial_data_file_path(key)
+        if not os.path.exists(fpath_spatial):
+            convert_parquet_to_spatial_parquet(get_data_file_path(key), fpath_spatial, epsg=4326)
+            converted_keys.append(key)
+        remove_stale_file_versions(SPATIAL_DATA_DIR, key, fpath_spatial)
+    return converted_keys
+
+
+def load_data_files(keys=None):
+    """
+    Load the GeoDataFrames of keys (default SEARCH_DATA_KEYS) - files not loaded yet are read in parallel
+    (parquet decoding and WKB conversion release the GIL).
+    Returns a new dictionary of references to the shared GeoDataFrames.
+    """
+    keys = SEARCH_DATA_KEYS if keys is None else keys
+    with ThreadPoolExecutor(max_workers=max(len(keys), 1)) as pool:
+        futures = {key: pool.submit(get_data_file, key) for key in keys}
+        return {key: future.result() for key, future in futures.items()}
+
+
+def get_session_data_files():
+    """Returns the dict held in st.session_state.data - references to the shared search layers
+    The session adds or replaces its own entries (eg ssdb, iso) without changing the shared layers
+    The other base layers are loaded when processing starts - see load_planar_data_files"""
+    return load_data_files(SEARCH_DATA_KEYS)
+
+
+def add_zone_area_and_bbox(gdf_planar):
+    """Adds the zone area (sqkm) and the zone bounding box columns to a planar layer - in place"""
+    gdf_planar[ZONE_AREA_COL] = gdf_planar.geometry.area / SQM_IN_SQKM
+    gdf_planar[ZONE_BBOX_COLS] = gdf_planar.geometry.bounds.values
+
+
+def build_planar_data_files():
+    """
+    Build a planar (EPSG:3035) copy of each base layer used in the demographic overlays.
+    Each layer gets the zone area (sqkm) and the zone bounding box precomputed.
+    Returns a dictionary of GeoDataFrames keyed as in DATA_FILES.
+    """
+    # Only the layers the planar build needs - read in parallel with their column projections
+    gdfs = load_data_files(list(dict.fromkeys(PLANAR_LAYER_KEYS + [source_key
+                                                                   for key in PLANAR_LAYER_KEYS
+                                                                   for source_key in PLANAR_LAYER_SOURCES[key]])))
+
+    planar_gdfs = {}
+
+    for key in PLANAR_LAYER_KEYS:
+        gdf_planar = gdfs[key].to_crs(CRS.EUROPEAN_PLANAR)
+        add_zone_area_and_bbox(gdf_planar)
+
+        planar_gdfs[key] = gdf_planar
+
+        if DEBUG_PRINT:
+            print(f'****INFO build_planar_data_files built planar {key} {gdf_planar.shape}')
+
+    # Income from the 2011 msoas and LA rents are carried on the 2021 zones so they share the popn intersection
+    df_msoa_crosswalk = get_msoa_crosswalk(gdfs['msoa_20'], gdfs['msoa_22'],
+                                           get_data_files_fingerprint(['msoa_20', 'msoa_22']))
+    add_msoa_11_values_to_msoa_22(planar_gdfs['msoa_22'], gdfs['msoa_20'], df_msoa_crosswalk)
+    df_msoa_la_lookup = get_msoa_la_lookup(gdfs['la_rents'], gdfs['msoa_22'],
+                                           get_data_files_fingerprint(['la_rents', 'msoa_22']))
+    add_la_values_to_msoa_22(planar_gdfs['msoa_22'], gdfs['la_rents'], df_msoa_la_lookup)
+
+    return planar_gdfs
+
+
+def get_data_files_fingerprint(keys):
+    """Returns the version fingerprint of the content of the data files of keys"""
+    file_shas = [get_path_sha256(get_data_file_path(key)) for key in keys]
+    if len(file_shas) == 1:
+        return file_shas[0]
+    return hashlib.sha256(''.join(file_shas).encode()).hexdigest()
+
+
+def get_base_layer_fingerprint(layer_key):
+    """Returns the version fingerprint of the parquet files a base layer is built from"""
+    return get_data_files_fingerprint(PLANAR_LAYER_SOURCES.get(layer_key, [layer_key]))
+
+
+def get_planar_arrow_fingerprint(key):
+    """Returns the fingerprint of a planar Arrow layer - the source files, the columns read and the build version"""
+    columns = ','.join(get_data_file_columns(key) or [])
+    return hashlib.sha256(f'{PLANAR_ARROW_VERSION}_{get_base_layer_fingerprint(key)}_{columns}'.encode()).hexdigest()
+
+
+def get_planar_arrow_path(key, fingerprint=None):
+    """Returns the path of a planar Arrow layer - versioned by its fingerprint (default the current one)
+    A new build writes a new file rather than replacing one that a server process may have mapped
+    (a mapped file cannot be replaced on Windows)"""
+    fingerprint = fingerprint or get_planar_arrow_fingerprint(key)
+    return os.path.join(PLANAR_ARROW_DIR, f'planar_{key}_{fingerprint[:16]}.arrow')
+
+
+def remove_stale_file_versions(dirpath, name, fpath_current):
+    """Removes the other versions ({name}_{fingerprint}.ext) of a versioned file in dirpath and its
+    unversioned name ({name}.ext) of earlier builds - best effort as a file still mapped or read by
+    another process cannot be removed on Windows (it is tried again on the next build)"""
+    ext = os.path.splitext(fpath_current)[1]
+    for fname in os.listdir(dirpath):
+        fpath = os.path.join(dirpath, fname)
+        is_version = (fname.startswith(f'{name}_') and fname.endswith(ext)
+                      and '_' not in fname[len(name) + 1:-len(ext)]) or fname == f'{name}{ext}'
+        if not is_version or os.path.normpath(fpath) == os.path.normpath(fpath_current):
+            continue
+        try:
+            os.remove(fpath)
+        except OSError as e:
+            if DEBUG_PRINT:
+                print(f'****INFO remove_stale_file_versions could not remove {fpath}: {e}')
+
+
+def build_planar_arrow_layers():
+    """Build step - builds the planar layers and writes each to its versioned Arrow IPC file
+    Returns the list of paths written"""
+    os.makedirs(PLANAR_ARROW_DIR, exist_ok=True)
+    fpaths = []
+    for key, gdf_planar in build_planar_data_files().items():
+        fingerprint = get_planar_arrow_fingerprint(key)
+        fpath = get_planar_arrow_path(key, fingerprint)
+        # The same version is never rewritten - it may be mapped and has the same content
+        if not _is_planar_arrow_layer_current(key):
+            write_arrow_layer(gdf_planar, fpath, fingerprint=fingerprint)
+            print(f'****INFO build_planar_arrow_layers saved {key} {gdf_planar.shape} to {fpath}')
+        remove_stale_file_versions(PLANAR_ARROW_DIR, f'planar_{key}', fpath)
+        fpaths.append(fpath)
+    return fpaths
+
+
+def _is_planar_arrow_layer_current(key):
+    fpath = get_planar_arrow_path(key)
+    if not os.path.exists(fpath):
+        return False
+    try:
+        return read_arrow_layer_fingerprint(fpath) == get_planar_arrow_fingerprint(key)
+    except Exception as e:
+        print(f'!!!!WARNING could not read {fpath}: {e}')
+        return False
+
+
+@st.cache_resource(show_spinner=True)
+def load_planar_data_files():
     """
-    Load all required GeoDataFrames from parquet files with validation.
-    Returns a dictionary of GeoDataFrames.
+    Returns {key: ArrowBaseLayer} of the planar base layers - memory-mapped from their Arrow IPC files
+    Mapped once per server process and shared across sessions - so treat them as read only.
+    The files are built first if they are missing or their source files have changed
     """
-    data_files = {
-        "msoa_20": FNAME_MSOA_20,
-        "msoa_22": FNAME_MSOA_22,
-        "iso": FNAME_ISO,
-        "la_rents": FNAME_LA_Rents,
-        # "ssdb": FNAME_SSDB,
-        "countries": FNAME_COUNTRIES,
-    }
+    if not all(_is_planar_arrow_layer_current(key) for key in PLANAR_LAYER_KEYS):
+        if DEBUG_PRINT:
+            print(f'****INFO load_planar_data_files planar Arrow layers missing or stale - building')
+        build_planar_arrow_layers()
+
+    # Processes still mapping an older version keep it until load_planar_data_files is cleared
+    return {key: ArrowBaseLayer(get_planar_arrow_path(key)) for key in PLANAR_LAYER_KEYS}
+
 
-    gdfs = {}
+def get_planar_arrow_layer(key):
+    """Returns the shared memory-mapped planar layer - take rows from it rather than decoding it all"""
+    planar_layers = load_planar_data_files()
+    if key not in planar_layers:
+        raise KeyError(f'!!!!WARNING get_planar_arrow_layer no planar layer for {key}')
+    return planar_layers[key]
 
-    for key, fname in data_files.items():
-        fpath = os.path.join('assets','data', fname)
-        gdf = load_gdf_from_parquet(fpath, epsg=4326)
 
-        if not validate_gdf(gdf):
-            raise ValueError(f"!!!!WARNING {fname} did not load as a valid GeoDataFrame with a geometry column.")
+def load_planar_layer_in_extent(key, bounds):
+    """Returns a planar layer of only the zones within bounds (in planar crs)
+    For layers not held in PLANAR_LAYER_KEYS - eg one too large to hold in memory"""
+    gdf_planar = load_data_file_in_extent(key, bounds, CRS.EUROPEAN_PLANAR).to_crs(CRS.EUROPEAN_PLANAR)
+    add_zone_area_and_bbox(gdf_planar)
+    return gdf_planar
 
-        gdfs[key] = gdf
 
-    return gdfs
+def get_planar_base_layer(key):
+    """Returns the whole planar version of a base layer as a GeoDataFrame - decodes every geometry
+    so only use for whole layer builds (eg the raster surface)"""
+    return get_planar_arrow_layer(key).to_gdf()
 
 
 # Callable function to save isochrone to update
@@ -134,7 +436,19 @@ def get_store_isos_from_ss():
         pass
 
     return None
-    
+
+
+def get_store_isos_planar_from_ss():
+    """Get the selected locations isos in planar crs (EPSG:3035) from session state.
+    These are projected once when the isos are set - see process_search_locations
+    Returns:
+        The planar iso gdf if it exists and is not empty, otherwise returns None.
+    """
+    gdf_store_isos_planar = st.session_state.get('gdf_isos_planar')
+    if gdf_store_isos_planar is None or gdf_store_isos_planar.empty:
+        return None
+    return gdf_store_isos_planar
+
 def validate_scoring_dataframe(df):
     # Check ascending order
     _required_cols = ['Lower Bound', 'Upper Bound', 'Score']
@@ -161,57 +475,133 @@ def validate_scoring_dataframe(df):
     
     return True
 
-def get_savills_score_weightings():
+def get_savills_score_weightings(fpath_weightings=None):
     """Function loads the score weigghtings 
         - This is both the percent that each score contributes to the overall total
         and the bounds and score for each asset
+        The workbook is parsed once - every sheet is read in the same pd.read_excel call
         returns either  or if error None df_weightings and weightings_dict 
     """
-    fpath_weightings = os.path.join('assets', 'data', FNAME_WEIGHTINGS)
+    fpath_weightings = fpath_weightings or os.path.join('assets', 'data', FNAME_WEIGHTINGS)
     # First load the front sheet where the column Internal name will provide keys to the other sheets
     try:
         if DEBUG_PRINT:
             print(f'****INFO - load_savills_score_weightings trying to load score weights from {fpath_weightings}')
-            
-            df_overall_weightings = pd.read_excel(fpath_weightings,
-                                                sheet_name='Weighting')
-            if df_overall_weightings.empty:
-                print(f'!!!!WARNING df_overall_weightings could not be loaded correctly')
-                return None, None
+
+        sheets = pd.read_excel(fpath_weightings, sheet_name=None)
+        df_overall_weightings = sheets.get('Weighting')
+        if df_overall_weightings is None or df_overall_weightings.empty:
+            print(f'!!!!WARNING df_overall_weightings could not be loaded correctly')
+            return None, None
+        if DEBUG_PRINT:
             print(f'*********************')
             print(f'{df_overall_weightings}')
-            
-            weightings_dict = {}
-
-            # Capture the data for each individual score weight from each sheet in first col
-            for idx, row in df_overall_weightings.iterrows():
-                sheet_name = row.Internal_Name
-                display_name = row.Display_Name
-                
-                if sheet_name.lower() == 'total':
+
+        weightings_dict = {}
+
+        # Capture the data for each individual score weight from each sheet in first col
+        for idx, row in df_overall_weightings.iterrows():
+            sheet_name = row.Internal_Name
+            display_name = row.Display_Name
+
+            if sheet_name.lower() == 'total':
+                if DEBUG_PRINT:
                     print(f'****INFO skipping Total row')
-                    continue
+                continue
 
+            if DEBUG_PRINT:
                 print(f'****INFO Getting weightings for: {sheet_name}')
-                try:
-                    df_ind_scoring = pd.read_excel(fpath_weightings,
-                                                    sheet_name=sheet_name)
-                    if not df_ind_scoring.empty:
-                        # Check if the weightings df is correctly formatted
-                        if validate_scoring_dataframe(df_ind_scoring):
-                            weightings_dict[sheet_name] = df_ind_scoring
-                        else:
-                            print(f'!!!!WARNING {sheet_name} {display_name} is not validly formatted')
-                            continue
-                except:
-                    print(f'!!!!WARNING - could not get df for {display_name} {sheet_name}')
-            
-            return df_overall_weightings, weightings_dict
-            
+            try:
+                df_ind_scoring = sheets[sheet_name]
+                if not df_ind_scoring.empty:
+                    # Check if the weightings df is correctly formatted
+                    if validate_scoring_dataframe(df_ind_scoring):
+                        weightings_dict[sheet_name] = df_ind_scoring
+                    else:
+                        print(f'!!!!WARNING {sheet_name} {display_name} is not validly formatted')
+                        continue
+            except:
+                print(f'!!!!WARNING - could not get df for {display_name} {sheet_name}')
+
+        return df_overall_weightings, weightings_dict
+
     except Exception as e:
         print(f'!!!!WARNING - failed to load weights: {e}')
         return None, None
 
+
+@st.cache_resource(show_spinner=False)
+def get_file_sha256(fpath, mtime_ns, size):
+    """Hashes the file content - mtime_ns and size are part of the cache key so an
+    edited file is hashed again"""
+    sha = hashlib.sha256()
+    with open(fpath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def get_path_sha256(fpath):
+    """Returns the content sha256 of a file - only hashed again when its mtime / size change"""
+    stat = os.stat(fpath)
+    return get_file_sha256(fpath, stat.st_mtime_ns, stat.st_size)
+
+
+def get_weightings_path():
+    return os.path.join('assets', 'data', FNAME_WEIGHTINGS)
+
+
+def get_weightings_cache_path(weightings_sha):
+    return os.path.join(WEIGHTINGS_CACHE_DIR, f'weightings_v{WEIGHTINGS_CACHE_VERSION}_{weightings_sha[:16]}.pkl')
+
+
+def build_compiled_weightings_file(fpath_weightings, fpath_cache):
+    """Build step - parses and compiles the workbook and saves the compiled form to fpath_cache
+    Returns df_weightings, weightings_dict, compiled_weightings (not saved if it did not compile)"""
+    df_weightings, weightings_dict = get_savills_score_weightings(fpath_weightings)
+    compiled_weightings = compile_weightings(df_weightings, weightings_dict)
+    if compiled_weightings is None:
+        return df_weightings, weightings_dict, None
+
+    try:
+        os.makedirs(WEIGHTINGS_CACHE_DIR, exist_ok=True)
+        with open(fpath_cache, 'wb') as f:
+            pickle.dump((df_weightings, weightings_dict, compiled_weightings), f)
+        if DEBUG_PRINT:
+            print(f'****INFO build_compiled_weightings_file saved compiled weightings to {fpath_cache}')
+    except Exception as e:
+        print(f'!!!!WARNING build_compiled_weightings_file could not save to {fpath_cache}: {e}')
+
+    return df_weightings, weightings_dict, compiled_weightings
+
+
+@st.cache_resource(show_spinner=False)
+def _load_compiled_weightings(fpath_weightings, weightings_sha):
+    """Returns df_weightings, weightings_dict, compiled_weightings for one version of the workbook
+    Keyed on the content hash - a workbook saved again without changes is not parsed again
+    The compiled form is also saved to WEIGHTINGS_CACHE_DIR so a server restart does not parse it"""
+    fpath_cache = get_weightings_cache_path(weightings_sha)
+    if os.path.exists(fpath_cache):
+        try:
+            with open(fpath_cache, 'rb') as f:
+                return pickle.load(f)
+        except Exception as e:
+            print(f'!!!!WARNING _load_compiled_weightings could not read {fpath_cache} - rebuilding: {e}')
+
+    return build_compiled_weightings_file(fpath_weightings, fpath_cache)
+
+
+def load_savills_score_weightings():
+    """Returns df_weightings, weightings_dict, compiled_weightings - shared by all sessions so treat as read only
+    The workbook is only parsed again when its mtime / size and then its content hash change"""
+    fpath_weightings = get_weightings_path()
+    try:
+        weightings_sha = get_path_sha256(fpath_weightings)
+    except OSError as e:
+        print(f'!!!!WARNING load_savills_score_weightings could not find {fpath_weightings}: {e}')
+        return None, None, None
+    return _load_compiled_weightings(fpath_weightings, weightings_sha)
+
 def get_validated_df_ssdb(df_ssdb):
     """This function validates the loaded SSDB and returns validated DataFrame or None"""
     _required_cols = ['storename','address', 'city', 
@@ -1,52 +1,136 @@
 import streamlit as st
+import os
+import json
 import pandas as pd
 import geopandas as gpd
-from shapely.wkb import dumps as wkb_dumps
-from shapely.wkb import loads as wkb_loads
+import shapely
+import pyarrow.parquet as pq
 
-WKB_EXTENSION = '_wkb' # added to geom cols converted to WKB
+"""This module reads and writes GeoDataFrames as parquet
+Files are written as standard GeoParquet (geometry as WKB with the 'geo' schema metadata)
+Older files hold each geometry column as WKB in a column ending WKB_EXTENSION - these are still read
+Geometry is converted to / from WKB for the whole column in one shapely call
+Base layers are written spatially sorted - rows in Hilbert curve order with a per-row bbox column
+(the GeoParquet covering bbox) so each row group covers a compact area and its bbox statistics
+let a read skip every row group outside the area asked for
+"""
 
-def load_gdf_from_parquet(fpath_load, epsg=4326, geometry_col=None):
-    """
-    Load Parquet file and convert WKB columns back to geometry.
-    Return as a GeoDataFrame.
-    """
-    try:
-        # Load the DataFrame from Parquet
-        df = pd.read_parquet(fpath_load)
-    except FileNotFoundError:
-        raise FileNotFoundError(f"Parquet file not found: {fpath_load}")
-    except Exception as e:
-        raise Exception(f"Error reading parquet file: {e}")
-    
+WKB_EXTENSION = '_wkb' # added to geom cols converted to WKB in the older files
+
+GEOPARQUET_METADATA_KEY = b'geo'
+
+# Hilbert curve level of the spatial sort - 2**16 cells per axis over the layer extent
+HILBERT_LEVEL = 16
+# Rows per row group of the spatially sorted files - small enough that a catchment only
+# touches a few row groups, large enough that the footer and statistics stay small
+SPATIAL_ROW_GROUP_SIZE = 1_000
+# Struct column holding the per-row bounding box
+COVERING_BBOX_COL = 'bbox'
+_COVERING_BBOX_FIELDS = ['xmin', 'ymin', 'xmax', 'ymax']
+
+
+def is_geoparquet(fpath):
+    """True if the parquet file has GeoParquet metadata - only the footer is read"""
+    metadata = pq.read_schema(fpath).metadata or {}
+    return GEOPARQUET_METADATA_KEY in metadata
+
+
+def get_covering_bbox_col(fpath):
+    """Returns the name of the per-row bbox column of the primary geometry - None if the file has none"""
+    metadata = pq.read_schema(fpath).metadata or {}
+    if GEOPARQUET_METADATA_KEY not in metadata:
+        return None
+    geo_metadata = json.loads(metadata[GEOPARQUET_METADATA_KEY])
+    covering = geo_metadata['columns'][geo_metadata['primary_column']].get('covering', {})
+    if 'bbox' not in covering:
+        return None
+    return covering['bbox']['xmin'][0]
+
+
+def get_row_groups_in_bbox(fpath, bbox):
+    """Returns the indices of the row groups whose bbox column statistics intersect bbox (minx, miny, maxx, maxy)
+    Row groups without statistics are always included. None if the file has no bbox column"""
+    bbox_col = get_covering_bbox_col(fpath)
+    if bbox_col is None:
+        return None
+    minx, miny, maxx, maxy = bbox
+    metadata = pq.ParquetFile(fpath).metadata
+    paths = {metadata.schema.column(i).path: i for i in range(metadata.num_columns)}
+    row_groups = []
+    for rg in range(metadata.num_row_groups):
+        stats = {field: metadata.row_group(rg).column(paths[f'{bbox_col}.{field}']).statistics
+                 for field in _COVERING_BBOX_FIELDS}
+        if any(stat is None or not stat.has_min_max for stat in stats.values()):
+            row_groups.append(rg)
+        elif (stats['xmin'].min <= maxx and stats['xmax'].max >= minx
+              and stats['ymin'].min <= maxy and stats['ymax'].max >= miny):
+            row_groups.append(rg)
+    return row_groups
+
+
+def get_parquet_num_rows(fpath):
+    """Returns the number of rows in a parquet file - only the footer is read"""
+    return pq.ParquetFile(fpath).metadata.num_rows
+
+
+def get_parquet_read_columns(fpath, columns):
+    """Returns the columns to read for a projection onto columns - the geometry columns are always read
+    Columns not in the file are left out with a warning. None reads every column"""
+    if columns is None:
+        return None
+    schema = pq.read_schema(fpath)
+    metadata = schema.metadata or {}
+    if GEOPARQUET_METADATA_KEY in metadata:
+        geometry_columns = list(json.loads(metadata[GEOPARQUET_METADATA_KEY])['columns'])
+    else:
+        geometry_columns = [col for col in schema.names if col.endswith(WKB_EXTENSION)]
+
+    missing_cols = [col for col in columns if col not in schema.names]
+    if missing_cols:
+        print(f'!!!!WARNING get_parquet_read_columns {fpath} does not have columns {missing_cols}')
+    return [col for col in schema.names if col in columns or col in geometry_columns]
+
+
+def _set_primary_geometry(gdf, geometry_col, epsg):
+    """Sets geometry_col (if passed) as the primary geometry and the crs if the file had none"""
+    if geometry_col and geometry_col != gdf.geometry.name:
+        if geometry_col not in gdf.columns:
+            raise ValueError(f"Specified geometry column '{geometry_col}' not found. "
+                             f"Available columns: {list(gdf.columns)}")
+        gdf = gdf.set_geometry(geometry_col)
+    if gdf.crs is None:
+        gdf = gdf.set_crs(epsg=epsg)
+    return gdf
+
+
+def _load_gdf_from_wkb_parquet(df, epsg, geometry_col):
+    """Converts the WKB_EXTENSION columns of an older file to geometry - returns a GeoDataFrame"""
     # Find all WKB columns
     wkb_columns = [col for col in df.columns if col.endswith(WKB_EXTENSION)]
     if not wkb_columns:
         raise ValueError(f"No columns ending with '{WKB_EXTENSION}' found in the parquet file")
-    
+
     # Convert WKB columns back to geometry
     geometry_columns = []
-    failed_conversions = []
-    
+
     for col in wkb_columns:
         new_col_name = col.removesuffix(WKB_EXTENSION)  # More explicit than replace
-        
+
         try:
-            # Handle potential None/NaN values in WKB data
-            df[new_col_name] = df[col].apply(
-                lambda x: wkb_loads(x) if pd.notna(x) and x is not None else None
-            )
+            # Missing values (None / NaN) are left as None
+            wkb_values = df[col].where(df[col].notna(), None).to_numpy(dtype=object)
+            df[new_col_name] = gpd.GeoSeries(shapely.from_wkb(wkb_values), index=df.index)
             geometry_columns.append(new_col_name)
         except Exception as e:
             print(f"!!!!WARNING Failed to convert WKB column '{col}': {e}")
             continue
-        
+
         # Drop the original WKB column
         df = df.drop(columns=[col])
-    
+
     if not geometry_columns:
         raise ValueError("No WKB columns could be successfully converted to geometry")
-    
+
     # Determine which geometry column to use
     if geometry_col:
         if geometry_col not in geometry_columns:
@@ -58,30 +142,96 @@ def load_gdf_from_parquet(fpath_load, epsg=4326, geometry_col=None):
         if len(geometry_columns) > 1:
             print(f"!!!!WARNING Multiple geometry columns found: {geometry_columns}. "
                          f"Using '{primary_geom_col}' as primary geometry.")
-    
+
     # Create GeoDataFrame
     try:
         gdf = gpd.GeoDataFrame(df, geometry=primary_geom_col, crs=f"EPSG:{epsg}")
     except Exception as e:
         raise Exception(f"Error creating GeoDataFrame: {e}")
-    
+
     return gdf
 
+
+def load_gdf_from_parquet(fpath_load, epsg=4326, geometry_col=None, columns=None, bbox=None):
+    """
+    Load a GeoParquet file - or an older parquet file with WKB_EXTENSION columns - as a GeoDataFrame.
+    epsg is used if the file does not hold a crs
+    columns projects the read onto these (non geometry) columns - None reads them all
+    bbox (minx, miny, maxx, maxy in the file crs) only returns the rows whose bounding box intersects it
+    For files with a per-row bbox column only the row groups whose statistics intersect bbox are read
+    """
+    try:
+        read_columns = get_parquet_read_columns(fpath_load, columns)
+        if is_geoparquet(fpath_load):
+            if bbox is not None and get_covering_bbox_col(fpath_load) is not None:
+                gdf = gpd.read_parquet(fpath_load, columns=read_columns, bbox=tuple(bbox))
+            else:
+                gdf = gpd.read_parquet(fpath_load, columns=read_columns)
+                if bbox is not None:
+                    gdf = gdf.cx[bbox[0]:bbox[2], bbox[1]:bbox[3]]
+            return _set_primary_geometry(gdf, geometry_col, epsg)
+        # Load the DataFrame from Parquet
+        df = pd.read_parquet(fpath_load, columns=read_columns)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Parquet file not found: {fpath_load}")
+    except Exception as e:
+        raise Exception(f"Error reading parquet file: {e}")
+
+    gdf = _load_gdf_from_wkb_parquet(df, epsg, geometry_col)
+    if bbox is not None:
+        gdf = gdf.cx[bbox[0]:bbox[2], bbox[1]:bbox[3]]
+    return gdf
+
+
 def save_gdf_to_parquet(gdf_to_save, fpath_save, geometry_cols_list=['geometry']):
     """
-    Save iso_gdf to a Parquet file after converting geometry columns to WKB
+    Save a GeoDataFrame to a GeoParquet file
+    Every column in geometry_cols_list is written as geometry (WKB) and listed in the GeoParquet metadata
     """
-    
-    # Make a copy of the GeoDataFrame to be absolutely sure to avoid modifying the original
-    gdf_to_save = gdf_to_save.copy()
+    # Shallow copy so converting a column does not modify the original
+    gdf_to_save = gdf_to_save.copy(deep=False)
 
+    # Make sure the extra geometry columns are geometry dtype so they are encoded as WKB
     for col in geometry_cols_list:
-        new_col_name = col + WKB_EXTENSION
-        # Convert geometry columns to WKB
-        gdf_to_save[new_col_name] = gdf_to_save[col].apply(wkb_dumps)
-        # drop the original geom column
-        gdf_to_save = gdf_to_save.drop(columns=[col])
-        
-    # Save the DataFrame to Parquet
+        if col != gdf_to_save.geometry.name and not isinstance(gdf_to_save[col].dtype, gpd.array.GeometryDtype):
+            gdf_to_save[col] = gpd.GeoSeries(gdf_to_save[col], crs=gdf_to_save.crs)
+
+    # Save the GeoDataFrame to GeoParquet
     gdf_to_save.to_parquet(fpath_save, engine='pyarrow')
-    print(f'****INFO Saved GeoDataFrame to {fpath_save}')
\ No newline at end of file
+    print(f'****INFO Saved GeoDataFrame to {fpath_save}')
+
+
+def sort_gdf_spatially(gdf):
+    """Returns gdf with its rows in Hilbert curve order of their bounding box centres (index reset)
+    Rows close on the curve are close on the ground - so any run of rows covers a compact area"""
+    hilbert_distances = gdf.geometry.hilbert_distance(level=HILBERT_LEVEL).to_numpy()
+    return gdf.iloc[hilbert_distances.argsort(kind='stable')].reset_index(drop=True)
+
+
+def save_gdf_to_spatial_parquet(gdf_to_save, fpath_save, row_group_size=SPATIAL_ROW_GROUP_SIZE):
+    """
+    Save a GeoDataFrame as a spatially sorted GeoParquet file for reading by bbox
+    Rows are in Hilbert curve order, each row has its bounding box in COVERING_BBOX_COL
+    and the file is written in row groups of row_group_size
+    Written to a temporary file first so a reader never sees a partial file
+    """
+    gdf_sorted = sort_gdf_spatially(gdf_to_save)
+    fpath_tmp = f'{fpath_save}.tmp'
+    gdf_sorted.to_parquet(fpath_tmp, engine='pyarrow', write_covering_bbox=True, row_group_size=row_group_size)
+    os.replace(fpath_tmp, fpath_save)
+    print(f'****INFO Saved spatially sorted GeoDataFrame ({len(gdf_sorted)} rows in row groups of '
+          f'{row_group_size}) to {fpath_save}')
+
+
+def convert_parquet_to_spatial_parquet(fpath_load, fpath_save=None, epsg=4326):
+    """Rewrites a parquet file as spatially sorted GeoParquet - in place if fpath_save is None"""
+    gdf = load_gdf_from_parquet(fpath_load, epsg=epsg)
+    save_gdf_to_spatial_parquet(gdf, fpath_save or fpath_load)
+    return gdf
+
+
+def convert_wkb_parquet_to_geoparquet(fpath_load, fpath_save=None, epsg=4326):
+    """Rewrites an older WKB_EXTENSION parquet file as GeoParquet - in place if fpath_save is None"""
+    gdf = load_gdf_from_parquet(fpath_load, epsg=epsg)
+    save_gdf_to_parquet(gdf, fpath_save or fpath_load, geometry_cols_list=[gdf.geometry.name])
+    return gdf
@@ -3,13 +3,14 @@ import pandas as pd
 import numpy as np
 import geopandas as gpd
 
-from config.constants import DEBUG_PRINT
+from config.constants import DEBUG_PRINT, CRS
 from utils.isochrone_utils import get_isos_from_confirmed_locations_df
 from utils.competition_utils import process_competition_with_isochrones, summarise_competition
-from utils.demo_processing_utils import (process_LA_rents, 
-                                         process_household_inc, 
-                                         process_popn_data)
+from utils.demo_processing_utils import run_demo_processors
 from utils.demo_data_summary_management_utils import create_base_df_demo_summ
+from utils.load_save_data_files_utils import get_debug_output_path
+from utils.raster_demo_utils import get_fast_catchment_demographics, get_indicative_demographics_table
+from utils.store_band_views_utils import start_store_band_views_precompute
 
 def validate_confirmed_locations(df):
     """
@@ -53,6 +54,16 @@ def set_storenames_from_search_locations(valid_storenames):
             print(f'****INFO valid_storename {valid_storenames[0]}')
 
 
+def show_indicative_demographics(df_demo_fast):
+    """Shows the raster values while the competition and the exact overlays are processed
+    They are written in the run that processes the locations so they are seen before the exact values"""
+    df_indicative = get_indicative_demographics_table(df_demo_fast)
+    if df_indicative is None:
+        return
+    st.caption('Indicative demographics (raster) - the exact values follow once processing finishes')
+    st.dataframe(df_indicative, hide_index=True)
+
+
 def process_search_locations():
     """
     Process the confirmed locations after validation.
@@ -79,9 +90,20 @@ def process_search_locations():
     if not gdf_isos.empty:
         print(f'****INFO saving gdf_isos to session_state {gdf_isos.shape}')
         st.session_state.gdf_isos = gdf_isos
+        # Project the isos once so the demographic overlays can run in planar crs
+        st.session_state.gdf_isos_planar = gdf_isos.to_crs(CRS.EUROPEAN_PLANAR)
+
+        # Indicative numbers from the raster surface - shown now while the exact overlays run
+        # and afterwards against the exact values in the summary tab
+        try:
+            st.session_state.df_demo_fast = get_fast_catchment_demographics(st.session_state.gdf_isos_planar)
+        except Exception as e:
+            print(f'!!!!WARNING process_search_locations could not get raster fast-path demographics: {e}')
+            st.session_state.df_demo_fast = None
+        show_indicative_demographics(st.session_state.df_demo_fast)
         if DEBUG_PRINT:
             try:
-                fpath_test = r'D:\D_documents\OldCo\Savills\Scripts\SSST_V2\assets\data\test_isos.gpkg'
+                fpath_test = get_debug_output_path('test_isos.gpkg')
                 gdf_isos.to_file(fpath_test, driver='GPKG')
                 print(f'****INFO Successfully saved gdf_isos to {fpath_test}')
             except:
@@ -97,16 +119,17 @@ def process_search_locations():
             print(f'!!!!WARNING process_search_locations could not print info on gdf_competition')
 
 
-    # Process demographic data
-    process_LA_rents()
-    process_household_inc()
-    process_popn_data()
+    # Process demographic data - see DEMO_PROCESSING_MODE
+    run_demo_processors()
 
     # Check if we have valid competition data and update session state
     if gdf_competition is not None and not gdf_competition.empty:
         
         st.session_state.gdf_competition = gdf_competition
 
+        # Every store / drive time is precomputed in the background while the first view renders
+        start_store_band_views_precompute()
+
         # Update the flag to trigger UI output
         st.session_state.src_locations_selected = True
         st.rerun()
\ No newline at end of file
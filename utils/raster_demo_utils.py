@@ -0,0 +1,284 @@
+import streamlit as st
+import os
+import hashlib
+import pandas as pd
+import numpy as np
+import shapely
+
+from utils.load_save_data_files_utils import get_planar_base_layer, get_planar_arrow_fingerprint
+from utils.demo_layer_registry import EXTENSIVE, get_demo_layer_spec
+from config.constants import DEBUG_PRINT, ISO_TIME_MINS_COL
+
+"""This module is the raster fast-path for indicative catchment demographics
+The extensive msoa_22 metrics are spread over a regular planar grid once per server
+Each grid row is stored as prefix sums (the running total along the row - not a 2D summed-area table)
+so any run of cells inside a rasterized isochrone sums with two lookups
+The prefix sums restart every RASTER_PREFIX_BLOCK_COLS cells and are held as float32 within a block plus
+a float64 offset per block - so a long row does not lose precision and the grid is held at half the memory
+The exact overlay path in demo_processing_utils remains the source of truth
+The surface is built by the asset pipeline and saved to RASTER_SURFACE_DIR - a user run only loads it
+"""
+
+RASTER_CELL_SIZE_M = 200
+
+RASTER_SURFACE_DIR = os.path.join('assets', 'cache', 'raster')
+# Bump when the rasterization changes what is saved
+RASTER_SURFACE_VERSION = 2
+
+# Cells per block of the row prefix sums - a float32 prefix within a block is exact to ~1e-7 of the block total
+RASTER_PREFIX_BLOCK_COLS = 256
+
+# Only extensive metrics can be spread over the grid - they are summed by cell
+RASTER_METRICS = [col.source for col in get_demo_layer_spec('msoa_22').get_columns(EXTENSIVE)]
+
+NO_ZONE = -1
+
+
+class DemoRasterSurface:
+    """Gridded msoa_22 metrics in planar crs with row prefix sums per metric"""
+
+    def __init__(self, gdf_zones, metrics, cell_size_m=RASTER_CELL_SIZE_M, block_cols=RASTER_PREFIX_BLOCK_COLS):
+        self.cell_size_m = cell_size_m
+        self.block_cols = block_cols
+        self.metrics = list(metrics)
+
+        minx, miny, maxx, maxy = gdf_zones.total_bounds
+        self.origin_x = np.floor(minx / cell_size_m) * cell_size_m
+        self.origin_y = np.floor(miny / cell_size_m) * cell_size_m
+        self.n_cols = int(np.ceil((maxx - self.origin_x) / cell_size_m))
+        self.n_rows = int(np.ceil((maxy - self.origin_y) / cell_size_m))
+
+        zone_idx = self._rasterize_zones(gdf_zones.geometry.values)
+        values = gdf_zones[self.metrics].to_numpy(dtype='float64')
+        self.row_prefix, self.row_block_offsets = self._build_row_prefix_sums(gdf_zones.geometry.values,
+                                                                              zone_idx, values)
+
+    def _cell_centres(self, row_start, row_end, col_start, col_end):
+        """Returns the x and y cell centre coordinates of a window of the grid"""
+        xs = self.origin_x + (np.arange(col_start, col_end) + 0.5) * self.cell_size_m
+        ys = self.origin_y + (np.arange(row_start, row_end) + 0.5) * self.cell_size_m
+        return np.meshgrid(xs, ys)
+
+    def _get_window(self, bounds):
+        """Returns the (row_start, row_end, col_start, col_end) window of the grid covering bounds"""
+        minx, miny, maxx, maxy = bounds
+        col_start = max(int(np.floor((minx - self.origin_x) / self.cell_size_m)), 0)
+        col_end = min(int(np.ceil((maxx - self.origin_x) / self.cell_size_m)), self.n_cols)
+        row_start = max(int(np.floor((miny - self.origin_y) / self.cell_size_m)), 0)
+        row_end = min(int(np.ceil((maxy - self.origin_y) / self.cell_size_m)), self.n_rows)
+        return row_start, row_end, col_start, col_end
+
+    def _rasterize_zones(self, geoms):
+        """Assigns each cell to the zone containing its centre"""
+        zone_idx = np.full((self.n_rows, self.n_cols), NO_ZONE, dtype='int32')
+        for i, geom in enumerate(geoms):
+            row_start, row_end, col_start, col_end = self._get_window(geom.bounds)
+            if row_end <= row_start or col_end <= col_start:
+                continue
+            x, y = self._cell_centres(row_start, row_end, col_start, col_end)
+            inside = shapely.contains_xy(geom, x, y)
+            zone_idx[row_start:row_end, col_start:col_end][inside] = i
+        return zone_idx
+
+    def _build_row_prefix_sums(self, geoms, zone_idx, values):
+        """Spreads each zone total evenly over its cells and returns the row prefix sums
+            row_prefix        - float32 (n_metrics, n_rows, n_cols + 1) - total of the cells of the row before
+                                col, counted from the start of the block of col
+            row_block_offsets - float64 (n_metrics, n_rows, n_blocks) - total of the row before each block
+        Zones smaller than a cell are put in the cell containing their representative point so the grid
+        totals match the zone totals"""
+        n_zones = len(values)
+        in_grid = zone_idx != NO_ZONE
+        cell_counts = np.bincount(zone_idx[in_grid], minlength=n_zones)
+
+        # Zones without any cell centre inside them
+        missed_zones = np.flatnonzero(cell_counts == 0)
+        missed_points = shapely.get_coordinates(shapely.point_on_surface(geoms[missed_zones]))
+        missed_cols = np.clip(((missed_points[:, 0] - self.origin_x) // self.cell_size_m).astype(int), 0, self.n_cols - 1)
+        missed_rows = np.clip(((missed_points[:, 1] - self.origin_y) // self.cell_size_m).astype(int), 0, self.n_rows - 1)
+
+        zone_density = np.divide(values, cell_counts[:, None],
+                                 out=np.zeros_like(values), where=cell_counts[:, None] > 0)
+
+        block_starts = np.arange(0, self.n_cols + 1, self.block_cols)
+        col_blocks = np.arange(self.n_cols + 1) // self.block_cols
+        row_prefix = np.zeros((len(self.metrics), self.n_rows, self.n_cols + 1), dtype='float32')
+        row_block_offsets = np.zeros((len(self.metrics), self.n_rows, len(block_starts)), dtype='float64')
+        for m in range(len(self.metrics)):
+            grid = np.zeros((self.n_rows, self.n_cols), dtype='float64')
+            grid[in_grid] = zone_density[zone_idx[in_grid], m]
+            np.add.at(grid, (missed_rows, missed_cols), values[missed_zones, m])
+            # Summed in float64 - only the part within a block is held as float32
+            prefix = np.zeros((self.n_rows, self.n_cols + 1), dtype='float64')
+            prefix[:, 1:] = np.cumsum(grid, axis=1)
+            row_block_offsets[m] = prefix[:, block_starts]
+            row_prefix[m] = prefix - row_block_offsets[m][:, col_blocks]
+        return row_prefix, row_block_offsets
+
+    def _get_row_prefix(self, rows, cols):
+        """Returns the float64 totals (n_metrics, len(rows)) of each row before each col"""
+        return (self.row_block_offsets[:, rows, cols // self.block_cols]
+                + self.row_prefix[:, rows, cols])
+
+    def catchment_totals(self, geom):
+        """Returns (totals, error_estimates) arrays in self.metrics order for a planar polygon
+        The error estimate is half of the value held in the cells on the edge of the rasterized polygon"""
+        n_metrics = len(self.metrics)
+        row_start, row_end, col_start, col_end = self._get_window(geom.bounds)
+        if row_end <= row_start or col_end <= col_start:
+            return np.zeros(n_metrics), np.zeros(n_metrics)
+
+        x, y = self._cell_centres(row_start, row_end, col_start, col_end)
+        inside = shapely.contains_xy(geom, x, y)
+
+        # Runs of cells inside the polygon along each row - a run is [start, end) in window cols
+        padded = np.zeros((inside.shape[0], inside.shape[1] + 2), dtype='int8')
+        padded[:, 1:-1] = inside
+        steps = np.diff(padded, axis=1)
+        run_rows, run_starts = np.nonzero(steps == 1)
+        _, run_ends = np.nonzero(steps == -1)
+
+        rows = run_rows + row_start
+        totals = (self._get_row_prefix(rows, run_ends + col_start)
+                  - self._get_row_prefix(rows, run_starts + col_start)).sum(axis=1)
+
+        # Edge cells - inside cells with a 4-neighbour outside
+        inside_padded = np.pad(inside, 1, constant_values=False)
+        interior = (inside_padded[:-2, 1:-1] & inside_padded[2:, 1:-1]
+                    & inside_padded[1:-1, :-2] & inside_padded[1:-1, 2:])
+        edge_rows, edge_cols = np.nonzero(inside & ~interior)
+        edge_rows = edge_rows + row_start
+        edge_cols = edge_cols + col_start
+        edge_values = (self._get_row_prefix(edge_rows, edge_cols + 1)
+                       - self._get_row_prefix(edge_rows, edge_cols))
+        error_estimates = 0.5 * edge_values.sum(axis=1)
+
+        return totals, error_estimates
+
+    def save(self, fpath, fingerprint=''):
+        """Saves the grid and its row prefix sums to an uncompressed npz
+        fingerprint is saved with it so a stale file can be detected"""
+        fpath_tmp = f'{fpath}.tmp.npz'
+        np.savez(fpath_tmp, row_prefix=self.row_prefix, row_block_offsets=self.row_block_offsets,
+                 metrics=np.array(self.metrics),
+                 grid=np.array([self.cell_size_m, self.origin_x, self.origin_y, self.n_cols, self.n_rows,
+                                self.block_cols], dtype='float64'),
+                 fingerprint=np.array(fingerprint))
+        os.replace(fpath_tmp, fpath)
+
+    @classmethod
+    def load(cls, fpath):
+        """Returns (surface, fingerprint) from a file written by save"""
+        with np.load(fpath) as saved:
+            surface = cls.__new__(cls)
+            surface.row_prefix = saved['row_prefix']
+            surface.row_block_offsets = saved['row_block_offsets']
+            surface.metrics = saved['metrics'].tolist()
+            surface.cell_size_m, surface.origin_x, surface.origin_y, n_cols, n_rows, block_cols = saved['grid'].tolist()
+            surface.n_cols, surface.n_rows, surface.block_cols = int(n_cols), int(n_rows), int(block_cols)
+            return surface, str(saved['fingerprint'])
+
+
+def get_raster_surface_path():
+    return os.path.join(RASTER_SURFACE_DIR, 'raster_msoa_22.npz')
+
+
+def get_raster_surface_fingerprint():
+    """Returns the fingerprint of the raster surface - the planar layer it is built from, the grid and the build version"""
+    return hashlib.sha256(f'{RASTER_SURFACE_VERSION}_{RASTER_CELL_SIZE_M}_{",".join(RASTER_METRICS)}_'
+                          f'{get_planar_arrow_fingerprint("msoa_22")}'.encode()).hexdigest()
+
+
+def build_demo_raster_surface_file():
+    """Build step - rasterizes the shared planar msoa_22 layer and saves the surface
+    Returns the surface"""
+    surface = DemoRasterSurface(get_planar_base_layer('msoa_22'), RASTER_METRICS)
+    fpath = get_raster_surface_path()
+    try:
+        os.makedirs(RASTER_SURFACE_DIR, exist_ok=True)
+        surface.save(fpath, fingerprint=get_raster_surface_fingerprint())
+        print(f'****INFO build_demo_raster_surface_file saved {surface.n_rows} x {surface.n_cols} grid '
+              f'at {surface.cell_size_m}m for {len(surface.metrics)} metrics to {fpath}')
+    except Exception as e:
+        print(f'!!!!WARNING build_demo_raster_surface_file could not save to {fpath}: {e}')
+    return surface
+
+
+@st.cache_resource(show_spinner=True)
+def get_demo_raster_surface():
+    """Returns the raster surface of the shared planar msoa_22 layer - loaded from the file saved by the
+    asset pipeline (python -m utils.asset_pipeline_utils). Held once per server and shared across sessions
+    Raises FileNotFoundError if the file is missing or stale - it is not cached so a later build is picked up
+    The ~280MB surface is never built in a user run"""
+    fpath = get_raster_surface_path()
+    if os.path.exists(fpath):
+        surface, fingerprint = DemoRasterSurface.load(fpath)
+        if fingerprint == get_raster_surface_fingerprint():
+            if DEBUG_PRINT:
+                print(f'****INFO get_demo_raster_surface loaded {surface.n_rows} x {surface.n_cols} grid from {fpath}')
+            return surface
+    raise FileNotFoundError(f'raster surface {fpath} is missing or stale')
+
+
+def get_fast_catchment_demographics(gdf_isos):
+    """Returns indicative catchment totals for each iso from the raster surface
+    gdf_isos must be in planar crs and have the columns storename and iso_time_mins
+    Returns df with columns storename, iso_time_mins, metric, value, error_estimate
+    Returns None if the surface has not been prebuilt - the fast path is skipped"""
+    try:
+        surface = get_demo_raster_surface()
+    except Exception as e:
+        print(f'!!!!WARNING get_fast_catchment_demographics skipped - run python -m utils.asset_pipeline_utils '
+              f'to prebuild the raster surface: {e}')
+        return None
+
+    rows = []
+    for storename, iso_time_mins, geom in zip(gdf_isos['storename'], gdf_isos[ISO_TIME_MINS_COL], gdf_isos.geometry):
+        totals, error_estimates = surface.catchment_totals(geom)
+        for metric, value, error_estimate in zip(surface.metrics, totals, error_estimates):
+            rows.append({'storename': storename,
+                         ISO_TIME_MINS_COL: iso_time_mins,
+                         'metric': metric,
+                         'value': round(value, 0),
+                         'error_estimate': round(error_estimate, 0)})
+
+    return pd.DataFrame(rows)
+
+
+def get_indicative_demographics_table(df_demo_fast):
+    """Returns df of the raster values with a row per store / iso_time_mins and a column per metric - or None"""
+    if df_demo_fast is None or df_demo_fast.empty:
+        return None
+    return (df_demo_fast.pivot_table(index=['storename', ISO_TIME_MINS_COL], columns='metric',
+                                     values='value', sort=False)
+            .reindex(columns=RASTER_METRICS)
+            .rename_axis(columns=None)
+            .reset_index())
+
+
+def compare_fast_to_exact(df_demo_fast, storename, iso_time_mins, get_exact_value):
+    """Returns a df of the raster values for a store / iso with the error estimate
+    and - where the exact overlay path has a value for the metric - the actual error
+    get_exact_value is called as get_exact_value(storename, iso_time_mins, metric) and returns a value or None"""
+    if df_demo_fast is None or df_demo_fast.empty:
+        return None
+
+    df_filtered = df_demo_fast[(df_demo_fast.storename == storename) &
+                               (df_demo_fast[ISO_TIME_MINS_COL] == iso_time_mins)]
+    if df_filtered.empty:
+        return None
+
+    rows = []
+    for metric, value, error_estimate in zip(df_filtered.metric, df_filtered.value, df_filtered.error_estimate):
+        exact_value = get_exact_value(storename, iso_time_mins, metric)
+        if exact_value is not None and exact_value != 0:
+            actual_error_perc = round((value - exact_value) / exact_value * 100, 2)
+        else:
+            actual_error_perc = None
+        rows.append({'Metric': metric,
+                     'Indicative (raster)': value,
+                     'Error estimate (+/-)': error_estimate,
+                     'Exact (overlay)': exact_value,
+                     'Actual error %': actual_error_perc})
+
+    return pd.DataFrame(rows)
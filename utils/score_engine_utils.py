@@ -0,0 +1,210 @@
+import numpy as np
+import pandas as pd
+
+"""This module is the scoring engine for the Savills self storage score
+Each weightings sheet is compiled into sorted bound arrays so a whole matrix of factor values
+(every store x drive time) is scored with one np.searchsorted per factor
+Values below the lowest bound take the first score and above the highest bound the last score
+A value in a gap between bands has no score (NaN) and the factor is left out for that store / band
+"""
+
+SCORE_ROUNDING_MULTIPLE = 0.25
+
+# Supply factors are not in df_demo_summ - they come from the competition in each catchment
+SUPPLY_FACTORS = {
+    'People_per_store': 'People per store',
+    'CLA_per_person': 'CLA per person',
+}
+
+
+def round_to_score_multiple(values):
+    """Rounds to the nearest SCORE_ROUNDING_MULTIPLE"""
+    return np.round(np.asarray(values, dtype='float64') / SCORE_ROUNDING_MULTIPLE, 0) * SCORE_ROUNDING_MULTIPLE
+
+
+class FactorScale:
+    """Bounds and scores of one weightings sheet as sorted arrays
+    The sheet must have passed validate_scoring_dataframe (ascending, non overlapping bounds)"""
+
+    def __init__(self, df_scoring):
+        self.lower = df_scoring['Lower Bound'].to_numpy(dtype='float64')
+        self.upper = df_scoring['Upper Bound'].to_numpy(dtype='float64')
+        self.scores = df_scoring['Score'].to_numpy(dtype='float64')
+
+    def score(self, values):
+        """Returns the score of each value - NaN where the value is NaN or falls between bands"""
+        values = np.asarray(values, dtype='float64')
+        # First band whose upper bound is >= value - a value on a shared bound takes the lower band
+        idx = np.searchsorted(self.upper, values, side='left')
+        idx_clipped = np.minimum(idx, len(self.upper) - 1)
+        in_band = (idx < len(self.upper)) & (self.lower[idx_clipped] <= values)
+        scores = np.where(in_band, self.scores[idx_clipped], np.nan)
+        scores = np.where(values < self.lower[0], self.scores[0], scores)
+        scores = np.where(values > self.upper[-1], self.scores[-1], scores)
+        return scores
+
+
+class CompiledWeightings:
+    """The weightings workbook compiled for the scoring engine
+    Demand factors are in Weighting sheet order followed by the supply factors
+    Only factors with a weight and a valid bounds sheet are included"""
+
+    def __init__(self, df_weightings, weightings_dict):
+        self.factor_names = []
+        self.display_names = []
+        self.is_supply = []
+        self.weights = []
+        self.scales = []
+
+        for internal_name, display_name, supply_demand, weight in zip(df_weightings['Internal_Name'],
+                                                                      df_weightings['Display_Name'],
+                                                                      df_weightings['Supply_Demand'],
+                                                                      df_weightings['Weight']):
+            if supply_demand == 'Supply' or internal_name not in weightings_dict:
+                continue
+            self._add_factor(internal_name, display_name, False, weight, weightings_dict[internal_name])
+
+        for internal_name, display_name in SUPPLY_FACTORS.items():
+            weight_values = df_weightings.loc[df_weightings['Internal_Name'] == internal_name, 'Weight'].values
+            if len(weight_values) == 0 or internal_name not in weightings_dict:
+                print(f'!!!!WARNING CompiledWeightings no weight or bounds found for {internal_name}')
+                continue
+            self._add_factor(internal_name, display_name, True, weight_values[0], weightings_dict[internal_name])
+
+        self.weights = np.array(self.weights, dtype='float64')
+
+    def _add_factor(self, internal_name, display_name, is_supply, weight, df_scoring):
+        self.factor_names.append(internal_name)
+        self.display_names.append(display_name)
+        self.is_supply.append(is_supply)
+        self.scales.append(FactorScale(df_scoring))
+        self.weights.append(float(weight))
+
+    @property
+    def demand_factor_names(self):
+        return [name for name, is_supply in zip(self.factor_names, self.is_supply) if not is_supply]
+
+    def score(self, factor_values):
+        """Returns the unweighted scores of factor_values shape (..., n_factors)"""
+        factor_values = np.asarray(factor_values, dtype='float64')
+        scores = np.empty_like(factor_values)
+        for i, scale in enumerate(self.scales):
+            scores[..., i] = scale.score(factor_values[..., i])
+        return scores
+
+
+def compile_weightings(df_weightings, weightings_dict):
+    """Returns CompiledWeightings - or None if the weightings have not loaded"""
+    if df_weightings is None or weightings_dict is None:
+        print(f'!!!!WARNING compile_weightings weightings not loaded')
+        return None
+    return CompiledWeightings(df_weightings, weightings_dict)
+
+
+def get_weighted_scores(unweighted_scores, weights):
+    """Returns weight x score rounded to SCORE_ROUNDING_MULTIPLE - NaN scores stay NaN"""
+    return round_to_score_multiple(unweighted_scores * weights)
+
+
+def get_overall_scores(weighted_scores):
+    """Returns the sum of the weighted scores over the factor axis rounded to SCORE_ROUNDING_MULTIPLE"""
+    return round_to_score_multiple(np.nansum(weighted_scores, axis=-1))
+
+
+class ScoreCube:
+    """Factor values and scores for every store x drive time x factor
+    The unweighted scores are kept so other weights (eg a what-if override) only need the weighted sum"""
+
+    def __init__(self, compiled_weightings, storenames, iso_time_mins_list, factor_values):
+        self.compiled_weightings = compiled_weightings
+        self.storenames = list(storenames)
+        self.iso_time_mins_list = list(iso_time_mins_list)
+        self.factor_values = factor_values
+        self.unweighted_scores = compiled_weightings.score(factor_values)
+        self.weighted_scores = get_weighted_scores(self.unweighted_scores, compiled_weightings.weights)
+        self.overall_scores = get_overall_scores(self.weighted_scores)
+
+    def _get_position(self, storename, iso_time_mins):
+        return self.storenames.index(storename), self.iso_time_mins_list.index(iso_time_mins)
+
+    def __contains__(self, store_band):
+        storename, iso_time_mins = store_band
+        return storename in self.storenames and iso_time_mins in self.iso_time_mins_list
+
+    def get_weighted_scores(self, weights=None):
+        """Returns the weighted scores - weights (one per factor) replace the compiled weights if passed"""
+        if weights is None:
+            return self.weighted_scores
+        return get_weighted_scores(self.unweighted_scores, weights)
+
+    def get_overall_scores(self, weights=None):
+        """Returns the overall scores shape (n_stores, n_bands)"""
+        if weights is None:
+            return self.overall_scores
+        return get_overall_scores(self.get_weighted_scores(weights))
+
+    def get_overall_scores_df(self, weights=None):
+        """Returns df of the overall scores - stores as rows and drive times as columns"""
+        return pd.DataFrame(self.get_overall_scores(weights), index=self.storenames, columns=self.iso_time_mins_list)
+
+    def get_score_table(self, storename, iso_time_mins, weights=None):
+        """Returns (df of the scored factors, overall score) for one store / drive time"""
+        s, b = self._get_position(storename, iso_time_mins)
+        weights = self.compiled_weightings.weights if weights is None else np.asarray(weights, dtype='float64')
+        weighted_scores = get_weighted_scores(self.unweighted_scores[s, b], weights)
+        scored = ~np.isnan(self.unweighted_scores[s, b])
+        df_scores = pd.DataFrame({
+            'Factor': np.array(self.compiled_weightings.display_names)[scored],
+            'Factor Value': self.factor_values[s, b][scored],
+            'Score (unweighted)': self.unweighted_scores[s, b][scored],
+            'Weight': [f'{round(weight * 100, 2)}%' for weight in weights[scored]],
+            'Weighted Score': weighted_scores[scored],
+        })
+        return df_scores, get_overall_scores(weighted_scores)
+
+
+def get_supply_factor_values(total_popn, competition_cla, competition_count):
+    """Returns {factor name: array} of the supply factors from arrays of catchment population
+    and competition totals - NaN where there is no competition or no population"""
+    has_competition = ~np.isnan(competition_count)
+    has_popn = ~np.isnan(total_popn) & (np.nan_to_num(total_popn) > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        people_per_store = np.where(has_competition & has_popn & (np.nan_to_num(competition_count) > 0),
+                                    np.round(total_popn / competition_count, 0), np.nan)
+        cla_per_person = np.where(has_competition & has_popn,
+                                  np.round(competition_cla / total_popn, 2), np.nan)
+    return {'People_per_store': people_per_store, 'CLA_per_person': cla_per_person}
+
+
+def get_competition_totals_by_store_band(gdf_competition, selected_storage_types):
+    """Returns df indexed on (storename, iso_time_mins) with store_cla and competition_count
+    of the selected storage types for every store / drive time - bands without competition are left out"""
+    _df = gdf_competition[gdf_competition.ss_type.isin(selected_storage_types)]
+    _df = pd.DataFrame({'storename': _df['storename'],
+                        'iso_time_mins': _df['iso_time_mins'],
+                        'store_cla': pd.to_numeric(_df['store_cla'], errors='coerce')})
+    _grouped = _df.groupby(['storename', 'iso_time_mins'])
+    return pd.DataFrame({'store_cla': _grouped['store_cla'].sum(),
+                         'competition_count': _grouped.size()})
+
+
+def build_factor_values(compiled_weightings, storenames, iso_time_mins_list, df_demo_summ, df_competition_summary):
+    """Returns the factor value array shape (n_stores, n_bands, n_factors)
+    df_demo_summ is indexed on (storename, iso_time_mins)
+    df_competition_summary is indexed on (storename, iso_time_mins) with store_cla and competition_count"""
+    idx = pd.MultiIndex.from_product([storenames, iso_time_mins_list], names=['storename', 'iso_time_mins'])
+    shape = (len(storenames), len(iso_time_mins_list))
+
+    df_demand = df_demo_summ.reindex(index=idx, columns=compiled_weightings.demand_factor_names)
+    total_popn = (df_demo_summ['Total_Popn'].reindex(idx).to_numpy(dtype='float64')
+                  if 'Total_Popn' in df_demo_summ.columns else np.full(len(idx), np.nan))
+    df_competition = df_competition_summary.reindex(idx)
+    supply_values = get_supply_factor_values(total_popn,
+                                             df_competition['store_cla'].to_numpy(dtype='float64'),
+                                             df_competition['competition_count'].to_numpy(dtype='float64'))
+
+    factor_values = np.empty(shape + (len(compiled_weightings.factor_names),), dtype='float64')
+    for i, (name, is_supply) in enumerate(zip(compiled_weightings.factor_names, compiled_weightings.is_supply)):
+        values = supply_values[name] if is_supply else df_demand[name].to_numpy(dtype='float64')
+        factor_values[..., i] = values.reshape(shape)
+    return factor_values
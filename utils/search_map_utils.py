@@ -1,8 +1,5 @@
 import streamlit as st
-from streamlit_folium import st_folium
 import pandas as pd
-import folium
-from folium.plugins import Geocoder
 from config.constants import (DEFAULT_MAP_CENTER_LATLON, DEFAULT_MAP_ZOOM_START,
                               MIN_SEARCH_MAP_ZOOM, MAX_SEARCH_MAP_ZOOM,
                               DEFAULT_TILE_LAYER)
@@ -22,8 +19,6 @@ def initialize_search_map_session_state():
         st.session_state.location_name_input = ""
     if 'clicked_location' not in st.session_state:
         st.session_state.clicked_location = None
-    if 'markers' not in st.session_state:
-        st.session_state.markers = folium.FeatureGroup(name="Selected Locations")
     if 'search_locations_df' not in st.session_state:
         st.session_state.search_locations_df = pd.DataFrame(columns=["lat", "lng", "name"])
     if 'tooltip_text' not in st.session_state:
@@ -40,6 +35,12 @@ def initialize_search_map_session_state():
 
 def create_search_map():
     """Creates the search map with marker at clicked location using FeatureGroup"""
+    # folium is imported here so initialising the session state does not load it
+    import folium
+    import folium.plugins
+
+    if 'markers' not in st.session_state:
+        st.session_state.markers = folium.FeatureGroup(name="Selected Locations")
 
     # Use stored map center/zoom if available, else defaults
     center = st.session_state.get('map_center', DEFAULT_MAP_CENTER_LATLON)
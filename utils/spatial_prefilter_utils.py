@@ -0,0 +1,81 @@
+import streamlit as st
+import numpy as np
+import shapely
+from shapely import STRtree
+
+from utils.load_save_data_files_utils import (get_planar_arrow_layer,
+                                              load_planar_layer_in_extent,
+                                              get_data_file_path,
+                                              PLANAR_LAYER_KEYS,
+                                              ZONE_BBOX_COLS)
+from utils.parquet_io_utils import get_parquet_num_rows
+from config.constants import DEBUG_PRINT
+
+"""This module prefilters the planar base layers before they are overlaid with the isochrones
+A catchment only touches a few hundred zones so only those are passed to gpd.overlay
+The zone bounding boxes are read straight from the memory-mapped layer so the candidates are found
+without decoding any geometry - only the candidate zones are decoded and tested against the iso boxes
+Layers not held in memory (not in PLANAR_LAYER_KEYS) are read from their spatially sorted parquet -
+only the row groups within the extent of the isos
+"""
+
+# Isos compared with the zone bounding boxes per numpy broadcast
+PREFILTER_ISO_BLOCK = 64
+
+
+def _get_iso_box_positions(gdf_candidates, iso_bounds):
+    """Returns the positions of the candidate zones that intersect any of the iso bounding boxes"""
+    iso_boxes = shapely.box(iso_bounds[:, 0], iso_bounds[:, 1], iso_bounds[:, 2], iso_bounds[:, 3])
+    # query returns [input_idx, tree_idx] pairs - we only need the unique input indices
+    input_idx, _ = STRtree(iso_boxes).query(gdf_candidates.geometry.values, predicate='intersects')
+    return np.unique(input_idx)
+
+
+def get_prefilter_indices(key, gdf_isos):
+    """Returns (sorted positional indices of the zones in the base layer that intersect the
+    bounding box of any of the isos, gdf of those zones)
+    gdf_isos must be in the same (planar) crs as the base layer"""
+    layer = get_planar_arrow_layer(key)
+    minx, miny, maxx, maxy = (layer.get_column_values(col) for col in ZONE_BBOX_COLS)
+    iso_bounds = gdf_isos.geometry.bounds.values
+
+    # Zones whose bounding box overlaps the bounding box of any iso - zones x isos broadcast a block of isos
+    # at a time so the comparison arrays stay small however many stores are processed
+    is_candidate = np.zeros(len(layer), dtype=bool)
+    minx, miny, maxx, maxy = minx[:, None], miny[:, None], maxx[:, None], maxy[:, None]
+    for start in range(0, len(iso_bounds), PREFILTER_ISO_BLOCK):
+        iso_minx, iso_miny, iso_maxx, iso_maxy = iso_bounds[start:start + PREFILTER_ISO_BLOCK].T
+        is_candidate |= ((minx <= iso_maxx) & (maxx >= iso_minx) & (miny <= iso_maxy) & (maxy >= iso_miny)).any(axis=1)
+    candidate_idx = np.flatnonzero(is_candidate)
+
+    # Only the candidates are decoded - kept if the zone itself intersects an iso bounding box
+    gdf_candidates = layer.take(candidate_idx)
+    kept = _get_iso_box_positions(gdf_candidates, iso_bounds)
+    return candidate_idx[kept], gdf_candidates.iloc[kept]
+
+
+def prefilter_layer_in_extent(key, gdf_isos):
+    """Returns (gdf of the zones that intersect the isos bounding boxes, total zones in the layer)
+    Reads only the part of the data file within the extent of the isos"""
+    gdf_candidates = load_planar_layer_in_extent(key, gdf_isos.total_bounds)
+    kept = _get_iso_box_positions(gdf_candidates, gdf_isos.geometry.bounds.values)
+    return gdf_candidates.iloc[kept], get_parquet_num_rows(get_data_file_path(key))
+
+
+def prefilter_base_layer(key, gdf_isos):
+    """Returns the subset of the planar base layer that intersects the isos bounding boxes
+    For the PLANAR_LAYER_KEYS the index is the zone position in the base layer
+    Records the number of zones kept in st.session_state.app_data['prefilter_counts']"""
+    if key in PLANAR_LAYER_KEYS:
+        _, gdf_subset = get_prefilter_indices(key, gdf_isos)
+        total_zones = len(get_planar_arrow_layer(key))
+    else:
+        gdf_subset, total_zones = prefilter_layer_in_extent(key, gdf_isos)
+
+    prefilter_counts = st.session_state.setdefault('app_data', {}).setdefault('prefilter_counts', {})
+    prefilter_counts[key] = {'total': total_zones, 'kept': len(gdf_subset)}
+
+    if DEBUG_PRINT:
+        print(f'****INFO prefilter_base_layer {key} kept {len(gdf_subset)} of {total_zones} zones')
+
+    return gdf_subset
@@ -0,0 +1,206 @@
+import streamlit as st
+import pandas as pd
+import geopandas as gpd
+
+from utils.ssdb_ingest_utils import read_ssdb_file, normalize_ssdb_chunk, SSDB_FILE_TYPES
+from utils.load_save_data_files_utils import get_gdf_ssdb_from_df
+from utils.competition_utils import (get_competition_ssdb_cols,
+                                     get_competition_isos_from_ss,
+                                     get_competition_in_isochrones,
+                                     sort_competition,
+                                     summarise_competition)
+from utils.store_band_views_utils import start_store_band_views_precompute
+from config.constants import DEBUG_PRINT, SSDB_ID_COL
+
+"""This module applies an SSDB update (stores added, changed or removed - keyed on SSDB_ID_COL)
+to the SSDB already loaded without re-uploading or reprocessing it
+Only the stores in the update are touched
+    ssdb        - the removed / changed rows are dropped and the added / changed rows appended
+    markers     - only the cached search map viewports holding an old or new location are dropped
+    competition - the rows of the removed / changed stores are dropped and only the added / changed
+                  stores are joined with the isos
+"""
+
+DELTA_ACTION_COL = 'delta_action'
+DELTA_ADD = 'add'
+DELTA_CHANGE = 'change'
+DELTA_REMOVE = 'remove'
+DELTA_ACTIONS = [DELTA_ADD, DELTA_CHANGE, DELTA_REMOVE]
+
+
+class SSDBDelta:
+    """The stores of an SSDB update
+    removed_ids - ids of the removed stores
+    gdf_upserts - validated rows of the added and changed stores"""
+
+    def __init__(self, removed_ids, gdf_upserts):
+        self.removed_ids = list(removed_ids)
+        self.gdf_upserts = gdf_upserts
+
+    @property
+    def upsert_ids(self):
+        return [] if self.gdf_upserts is None else self.gdf_upserts[SSDB_ID_COL].tolist()
+
+    @property
+    def touched_ids(self):
+        """Ids whose current rows are replaced or dropped"""
+        return list(dict.fromkeys(self.removed_ids + self.upsert_ids))
+
+    def __len__(self):
+        return len(self.touched_ids)
+
+
+def get_ssdb_delta(df_delta):
+    """Returns the SSDBDelta of a df with SSDB_ID_COL and DELTA_ACTION_COL
+    Added / changed rows need every SSDB column and are validated as in the ingest - invalid rows are dropped
+    Raises ValueError if any row has an unknown action - none of the update is applied"""
+    missing_cols = [col for col in [SSDB_ID_COL, DELTA_ACTION_COL] if col not in df_delta.columns]
+    if missing_cols:
+        raise KeyError(f'!!!!WARNING get_ssdb_delta missing cols: {missing_cols}')
+
+    df_delta = df_delta[df_delta[SSDB_ID_COL].notna()].copy()
+    df_delta[SSDB_ID_COL] = df_delta[SSDB_ID_COL].map(lambda value: str(value).strip())
+    actions = df_delta[DELTA_ACTION_COL].map(lambda value: str(value).strip().lower())
+    unknown_actions = sorted(set(actions) - set(DELTA_ACTIONS))
+    if unknown_actions:
+        raise ValueError(f'!!!!WARNING get_ssdb_delta unknown {DELTA_ACTION_COL} {unknown_actions} - use one of {DELTA_ACTIONS}')
+
+    removed_ids = df_delta.loc[actions == DELTA_REMOVE, SSDB_ID_COL].unique().tolist()
+
+    gdf_upserts = None
+    df_upserts = df_delta[actions.isin([DELTA_ADD, DELTA_CHANGE])].drop(columns=[DELTA_ACTION_COL])
+    # The last row of a store wins if it is in the update more than once
+    df_upserts = df_upserts.drop_duplicates(subset=[SSDB_ID_COL], keep='last')
+    if not df_upserts.empty:
+        df_upserts = normalize_ssdb_chunk(df_upserts)
+        if df_upserts is not None:
+            gdf_upserts = get_gdf_ssdb_from_df(df_upserts.reset_index(drop=True))
+
+    return SSDBDelta(removed_ids, gdf_upserts)
+
+
+def read_ssdb_delta(file_bytes, fname):
+    """Returns the SSDBDelta of an uploaded update file (any of SSDB_FILE_TYPES)"""
+    return get_ssdb_delta(read_ssdb_file(file_bytes, fname))
+
+
+def apply_delta_to_ssdb(gdf_ssdb, ssdb_delta):
+    """Returns the ssdb with the touched stores replaced by the added / changed rows
+    Also returns the gdf of the rows replaced or removed (their old locations)"""
+    is_touched = gdf_ssdb[SSDB_ID_COL].isin(ssdb_delta.touched_ids)
+    gdf_old = gdf_ssdb[is_touched]
+    gdf_kept = gdf_ssdb[~is_touched]
+    if ssdb_delta.gdf_upserts is None:
+        return gdf_kept.reset_index(drop=True), gdf_old
+    gdf_upserts = ssdb_delta.gdf_upserts.reindex(columns=gdf_ssdb.columns)
+    gdf_updated = gpd.GeoDataFrame(pd.concat([gdf_kept, gdf_upserts], ignore_index=True),
+                                   geometry=gdf_ssdb.geometry.name, crs=gdf_ssdb.crs)
+    return gdf_updated, gdf_old
+
+
+def _parse_bounds_key(bounds_key):
+    """Returns (south, west, north, east) from a search_ui bounds_to_key key - or None"""
+    try:
+        south, west, north, east = (float(value) for value in bounds_key.split('_'))
+    except ValueError:
+        return None
+    return south, west, north, east
+
+
+def invalidate_ssdb_marker_cache(gdf_points):
+    """Drops the cached search map viewports (st.session_state.cached_ssdb_markers) holding any of the points
+    Returns the number dropped"""
+    cached_ssdb_markers = st.session_state.get('cached_ssdb_markers')
+    if not cached_ssdb_markers or gdf_points.empty:
+        return 0
+    lats = gdf_points.geometry.y.values
+    lngs = gdf_points.geometry.x.values
+    bounds_keys_to_drop = []
+    for bounds_key in cached_ssdb_markers:
+        bounds = _parse_bounds_key(bounds_key)
+        # Keys that are not bounds are dropped to be safe
+        if bounds is None:
+            bounds_keys_to_drop.append(bounds_key)
+            continue
+        south, west, north, east = bounds
+        if ((lats >= south) & (lats <= north) & (lngs >= west) & (lngs <= east)).any():
+            bounds_keys_to_drop.append(bounds_key)
+    for bounds_key in bounds_keys_to_drop:
+        del cached_ssdb_markers[bounds_key]
+    return len(bounds_keys_to_drop)
+
+
+def apply_delta_to_competition(gdf_competition, ssdb_delta):
+    """Returns the competition with the rows of the touched stores dropped and the added / changed
+    stores joined with the isos in session_state - the other rows are kept as they are"""
+    if SSDB_ID_COL not in gdf_competition.columns:
+        raise KeyError(f'!!!!WARNING apply_delta_to_competition competition has no {SSDB_ID_COL} - process the locations again')
+    gdf_kept = gdf_competition[~gdf_competition[SSDB_ID_COL].isin(ssdb_delta.touched_ids)]
+    if ssdb_delta.gdf_upserts is None:
+        return gdf_kept
+
+    gdf_store_isos_4236 = get_competition_isos_from_ss()
+    if gdf_store_isos_4236 is None:
+        return gdf_kept
+    gdf_new = get_competition_in_isochrones(get_competition_ssdb_cols(ssdb_delta.gdf_upserts), gdf_store_isos_4236)
+    if gdf_new.empty:
+        return gdf_kept
+    gdf_updated = gpd.GeoDataFrame(pd.concat([gdf_kept, gdf_new]), geometry=gdf_competition.geometry.name,
+                                   crs=gdf_competition.crs)
+    return sort_competition(gdf_updated)
+
+
+def apply_ssdb_delta(ssdb_delta):
+    """Applies an SSDB update to st.session_state - the ssdb, the cached search map markers and
+    (if the locations have been processed) the competition, its summary and the precomputed views
+    Returns a dict of the counts changed"""
+    gdf_ssdb = st.session_state.data['ssdb']
+    if SSDB_ID_COL not in gdf_ssdb.columns:
+        raise KeyError(f'!!!!WARNING apply_ssdb_delta ssdb has no {SSDB_ID_COL} - upload the SSDB again')
+
+    gdf_ssdb_updated, gdf_old = apply_delta_to_ssdb(gdf_ssdb, ssdb_delta)
+    st.session_state.data['ssdb'] = gdf_ssdb_updated
+
+    gdf_touched_points = gdf_old[[gdf_old.geometry.name]]
+    if ssdb_delta.gdf_upserts is not None:
+        gdf_touched_points = pd.concat([gdf_touched_points,
+                                        ssdb_delta.gdf_upserts[[ssdb_delta.gdf_upserts.geometry.name]]])
+    delta_counts = {'stores': len(ssdb_delta),
+                    'ssdb_rows': len(gdf_ssdb_updated),
+                    'marker_views_dropped': invalidate_ssdb_marker_cache(gdf_touched_points)}
+
+    gdf_competition = st.session_state.get('gdf_competition')
+    if gdf_competition is not None:
+        gdf_competition_updated = apply_delta_to_competition(gdf_competition, ssdb_delta)
+        delta_counts['competition_rows'] = len(gdf_competition_updated)
+        # A new object - so anything built from the old competition is no longer used
+        st.session_state.gdf_competition = gdf_competition_updated
+        if st.session_state.get('competition_summary') is not None:
+            summarise_competition(gdf_competition_updated)
+        start_store_band_views_precompute()
+
+    if DEBUG_PRINT:
+        print(f'****INFO apply_ssdb_delta {delta_counts}')
+    return delta_counts
+
+
+def render_ssdb_delta_uploader():
+    """Renders the uploader of an SSDB update file and applies it"""
+    with st.expander('Update the SSDB (added / changed / removed stores)'):
+        # Set by the run that applied the update - shown once after its rerun
+        delta_counts = st.session_state.pop('ssdb_delta_counts', None)
+        if delta_counts is not None:
+            st.success(f"Updated {delta_counts['stores']} stores - the SSDB now has {delta_counts['ssdb_rows']:,} stores")
+        st.caption(f'One row per store with {SSDB_ID_COL} and {DELTA_ACTION_COL} ({", ".join(DELTA_ACTIONS)}) - '
+                   f'added and changed stores need every SSDB column')
+        uploaded_file = st.file_uploader('Choose an SSDB update file', type=SSDB_FILE_TYPES, key='ssdb_delta_uploader')
+        if uploaded_file is None or not st.button('Apply SSDB update'):
+            return
+        try:
+            ssdb_delta = read_ssdb_delta(uploaded_file.getvalue(), uploaded_file.name)
+            st.session_state.ssdb_delta_counts = apply_ssdb_delta(ssdb_delta)
+        except Exception as e:
+            print(f'!!!!WARNING render_ssdb_delta_uploader was not able to apply the update: {e}')
+            st.error(f'Unable to apply the SSDB update: {e}')
+            return
+        st.rerun()
@@ -0,0 +1,148 @@
+import streamlit as st
+import os
+import io
+import hashlib
+import pandas as pd
+
+from utils.load_save_data_files_utils import get_validated_df_ssdb, get_gdf_ssdb_from_df
+from config.constants import DEBUG_PRINT, SSDB_ID_COL
+
+"""This module is the ingest pipeline of an uploaded SSDB
+The upload (xlsx / xls, csv or parquet) is read, validated in chunks and saved as a parquet artifact
+keyed on the content hash of the uploaded bytes - the same SSDB uploaded again (by any user or
+after a restart) is read straight from the artifact without parsing or validating the upload
+Every store gets a stable SSDB_ID_COL - from the upload if it has one, otherwise from its address and city
+"""
+
+SSDB_CACHE_DIR = os.path.join('assets', 'cache', 'ssdb')
+
+# Bump when the validation / normalisation changes what is saved
+SSDB_INGEST_VERSION = 3
+
+SSDB_FILE_TYPES = ['xlsx', 'xls', 'csv', 'parquet']
+
+# Rows validated per chunk - progress is reported after each chunk
+SSDB_INGEST_CHUNK_ROWS = 2_000
+
+# Text columns held as strings stripped of surrounding whitespace so names match across uploads
+_SSDB_TEXT_COLS = ['storename', 'address', 'city', 'ss_type', 'area_unit']
+
+
+def get_ssdb_content_sha256(file_bytes):
+    """Returns the sha256 of the uploaded file content"""
+    return hashlib.sha256(file_bytes).hexdigest()
+
+
+def get_ssdb_artifact_path(content_sha):
+    return os.path.join(SSDB_CACHE_DIR, f'ssdb_v{SSDB_INGEST_VERSION}_{content_sha[:32]}.parquet')
+
+
+def read_ssdb_file(file_bytes, fname):
+    """Returns df of the uploaded SSDB - the reader is chosen on the file extension"""
+    file_type = os.path.splitext(fname)[1].lower().lstrip('.')
+    if file_type not in SSDB_FILE_TYPES:
+        raise ValueError(f'!!!!WARNING read_ssdb_file unsupported file type {file_type} - use one of {SSDB_FILE_TYPES}')
+    if file_type == 'csv':
+        return pd.read_csv(io.BytesIO(file_bytes))
+    if file_type == 'parquet':
+        return pd.read_parquet(io.BytesIO(file_bytes))
+    return pd.read_excel(io.BytesIO(file_bytes))
+
+
+def normalize_ssdb_chunk(df_chunk):
+    """Returns the validated chunk with the text columns as stripped strings - or None if no rows are valid"""
+    df_validated = get_validated_df_ssdb(df_chunk)
+    if df_validated is None:
+        return None
+    for col in _SSDB_TEXT_COLS:
+        df_validated[col] = df_validated[col].map(lambda value: str(value).strip() if pd.notna(value) else value)
+    return df_validated
+
+
+def get_derived_store_ids(df_ssdb):
+    """Returns a store id for each row from its address and city - not its name or location so a store
+    that is renamed or re-geocoded keeps its id
+    Stores at the same address get a -2, -3 ... suffix in storename order"""
+    _key = (df_ssdb['address'].fillna('') + '|' + df_ssdb['city'].fillna('')).str.lower()
+    store_ids = _key.map(lambda key: hashlib.sha1(key.encode()).hexdigest()[:16])
+    _name_order = df_ssdb['storename'].fillna('').str.lower().sort_values(kind='stable').index
+    repeat = store_ids.loc[_name_order].groupby(store_ids.loc[_name_order]).cumcount().reindex(store_ids.index)
+    return store_ids.where(repeat == 0, store_ids + '-' + (repeat + 1).astype(str))
+
+
+def add_store_ids(df_ssdb):
+    """Adds SSDB_ID_COL (as str) - ids in the upload are kept and only missing ids are derived"""
+    derived_ids = get_derived_store_ids(df_ssdb)
+    if SSDB_ID_COL in df_ssdb.columns:
+        uploaded_ids = df_ssdb[SSDB_ID_COL].map(lambda value: str(value).strip() if pd.notna(value) else None)
+        df_ssdb[SSDB_ID_COL] = uploaded_ids.where(uploaded_ids.notna(), derived_ids)
+    else:
+        df_ssdb[SSDB_ID_COL] = derived_ids
+    duplicated = df_ssdb[SSDB_ID_COL].duplicated()
+    if duplicated.any():
+        print(f'!!!!WARNING add_store_ids {duplicated.sum()} repeated {SSDB_ID_COL} - only the first is kept')
+        return df_ssdb[~duplicated].reset_index(drop=True)
+    return df_ssdb
+
+
+def validate_ssdb_in_chunks(df_ssdb, progress_callback=None):
+    """Validates and normalises the SSDB SSDB_INGEST_CHUNK_ROWS rows at a time
+    progress_callback(fraction, text) is called after each chunk
+    Returns the validated df or None"""
+    n_rows = len(df_ssdb)
+    df_chunks = []
+    for start in range(0, max(n_rows, 1), SSDB_INGEST_CHUNK_ROWS):
+        df_chunk = normalize_ssdb_chunk(df_ssdb.iloc[start:start + SSDB_INGEST_CHUNK_ROWS])
+        if df_chunk is not None:
+            df_chunks.append(df_chunk)
+        if progress_callback is not None:
+            done = min(start + SSDB_INGEST_CHUNK_ROWS, n_rows)
+            progress_callback(done / max(n_rows, 1), f'Validated {done:,} of {n_rows:,} rows')
+
+    if not df_chunks:
+        print(f'!!!!WARNING validate_ssdb_in_chunks no valid rows in the SSDB')
+        return None
+    return add_store_ids(pd.concat(df_chunks).reset_index(drop=True))
+
+
+def save_ssdb_artifact(df_validated, fpath):
+    """Saves the validated SSDB - written to a temporary file first so a partial file is never read"""
+    os.makedirs(SSDB_CACHE_DIR, exist_ok=True)
+    fpath_tmp = f'{fpath}.tmp'
+    df_validated.to_parquet(fpath_tmp, index=False, compression='zstd')
+    os.replace(fpath_tmp, fpath)
+
+
+@st.cache_data(show_spinner=False)
+def load_ssdb_artifact(fpath):
+    """Returns the df of a saved SSDB artifact - held in memory for every session"""
+    return pd.read_parquet(fpath)
+
+
+def ingest_ssdb(file_bytes, fname, progress_callback=None):
+    """Returns (gdf_ssdb or None, content sha) for an uploaded SSDB
+    An SSDB already ingested is read from its artifact - otherwise it is read, validated and saved"""
+    content_sha = get_ssdb_content_sha256(file_bytes)
+    fpath = get_ssdb_artifact_path(content_sha)
+
+    if os.path.exists(fpath):
+        if DEBUG_PRINT:
+            print(f'****INFO ingest_ssdb found artifact for {fname} {content_sha[:16]}')
+        if progress_callback is not None:
+            progress_callback(1.0, 'SSDB already ingested')
+        return get_gdf_ssdb_from_df(load_ssdb_artifact(fpath)), content_sha
+
+    df_ssdb = read_ssdb_file(file_bytes, fname)
+    df_validated = validate_ssdb_in_chunks(df_ssdb, progress_callback)
+    if df_validated is None:
+        return None, content_sha
+
+    try:
+        save_ssdb_artifact(df_validated, fpath)
+        if DEBUG_PRINT:
+            print(f'****INFO ingest_ssdb saved {df_validated.shape} from {fname} to {fpath}')
+    except Exception as e:
+        # The upload is still used - it will be validated again next time
+        print(f'!!!!WARNING ingest_ssdb could not save the artifact for {fname}: {e}')
+
+    return get_gdf_ssdb_from_df(df_validated), content_sha
@@ -0,0 +1,79 @@
+import os
+import sys
+import subprocess
+
+"""This module profiles the import cost of the app at startup
+The entry module is imported in a fresh interpreter with python -X importtime so nothing is already
+loaded - each module is charged the time of the imports it triggered (cumulative) and its own time
+Run from the repo root:
+    python -m utils.startup_profile_utils [entry module - default main] [rows - default 25]
+"""
+
+DEFAULT_ENTRY_MODULE = 'main'
+DEFAULT_PROFILE_ROWS = 25
+
+
+def parse_importtime(importtime_lines):
+    """Returns a list of dicts (module, depth, self_us, cumulative_us) from -X importtime stderr lines"""
+    module_times = []
+    for line in importtime_lines:
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, module = line.split('|', 2)
+        name = module.rstrip()
+        module_times.append({'module': name.strip(),
+                             'depth': (len(name) - len(name.lstrip())) // 2,
+                             'self_us': int(self_us.split(':')[-1]),
+                             'cumulative_us': int(cumulative_us)})
+    return module_times
+
+
+def profile_startup_imports(entry_module=DEFAULT_ENTRY_MODULE):
+    """Imports entry_module in a new interpreter and returns the parsed import times"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {entry_module}'],
+                            capture_output=True, text=True, cwd=os.getcwd())
+    if result.returncode != 0:
+        print(f'!!!!WARNING profile_startup_imports import {entry_module} failed:\n{result.stderr[-2_000:]}')
+    return parse_importtime(result.stderr.splitlines())
+
+
+def get_package_import_times(module_times):
+    """Returns {top level package: cumulative us} - the time of the first import of each package
+    (the imports it triggers included) - sorted slowest first"""
+    min_depths = {}
+    for module_time in module_times:
+        package = module_time['module'].split('.')[0]
+        min_depths[package] = min(min_depths.get(package, module_time['depth']), module_time['depth'])
+
+    # Only the outermost imports of a package are counted - they include its submodules
+    package_times = {}
+    for module_time in module_times:
+        package = module_time['module'].split('.')[0]
+        if module_time['depth'] == min_depths[package]:
+            package_times[package] = package_times.get(package, 0) + module_time['cumulative_us']
+    return dict(sorted(package_times.items(), key=lambda item: -item[1]))
+
+
+def print_startup_profile(entry_module=DEFAULT_ENTRY_MODULE, rows=DEFAULT_PROFILE_ROWS):
+    """Prints the total import time and the slowest packages and app modules"""
+    module_times = profile_startup_imports(entry_module)
+    total_us = sum(module_time['cumulative_us'] for module_time in module_times if module_time['depth'] == 0)
+    print(f'****INFO startup imports of {entry_module}: {total_us / 1_000:,.0f} ms '
+          f'({len(module_times)} modules)')
+
+    print(f'\n{"package":<40}{"ms":>10}')
+    for package, cumulative_us in list(get_package_import_times(module_times).items())[:rows]:
+        print(f'{package:<40}{cumulative_us / 1_000:>10,.1f}')
+
+    app_packages = ('main', 'config', 'controllers', 'managers', 'ui', 'utils')
+    app_times = [module_time for module_time in module_times
+                 if module_time['module'].split('.')[0] in app_packages]
+    print(f'\n{"app module":<50}{"self ms":>10}{"cumulative ms":>15}')
+    for module_time in sorted(app_times, key=lambda _time: -_time['cumulative_us'])[:rows]:
+        print(f'{module_time["module"]:<50}{module_time["self_us"] / 1_000:>10,.1f}'
+              f'{module_time["cumulative_us"] / 1_000:>15,.1f}')
+
+
+if __name__ == '__main__':
+    print_startup_profile(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_ENTRY_MODULE,
+                          int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_PROFILE_ROWS)
@@ -0,0 +1,148 @@
+import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.score_engine_utils import ScoreCube, build_factor_values, get_competition_totals_by_store_band
+
+from config.constants import DEBUG_PRINT, ISO_TIME_MINS
+
+"""This module precomputes the outputs of every (store, drive time) once the locations are processed
+The iso and competition slices, competition totals and score tables are built in a background thread
+while the first view is rendered - switching store, drive time or storage type is then a lookup
+The views hold the session_state objects they were built from and are only used while those
+are unchanged (eg deleting a competitor replaces gdf_competition so the views are not used)
+"""
+
+_GROUPBY_COLS = ['storename', 'iso_time_mins']
+
+
+class _StorageTypeViews:
+    """Competition slices, totals and score tables of every store / drive time for one storage type selection"""
+
+    def __init__(self, store_band_views, selected_storage_types):
+        gdf_competition = store_band_views.gdf_competition
+        gdf_selected = gdf_competition[gdf_competition.ss_type.isin(selected_storage_types)]
+        self.competition_slices = {key: gdf for key, gdf in gdf_selected.groupby(_GROUPBY_COLS)}
+        self.df_competition_totals = get_competition_totals_by_store_band(gdf_competition, selected_storage_types)
+
+        self.score_cube = None
+        self.score_tables = {}
+        if store_band_views.compiled_weightings is not None and store_band_views.df_demo_summ is not None:
+            factor_values = build_factor_values(store_band_views.compiled_weightings,
+                                                store_band_views.storenames,
+                                                store_band_views.iso_time_mins_list,
+                                                store_band_views.df_demo_summ,
+                                                self.df_competition_totals)
+            self.score_cube = ScoreCube(store_band_views.compiled_weightings, store_band_views.storenames,
+                                        store_band_views.iso_time_mins_list, factor_values)
+            self.score_tables = {(storename, iso_time_mins): self.score_cube.get_score_table(storename, iso_time_mins)
+                                 for storename in self.score_cube.storenames
+                                 for iso_time_mins in self.score_cube.iso_time_mins_list}
+
+
+class StoreBandViews:
+    """Precomputed outputs of every store / drive time
+    The slices are shared - callers get a copy so they can modify it"""
+
+    def __init__(self, gdf_isos, gdf_competition, df_demo_summ, compiled_weightings, storenames,
+                 iso_time_mins_list=ISO_TIME_MINS):
+        self.gdf_isos = gdf_isos
+        self.gdf_competition = gdf_competition
+        self.df_demo_summ = df_demo_summ
+        self.compiled_weightings = compiled_weightings
+        self.storenames = list(storenames)
+        self.iso_time_mins_list = list(iso_time_mins_list)
+        self.iso_slices = {key: gdf.iloc[0:1] for key, gdf in gdf_isos.groupby(_GROUPBY_COLS)}
+        self._by_storage_types = {}
+
+    def is_current(self, gdf_isos, gdf_competition, df_demo_summ, compiled_weightings):
+        """True if the views were built from these session_state objects"""
+        return (self.gdf_isos is gdf_isos
+                and self.gdf_competition is gdf_competition
+                and self.df_demo_summ is df_demo_summ
+                and self.compiled_weightings is compiled_weightings)
+
+    def get_storage_type_views(self, selected_storage_types):
+        """Returns the views for a storage type selection - a new selection is built on first use"""
+        key = tuple(sorted(selected_storage_types))
+        if key not in self._by_storage_types:
+            self._by_storage_types[key] = _StorageTypeViews(self, selected_storage_types)
+        return self._by_storage_types[key]
+
+    def get_output_iso(self, storename, iso_time_mins):
+        """Returns one row gdf or None"""
+        gdf = self.iso_slices.get((storename, iso_time_mins))
+        return None if gdf is None else gdf.copy()
+
+    def get_output_competition(self, storename, iso_time_mins, selected_storage_types):
+        """Returns gdf of the competition or None"""
+        gdf = self.get_storage_type_views(selected_storage_types).competition_slices.get((storename, iso_time_mins))
+        return None if gdf is None else gdf.copy()
+
+    def get_score_table(self, storename, iso_time_mins, selected_storage_types):
+        """Returns (df of the scored factors, overall score) or None"""
+        return self.get_storage_type_views(selected_storage_types).score_tables.get((storename, iso_time_mins))
+
+    def get_score_cube(self, selected_storage_types):
+        """Returns the ScoreCube of every store / drive time or None"""
+        return self.get_storage_type_views(selected_storage_types).score_cube
+
+
+def build_store_band_views(gdf_isos, gdf_competition, df_demo_summ, compiled_weightings, storenames,
+                           selected_storage_types):
+    """Builds the views and the storage type selection shown first
+    Does not touch session_state so can be run in a background thread"""
+    store_band_views = StoreBandViews(gdf_isos, gdf_competition, df_demo_summ, compiled_weightings, storenames)
+    store_band_views.get_storage_type_views(selected_storage_types)
+    if DEBUG_PRINT:
+        print(f'****INFO build_store_band_views built {len(store_band_views.iso_slices)} store / drive time views')
+    return store_band_views
+
+
+@st.cache_resource(show_spinner=False)
+def get_views_thread_pool():
+    """Returns the thread pool shared by all sessions for precomputing the views"""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix='store_band_views')
+
+
+def start_store_band_views_precompute():
+    """Submits build_store_band_views for the processed locations in session_state
+    The future is held in st.session_state.store_band_views_future"""
+    gdf_isos = st.session_state.get('gdf_isos')
+    gdf_competition = st.session_state.get('gdf_competition')
+    if gdf_isos is None or gdf_competition is None:
+        print(f'!!!!WARNING start_store_band_views_precompute missing gdf_isos or gdf_competition')
+        return
+
+    # Before the sidebar has rendered every storage type is selected
+    selected_storage_types = (st.session_state.get('selected_storage_types')
+                              or gdf_competition['ss_type'].unique().tolist())
+
+    st.session_state.store_band_views_future = get_views_thread_pool().submit(
+        build_store_band_views,
+        gdf_isos,
+        gdf_competition,
+        st.session_state.get('df_demo_summ'),
+        st.session_state.get('compiled_weightings'),
+        st.session_state.get('selected_storenames', []),
+        selected_storage_types)
+
+
+def get_store_band_views():
+    """Returns the precomputed views if they are ready and still match session_state - otherwise None
+    Never waits for the background thread"""
+    future = st.session_state.get('store_band_views_future')
+    if future is None or not future.done():
+        return None
+    try:
+        store_band_views = future.result()
+    except Exception as e:
+        print(f'!!!!WARNING get_store_band_views precompute failed: {e}')
+        st.session_state.store_band_views_future = None
+        return None
+
+    if not store_band_views.is_current(st.session_state.get('gdf_isos'),
+                                       st.session_state.get('gdf_competition'),
+                                       st.session_state.get('df_demo_summ'),
+                                       st.session_state.get('compiled_weightings')):
+        return None
+    return store_band_views
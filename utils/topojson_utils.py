@@ -0,0 +1,150 @@
+import json
+import numpy as np
+import shapely
+
+from config.constants import TOPOJSON_QUANTIZATION
+
+"""This module encodes map layers as TopoJSON for a smaller payload to the browser
+Coordinates are quantized to integers on a TOPOJSON_QUANTIZATION grid over the layer extent
+Rings are cut at junctions (points where neighbouring boundaries meet or part) so a border
+shared by two adjacent overlay pieces is sent once as an arc referenced by both
+Arcs are delta encoded as in the TopoJSON spec and rendered through folium.TopoJson
+"""
+
+
+def _quantize_geoms(geoms, quantization):
+    """Returns (transform, quantized integer coords for every ring of every polygon part)
+    Each geom is a list of polygons, each polygon a list of rings without the closing point"""
+    minx, miny, maxx, maxy = shapely.total_bounds(geoms)
+    kx = (maxx - minx) / (quantization - 1) if maxx > minx else 1.0
+    ky = (maxy - miny) / (quantization - 1) if maxy > miny else 1.0
+    transform = {'scale': [kx, ky], 'translate': [minx, miny]}
+
+    quantized_geoms = []
+    for geom in geoms:
+        polygons = []
+        # Overlay pieces can be collections holding slivers of line / point - only polygons are kept
+        parts = [] if geom is None or geom.is_empty else shapely.get_parts(geom)
+        for polygon in parts:
+            if polygon.geom_type != 'Polygon':
+                continue
+            rings = []
+            for ring in [polygon.exterior, *polygon.interiors]:
+                coords = np.asarray(ring.coords)[:-1]
+                q = np.column_stack([np.round((coords[:, 0] - minx) / kx),
+                                     np.round((coords[:, 1] - miny) / ky)]).astype('int64')
+                # Quantizing can collapse neighbouring points onto the same cell
+                keep = np.any(q != np.roll(q, 1, axis=0), axis=1)
+                q = q[keep]
+                if len(q) >= 3:
+                    rings.append([tuple(p) for p in q.tolist()])
+            # A polygon whose exterior collapsed is dropped
+            if rings and len(rings[0]) >= 3:
+                polygons.append(rings)
+        quantized_geoms.append(polygons)
+    return transform, quantized_geoms
+
+
+def _find_junctions(quantized_geoms):
+    """Returns the set of points whose neighbouring points differ between the rings that share them"""
+    neighbours = {}
+    junctions = set()
+    for polygons in quantized_geoms:
+        for rings in polygons:
+            for ring in rings:
+                n = len(ring)
+                for i, point in enumerate(ring):
+                    pair = frozenset((ring[i - 1], ring[(i + 1) % n]))
+                    seen = neighbours.get(point)
+                    if seen is None:
+                        neighbours[point] = pair
+                    elif seen != pair:
+                        junctions.add(point)
+    return junctions
+
+
+class _ArcIndex:
+    """Deduplicates arcs - an arc already held in reverse is referenced as ~index"""
+
+    def __init__(self):
+        self.arcs = []
+        self._index = {}
+
+    def get_arc_ref(self, points):
+        key = tuple(points)
+        if key in self._index:
+            return self._index[key]
+        reversed_key = key[::-1]
+        if reversed_key in self._index:
+            return ~self._index[reversed_key]
+        self._index[key] = len(self.arcs)
+        self.arcs.append(points)
+        return self._index[key]
+
+
+def _ring_to_arc_refs(ring, junctions, arc_index):
+    """Cuts a ring at its junctions and returns the list of arc references"""
+    cut_idx = [i for i, point in enumerate(ring) if point in junctions]
+    if not cut_idx:
+        # Whole ring is one arc - start from the smallest point so a ring shared
+        # in full by a neighbour (eg a hole) produces the same arc
+        start = ring.index(min(ring))
+        rotated = ring[start:] + ring[:start]
+        return [arc_index.get_arc_ref(rotated + [rotated[0]])]
+
+    rotated = ring[cut_idx[0]:] + ring[:cut_idx[0]]
+    offset = cut_idx[0]
+    cuts = [i - offset for i in cut_idx] + [len(ring)]
+    closed = rotated + [rotated[0]]
+    return [arc_index.get_arc_ref(closed[a:b + 1]) for a, b in zip(cuts[:-1], cuts[1:])]
+
+
+def _delta_encode(points):
+    x0, y0 = points[0]
+    encoded = [[x0, y0]]
+    for x, y in points[1:]:
+        encoded.append([x - x0, y - y0])
+        x0, y0 = x, y
+    return encoded
+
+
+def encode_topojson(geoms, properties, object_name, quantization=TOPOJSON_QUANTIZATION):
+    """Returns a TopoJSON topology dict for 4326 (Multi)Polygon geoms with one properties dict per geom
+    The geometries are held in objects[object_name] as a GeometryCollection"""
+    geoms = np.asarray(geoms, dtype=object)
+    transform, quantized_geoms = _quantize_geoms(geoms, quantization)
+    junctions = _find_junctions(quantized_geoms)
+    arc_index = _ArcIndex()
+
+    geometries = []
+    for i, (polygons, feature_properties) in enumerate(zip(quantized_geoms, properties)):
+        polygon_arcs = [[_ring_to_arc_refs(ring, junctions, arc_index) for ring in rings]
+                        for rings in polygons]
+        if not polygon_arcs:
+            geometry = {'type': None}
+        elif len(polygon_arcs) == 1:
+            geometry = {'type': 'Polygon', 'arcs': polygon_arcs[0]}
+        else:
+            geometry = {'type': 'MultiPolygon', 'arcs': polygon_arcs}
+        geometry['id'] = str(i)
+        geometry['properties'] = feature_properties
+        geometries.append(geometry)
+
+    return {'type': 'Topology',
+            'transform': transform,
+            'objects': {object_name: {'type': 'GeometryCollection', 'geometries': geometries}},
+            'arcs': [_delta_encode(arc) for arc in arc_index.arcs]}
+
+
+def get_payload_bytes(data):
+    """Returns the size in bytes of data serialized as compact JSON - strings are measured as is"""
+    if isinstance(data, str):
+        return len(data.encode())
+    return len(json.dumps(data, separators=(',', ':')).encode())
+
+
+def format_payload_comparison(geojson_bytes, topojson_bytes):
+    """Returns a one line comparison of the GeoJSON and TopoJSON payload sizes"""
+    saving_perc = (1 - topojson_bytes / geojson_bytes) * 100 if geojson_bytes else 0
+    return (f'Map layer payload: TopoJSON {topojson_bytes / 1e3:,.0f} kB vs GeoJSON '
+            f'{geojson_bytes / 1e3:,.0f} kB ({saving_perc:.0f}% smaller)')